@@ -0,0 +1,285 @@
+"""
+Benchmark del pipeline de extracción de liquidaciones.
+
+Genera liquidaciones sintéticas deterministas con el mismo formato que espera
+`extraer_liquidacion_desde_pagina` y mide cada etapa por separado. Los
+resultados se escriben en JSON para comparar entre commits:
+
+    python benchmark.py                         # niveles 10, 100, 1000, 10000
+    python benchmark.py --niveles 10 100 --pdf  # incluye extracción de texto desde PDF
+"""
+import argparse
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import pdfplumber
+
+import untitled0 as app
+
+NIVELES = [10, 100, 1000, 10000]
+MESES = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio",
+         "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
+MESES_POR_EMPLEADO = 120  # 10 años de historia por empleado
+ANIO_INICIAL = 2015
+
+# --- GENERADOR SINTÉTICO ---
+def formatear_monto(monto: int) -> str:
+    """Formato chileno: $ 1.234.567"""
+    return "$ " + f"{monto:,}".replace(",", ".")
+
+def generar_texto_pagina(indice: int, semilla: int = 0) -> str:
+    """
+    Genera el texto de una página de liquidación. La misma (indice, semilla)
+    produce siempre el mismo texto; cada bloque de 120 páginas es un empleado.
+    """
+    rng = random.Random(semilla * 1_000_003 + indice)
+    empleado, mes = divmod(indice, MESES_POR_EMPLEADO)
+    anio = ANIO_INICIAL + mes // 12
+    
+    sueldo_base = rng.randrange(600_000, 3_000_000, 1000)
+    afectos = [
+        ("Sueldo Base", sueldo_base),
+        ("Gratificación Legal", min(sueldo_base // 4, 209_396)),
+        ("Horas Extra", rng.choice([0, rng.randint(20_000, 150_000)])),
+        ("Bono Producción", rng.randint(0, 300_000)),
+    ]
+    exentos = [
+        ("Asignación Movilización", rng.randint(20_000, 60_000)),
+        ("Asignación Colación", rng.randint(20_000, 60_000)),
+    ]
+    total_afectos = sum(m for _, m in afectos)
+    total_exentos = sum(m for _, m in exentos)
+    
+    legales = [
+        ("Cotización AFP Modelo", total_afectos * 1058 // 10_000),
+        ("Cotización Salud Isapre Colmena", total_afectos * 7 // 100),
+        ("Seguro de Cesantía", total_afectos * 6 // 1000),
+        ("Impuesto Único", rng.randint(0, 120_000)),
+    ]
+    otros = [
+        ("Préstamo Caja Los Andes", rng.randint(10_000, 80_000)),
+        ("Cuota Sindical", rng.randint(5_000, 9_000)),
+        ("Seguro Complementario", rng.choice([0, rng.randint(8_000, 25_000)])),
+    ]
+    total_legales = sum(m for _, m in legales)
+    total_otros = sum(m for _, m in otros)
+    liquido = total_afectos + total_exentos - total_legales - total_otros
+    
+    lineas = [
+        "EMPRESA DE SERVICIOS USM S.A.",
+        f"Liquidación de sueldo {MESES[mes % 12]} {anio}",
+        f"Nombre: Empleado {empleado + 1:05d}",
+        f"RUT: {10_000_000 + empleado * 7919:,}-{empleado % 10}".replace(",", "."),
+        f"Días trabajados: {30 - rng.choice([0, 0, 0, 1, 2])}",
+        f"Días licencia: {rng.choice([0, 0, 0, 1])}",
+        "Días Ausencia: 0",
+        f"Días vacaciones: {rng.choice([0, 0, 5])}",
+        "Horas base: 44",
+        f"Sueldo base: {formatear_monto(sueldo_base)}",
+        "HABERES AFECTOS",
+    ]
+    # Los montos en cero se omiten, igual que en las liquidaciones reales
+    lineas += [f"{n} {formatear_monto(m)}" for n, m in afectos if m]
+    lineas += [f"Total Haberes Afectos: {formatear_monto(total_afectos)}", "HABERES EXENTOS"]
+    lineas += [f"{n} {formatear_monto(m)}" for n, m in exentos if m]
+    lineas += [f"Total Haberes Exentos: {formatear_monto(total_exentos)}", "DESCUENTOS LEGALES"]
+    lineas += [f"{n} {formatear_monto(m)}" for n, m in legales if m]
+    lineas += [f"Total Descuentos Legales: {formatear_monto(total_legales)}", "OTROS DESCUENTOS"]
+    lineas += [f"{n} {formatear_monto(m)}" for n, m in otros if m]
+    lineas += [
+        f"Total Otros Descuentos: {formatear_monto(total_otros)}",
+        f"Total Imponible {formatear_monto(total_afectos)}",
+        f"Total Tributable {formatear_monto(total_afectos - total_legales)}",
+        f"Líquido a pagar: {formatear_monto(liquido)}",
+    ]
+    return "\n".join(lineas)
+
+def generar_pdf(textos: List[str], xobjetos: bool = False) -> bytes:
+    """
+    Arma un PDF mínimo (Helvetica, WinAnsiEncoding) con una página por texto y
+    una línea de texto por renglón, suficiente para que pdfplumber lo lea. Con
+    `xobjetos`, cada página dibuja su texto desde un Form XObject (`/X0 Do`) y
+    todas comparten el mismo content stream, como en algunos generadores de PDF.
+    """
+    objetos: List[bytes] = []
+    
+    def agregar(contenido: bytes) -> int:
+        objetos.append(contenido)
+        return len(objetos)
+    
+    catalogo = agregar(b"")
+    paginas = agregar(b"")
+    fuente = agregar(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    
+    hijos = []
+    for texto in textos:
+        operaciones = ["BT", "/F1 10 Tf", "14 TL", "50 800 Td"]
+        for linea in texto.split("\n"):
+            escapada = linea.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            operaciones.append(f"({escapada}) Tj T*")
+        operaciones.append("ET")
+        flujo = "\n".join(operaciones).encode("cp1252")
+        
+        recursos = f"/Font << /F1 {fuente} 0 R >>"
+        if xobjetos:
+            formulario = agregar(
+                f"<< /Type /XObject /Subtype /Form /BBox [0 0 595 842] /Resources << {recursos} >> "
+                f"/Length {len(flujo)} >>\nstream\n".encode() + flujo + b"\nendstream"
+            )
+            recursos = f"/XObject << /X0 {formulario} 0 R >>"
+            flujo = b"q /X0 Do Q"
+        
+        contenido = agregar(b"<< /Length %d >>\nstream\n" % len(flujo) + flujo + b"\nendstream")
+        hijos.append(agregar(
+            f"<< /Type /Page /Parent {paginas} 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << {recursos} >> /Contents {contenido} 0 R >>".encode()
+        ))
+    
+    objetos[catalogo - 1] = f"<< /Type /Catalog /Pages {paginas} 0 R >>".encode()
+    objetos[paginas - 1] = (
+        f"<< /Type /Pages /Kids [{' '.join(f'{h} 0 R' for h in hijos)}] /Count {len(hijos)} >>".encode()
+    )
+    
+    salida = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for numero, objeto in enumerate(objetos, 1):
+        offsets.append(len(salida))
+        salida += f"{numero} 0 obj\n".encode() + objeto + b"\nendobj\n"
+    
+    inicio_xref = len(salida)
+    salida += f"xref\n0 {len(objetos) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        salida += f"{offset:010d} 00000 n \n".encode()
+    salida += (
+        f"trailer\n<< /Size {len(objetos) + 1} /Root {catalogo} 0 R >>\n"
+        f"startxref\n{inicio_xref}\n%%EOF\n"
+    ).encode()
+    return bytes(salida)
+
+# --- MEDICIÓN ---
+def medir(funcion: Callable[[], object], n_items: int, repeticiones: int) -> Dict:
+    """Ejecuta `funcion` varias veces y reporta el mejor tiempo."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    
+    mejor = min(tiempos)
+    return {
+        'segundos': mejor,
+        'segundos_mediana': sorted(tiempos)[len(tiempos) // 2],
+        'items': n_items,
+        'us_por_item': mejor / n_items * 1e6 if n_items else 0.0,
+        'items_por_segundo': n_items / mejor if mejor > 0 else 0.0
+    }
+
+def _extraer_textos_pdf(datos: bytes) -> List[str]:
+    with pdfplumber.open(io.BytesIO(datos)) as pdf:
+        return [pagina.extract_text() or "" for pagina in pdf.pages]
+
+def _extraer_textos_backend(datos: bytes, nombre: str) -> List[str]:
+    with app.abrir_backend_texto(datos, nombre) as backend:
+        return [backend.texto(i + 1) for i in range(app.contar_paginas(datos))]
+
+def _prefiltrar_pdf(datos: bytes) -> List[bool]:
+    with pdfplumber.open(io.BytesIO(datos)) as pdf:
+        return [app.parece_liquidacion(pagina) for pagina in pdf.pages]
+
+def _agregacion_dashboard(almacen, anio: str) -> None:
+    """Lo que leen las vistas Anual y Mensual: los agregados materializados del almacén."""
+    almacen.resumen_anual()
+    almacen.resumen_mensual(None, anio)
+    almacen.top_otros_descuentos(None, anio)
+
+def ejecutar_nivel(n_paginas: int, semilla: int, repeticiones: int, con_pdf: bool) -> Dict:
+    textos = [generar_texto_pagina(i, semilla) for i in range(n_paginas)]
+    lineas = [[l.strip() for l in t.split('\n') if l.strip()] for t in textos]
+    liquidaciones = [app.extraer_liquidacion_desde_pagina(t) for t in textos]
+    if not all(liquidaciones):
+        raise RuntimeError("El generador produjo páginas que el extractor no reconoce")
+    nombres_legales = [d.nombre for liq in liquidaciones for d in liq.descuentos_items
+                       if d.tipo == 'descuento_legal']
+    
+    etapas = {}
+    if con_pdf:
+        datos_pdf = generar_pdf(textos)
+        etapas['extraccion_texto'] = medir(lambda: _extraer_textos_pdf(datos_pdf), n_paginas, repeticiones)
+        etapas['extraccion_texto_pdfium'] = medir(
+            lambda: _extraer_textos_backend(datos_pdf, 'pdfium'), n_paginas, repeticiones)
+        etapas['prefiltro_cabecera'] = medir(lambda: _prefiltrar_pdf(datos_pdf), n_paginas, repeticiones)
+    
+    etapas['extraer_liquidacion_desde_pagina'] = medir(
+        lambda: [app.extraer_liquidacion_desde_pagina(t) for t in textos], n_paginas, repeticiones)
+    etapas['extraer_cabecera'] = medir(
+        lambda: [app.extraer_cabecera(t) for t in textos], n_paginas, repeticiones)
+    # tokenizar_secciones reemplaza a las cuatro llamadas a extraer_items_seccion
+    etapas['tokenizar_secciones'] = medir(
+        lambda: [app.tokenizar_secciones(l) for l in lineas], n_paginas, repeticiones)
+    etapas['clasificar_descuento'] = medir(
+        lambda: [app.clasificar_descuento(n) for n in nombres_legales], len(nombres_legales), repeticiones)
+    etapas['validar_liquidacion'] = medir(
+        lambda: [app.validar_liquidacion(l.haberes_items, l.haberes_afectos_total, l.haberes_exentos_total,
+                                         l.descuentos_items, l.descuentos_legales_total,
+                                         l.otros_descuentos_total)
+                 for l in liquidaciones], n_paginas, repeticiones)
+    etapas['calcular_metricas_mes'] = medir(
+        lambda: [app.calcular_metricas_mes(l) for l in liquidaciones], n_paginas, repeticiones)
+    # Guardar mantiene los agregados; las vistas luego solo los leen
+    etapas['guardar_almacen'] = medir(
+        lambda: app.AlmacenLiquidaciones(':memory:').guardar(liquidaciones), n_paginas, repeticiones)
+    almacen = app.AlmacenLiquidaciones(':memory:')
+    almacen.guardar(liquidaciones)
+    ultimo_anio = max(l.periodo for l in liquidaciones)[:4]
+    etapas['agregacion_dashboard'] = medir(
+        lambda: _agregacion_dashboard(almacen, ultimo_anio), n_paginas, repeticiones)
+    etapas['series_tiempo'] = medir(
+        lambda: app.construir_series(almacen.resumen_mensual(None)), n_paginas, repeticiones)
+    
+    return {'paginas': n_paginas, 'etapas': etapas}
+
+def _commit_actual() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark por etapas del pipeline de liquidaciones.")
+    parser.add_argument("--niveles", type=int, nargs="+", default=NIVELES, help="Cantidades de páginas a medir")
+    parser.add_argument("--repeticiones", type=int, default=3, help="Repeticiones por etapa (se reporta la mejor)")
+    parser.add_argument("--semilla", type=int, default=0, help="Semilla del generador sintético")
+    parser.add_argument("--pdf", action="store_true", help="Medir también la extracción de texto desde un PDF")
+    parser.add_argument("--salida", default="benchmark_resultados.json", help="Archivo JSON de resultados")
+    args = parser.parse_args(argv)
+    
+    resultados = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit_actual(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'semilla': args.semilla,
+        'niveles': []
+    }
+    
+    for n in args.niveles:
+        nivel = ejecutar_nivel(n, args.semilla, args.repeticiones, args.pdf)
+        resultados['niveles'].append(nivel)
+        for etapa, medicion in nivel['etapas'].items():
+            print(f"{n:>6} págs  {etapa:<34} {medicion['segundos'] * 1000:>10.2f} ms"
+                  f"  {medicion['us_por_item']:>9.1f} µs/item", file=sys.stderr)
+    
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump(resultados, f, ensure_ascii=False, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+from dataclasses import replace
+
+import benchmark
+import untitled0 as app
+
+def _liquidaciones(ruts):
+    """Una liquidación por RUT, todas del mismo periodo y con montos distintos."""
+    return [
+        replace(app.extraer_liquidacion_desde_pagina(benchmark.generar_texto_pagina(i)), rut=rut, periodo="2015-01")
+        for i, rut in enumerate(ruts)
+    ]
+
+def test_resumen_anual_del_rut_vacio_no_es_el_de_la_empresa():
+    almacen = app.AlmacenLiquidaciones(":memory:")
+    liquidaciones = _liquidaciones(["", "11111111-1", "22222222-2"])
+    almacen.guardar(liquidaciones)
+    
+    sin_rut = almacen.resumen_anual("")
+    empresa = almacen.resumen_anual(None)
+    
+    assert sin_rut['liquidaciones'].tolist() == [1]
+    assert sin_rut['liquido'].tolist() == [liquidaciones[0].liquido_a_pagar]
+    assert empresa['liquidaciones'].tolist() == [3]
+    assert empresa['liquido'].tolist() == [sum(l.liquido_a_pagar for l in liquidaciones)]
+
+def test_empleados_sin_rut_del_mismo_mes_no_se_pisan():
+    almacen = app.AlmacenLiquidaciones(":memory:")
+    paginas = [
+        benchmark.generar_texto_pagina(0).replace("RUT: 10.000.000-0\n", "").replace("Empleado 00001", nombre)
+        for nombre in ("Juan Pérez", "María Soto")
+    ]
+    almacen.guardar([app.extraer_liquidacion_desde_pagina(p) for p in paginas])
+    
+    assert sorted(liq.nombre for liq in almacen.cargar()) == ["Juan Pérez", "María Soto"]
+
+def test_version_solo_cambia_si_se_escriben_liquidaciones():
+    almacen = app.AlmacenLiquidaciones(":memory:")
+    liquidaciones = _liquidaciones(["11111111-1", "22222222-2"])
+    almacen.guardar(liquidaciones, [("h1", *liquidaciones[0].clave)])
+    version = almacen.version()
+    
+    # Reingesta sin nada nuevo: tramos solo con páginas sin cambios u omitidas
+    almacen.guardar([], [])
+    almacen.guardar([], [("portada", None, None)])
+    almacen.eliminar([("99999999-9", "2015-01")])
+    assert almacen.version() == version
+    
+    almacen.guardar(liquidaciones[:1])
+    assert almacen.version() != version
+    version = almacen.version()
+    almacen.eliminar([liquidaciones[1].clave])
+    assert almacen.version() != version
+
+def test_lecturas_de_la_empresa_por_periodo_usan_indice():
+    almacen = app.AlmacenLiquidaciones(":memory:")
+    consultas = [
+        "SELECT nombre, SUM(monto) FROM descuentos WHERE categoria = 'OTRO' "
+        "AND periodo BETWEEN '2015-01' AND '2015-12' GROUP BY nombre",
+        "SELECT rut FROM liquidaciones WHERE periodo BETWEEN '2015-01' AND '2015-12'",
+    ]
+    for consulta in consultas:
+        plan = " ".join(fila[-1] for fila in almacen._conn.execute(f"EXPLAIN QUERY PLAN {consulta}"))
+        
+        assert "periodo>" in plan and "SCAN" not in plan, plan
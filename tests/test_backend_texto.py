@@ -0,0 +1,48 @@
+import pytest
+
+import benchmark
+import untitled0 as app
+
+N_PAGINAS = 40
+
+@pytest.fixture(params=[False, True], ids=["texto", "xobjetos"])
+def pdf(request) -> bytes:
+    textos = [benchmark.generar_texto_pagina(i, semilla=7) for i in range(N_PAGINAS)]
+    return benchmark.generar_pdf(textos, xobjetos=request.param)
+
+def _con_backend(monkeypatch, datos: bytes, nombre: str):
+    monkeypatch.setattr(app, "BACKEND_TEXTO", nombre)
+    return list(app._iterar_paginas(datos, 0, N_PAGINAS))
+
+def test_pdfium_da_las_mismas_liquidaciones_que_pdfplumber(pdf, monkeypatch):
+    rapido = _con_backend(monkeypatch, pdf, "pdfium")
+    layout = _con_backend(monkeypatch, pdf, "pdfplumber")
+    
+    # Ninguna página necesitó el respaldo: la comparación es realmente entre backends
+    assert not any('texto_layout' in r.tiempos for r in rapido)
+    assert [r.estado for r in rapido] == ['extraida'] * N_PAGINAS
+    assert [r.liquidacion for r in rapido] == [r.liquidacion for r in layout]
+
+def test_error_del_backend_en_una_pagina_usa_layout(pdf, monkeypatch):
+    texto = app.BackendPdfium.texto
+    
+    def texto_con_error(self, numero_pagina):
+        if numero_pagina == 2:
+            raise RuntimeError("PDFium falló")
+        return texto(self, numero_pagina)
+    
+    monkeypatch.setattr(app.BackendPdfium, "texto", texto_con_error)
+    resultados = _con_backend(monkeypatch, pdf, "pdfium")
+    
+    assert [r.estado for r in resultados] == ['extraida'] * N_PAGINAS
+    assert 'texto_layout' not in resultados[1].tiempos and 'texto' in resultados[1].tiempos
+    assert resultados[1].liquidacion == _con_backend(monkeypatch, pdf, "pdfplumber")[1].liquidacion
+
+def test_error_al_abrir_con_el_backend_usa_layout(pdf, monkeypatch):
+    def abrir_con_error(self, fuente):
+        raise RuntimeError("PDFium no abre el documento")
+    
+    monkeypatch.setattr(app.BackendPdfium, "__init__", abrir_con_error)
+    resultados = _con_backend(monkeypatch, pdf, "pdfium")
+    
+    assert [r.liquidacion for r in resultados] == [r.liquidacion for r in _con_backend(monkeypatch, pdf, "pdfplumber")]
@@ -0,0 +1,82 @@
+import json
+import random
+
+import pytest
+
+import untitled0 as app
+
+# Clasificación como la hacía la versión original: una cadena de if/elif
+def _clasificar_original(nombre: str) -> str:
+    nombre_upper = nombre.upper()
+    
+    if "AFP" in nombre_upper or "COTIZACION" in nombre_upper:
+        return "AFP"
+    elif any(x in nombre_upper for x in ["SALUD", "ISAPRE", "COLMENA"]):
+        return "SALUD"
+    elif "IMPUESTO" in nombre_upper:
+        return "IMPUESTO"
+    elif "CESANTIA" in nombre_upper or "CESANTÍA" in nombre_upper:
+        return "CESANTIA"
+    else:
+        return "OTRO"
+
+@pytest.mark.parametrize("nombre, categoria", [
+    ("Cotización Salud Isapre", "SALUD"),
+    ("Cotizacion Salud Isapre", "AFP"),  # Sin tilde gana la regla AFP, como antes
+    ("Salud AFP Modelo", "AFP"),  # El término de mayor prioridad aparece después
+    ("Impuesto Único", "IMPUESTO"),
+    ("Seguro de Cesantía", "CESANTIA"),
+    ("seguro de cesantia", "CESANTIA"),
+    ("Isapre Colmena", "SALUD"),
+    ("Impuesto de cesantía", "IMPUESTO"),
+    ("Anticipo de sueldo", "OTRO"),
+    ("", "OTRO"),
+])
+def test_reglas_por_defecto_respetan_la_prioridad(nombre, categoria):
+    clasificador = app.ClasificadorDescuentos(app.REGLAS_DESCUENTO_POR_DEFECTO)
+    
+    assert clasificador.clasificar(nombre) == categoria == _clasificar_original(nombre)
+
+def test_reglas_por_defecto_equivalen_a_la_cadena_original():
+    palabras = ["AFP", "Cotización", "Cotizacion", "Salud", "Isapre", "Colmena", "Impuesto", "Único",
+                "Cesantía", "cesantia", "Seguro", "Fonasa", "Modelo", "Habitat", "APV", "préstamo",
+                "de", "Caja", "ISAPRE\nCOLMENA", "afp-capital", "xImpuestoX"]
+    rng = random.Random(18)
+    clasificador = app.ClasificadorDescuentos(app.REGLAS_DESCUENTO_POR_DEFECTO)
+    for _ in range(5000):
+        nombre = " ".join(rng.choice(palabras) for _ in range(rng.randint(1, 4)))
+        
+        assert clasificador.clasificar(nombre) == _clasificar_original(nombre), nombre
+
+@pytest.fixture
+def sin_clasificador_memorizado():
+    app.obtener_clasificador.cache_clear()
+    yield
+    app.obtener_clasificador.cache_clear()
+
+def test_reglas_desde_json(tmp_path, monkeypatch, sin_clasificador_memorizado):
+    ruta = tmp_path / "reglas.json"
+    ruta.write_text(json.dumps([
+        {'categoria': 'SALUD', 'contiene': ['fonasa']},
+        *app.REGLAS_DESCUENTO_POR_DEFECTO,
+    ]), encoding='utf-8')
+    monkeypatch.setattr(app, "RUTA_REGLAS_DESCUENTO", str(ruta))
+    
+    assert app.clasificar_descuento("Cotizacion Fonasa 7%") == "SALUD"
+    assert app.clasificar_descuento("AFP Modelo") == "AFP"
+
+def test_json_que_no_es_una_lista(tmp_path):
+    ruta = tmp_path / "reglas.json"
+    ruta.write_text(json.dumps({'categoria': 'AFP', 'contiene': ['AFP']}), encoding='utf-8')
+    
+    with pytest.raises(ValueError, match="lista de reglas"):
+        app.cargar_reglas_descuento(str(ruta))
+
+@pytest.mark.parametrize("regla, mensaje", [
+    ({'categoria': 'BONO', 'contiene': ['BONO']}, "categoría 'BONO'"),
+    ({'categoria': 'AFP', 'contiene': []}, "'contiene'"),
+    ({'categoria': 'AFP', 'contiene': ['AFP', '  ']}, "'contiene'"),
+])
+def test_regla_invalida(regla, mensaje):
+    with pytest.raises(ValueError, match=f"Regla de descuento 2: {mensaje}"):
+        app.ClasificadorDescuentos([app.REGLAS_DESCUENTO_POR_DEFECTO[0], regla])
@@ -0,0 +1,136 @@
+import random
+import re
+
+import pytest
+
+import benchmark
+import untitled0 as app
+
+@pytest.mark.parametrize("texto", [
+    "Nombre: Empleado 00001  RUT: 10.000.000-0 Días trabajados: 29",
+    "Nombre: Empleado 00001\tRUT: 10.000.000-0\tDías trabajados: 29",
+    "Nombre: Empleado 00001\nRUT: 10.000.000-0\nDías trabajados: 29",
+])
+def test_nombre_no_consume_las_etiquetas_siguientes(texto):
+    cabecera = app.extraer_cabecera(texto)
+    
+    assert cabecera['nombre'] == "Empleado 00001"
+    assert cabecera['rut'] == "10000000-0"
+    assert cabecera['dias_trabajados'] == 29
+
+def test_nombre_hasta_fin_de_linea():
+    cabecera = app.extraer_cabecera("Nombre: María José Totalmente Pérez\nRUT: 12.345.678-K")
+    
+    assert cabecera['nombre'] == "María José Totalmente Pérez"
+    assert cabecera['rut'] == "12345678-K"
+
+def test_nombre_vacio():
+    assert app.extraer_cabecera("Nombre:   \nRUT: 1.111.111-1")['nombre'] == ""
+
+def _pagina_sin_rut(indice: int, nombre: str) -> str:
+    texto = re.sub(r"RUT: [^\n]*\n", "", benchmark.generar_texto_pagina(indice))
+    return re.sub(r"Nombre: [^\n]*", f"Nombre: {nombre}", texto)
+
+def test_sin_rut_la_identidad_es_el_nombre():
+    # Dos empleados sin RUT en el mismo mes no se pisan; el mismo nombre mal espaciado sí coincide
+    juan = app.extraer_liquidacion_desde_pagina(_pagina_sin_rut(0, "Juan Pérez"))
+    maria = app.extraer_liquidacion_desde_pagina(_pagina_sin_rut(0, "María Soto"))
+    juan_otra_vez = app.extraer_liquidacion_desde_pagina(_pagina_sin_rut(0, "JUAN  PEREZ"))
+    
+    assert juan.clave == (app.PREFIJO_SIN_RUT + "JUAN PEREZ", "2015-01")
+    assert maria.clave != juan.clave
+    assert juan_otra_vez.clave == juan.clave
+    assert not app.es_rut(juan.rut) and app.es_rut("10000000-0")
+
+def test_sin_rut_ni_nombre_queda_sin_identificar():
+    assert app.extraer_liquidacion_desde_pagina(_pagina_sin_rut(0, "")).rut == ""
+
+# --- EQUIVALENCIA CON LA EXTRACCIÓN ORIGINAL ---
+# Páginas sintéticas del benchmark, con renglones vecinos juntados al azar en uno
+# solo (como cuando el layout de un PDF pone dos etiquetas en la misma línea).
+N_PAGINAS_FUZZ = 3000
+
+def _juntar_lineas(texto: str, semilla: int) -> str:
+    rng = random.Random(semilla)
+    lineas = texto.split("\n")
+    juntadas = [lineas[0]]
+    for linea in lineas[1:]:
+        if rng.random() < 0.3:
+            juntadas[-1] += rng.choice(["  ", " ", "\t"]) + linea
+        else:
+            juntadas.append(linea)
+    return "\n".join(juntadas)
+
+def _paginas_fuzz():
+    """(número, texto original, texto con líneas juntadas) de páginas de cinco empleados."""
+    for i in range(N_PAGINAS_FUZZ):
+        texto = benchmark.generar_texto_pagina(i * 37 % (5 * benchmark.MESES_POR_EMPLEADO), semilla=i)
+        yield i, texto, _juntar_lineas(texto, semilla=i)
+
+# Cabecera como la leía la versión original: un re.search independiente por campo
+_PATRONES_ORIGINALES = {
+    'dias_trabajados': r"Días trabajados:\s*(\d+)",
+    'dias_licencia': r"Días licencia:\s*(\d+)",
+    'dias_ausencia': r"Días Ausencia:\s*(\d+)",
+    'dias_vacaciones': r"Días vacaciones:\s*(\d+)",
+    'sueldo_base': r"Sueldo base:\s*\$?\s*([\d\.]+)",
+    'haberes_afectos_total': r"Total Haberes Afectos:\s*\$\s*([\d\.]+)",
+    'haberes_exentos_total': r"Total Haberes Exentos:\s*\$\s*([\d\.]+)",
+    'descuentos_legales_total': r"Total Descuentos Legales:\s*\$\s*([\d\.]+)",
+    'otros_descuentos_total': r"Total Otros Descuentos:\s*\$\s*([\d\.]+)",
+    'liquido_a_pagar': r"Líquido a pagar:\s*\$\s*([\d\.]+)",
+    'total_imponible': r"Total Imponible\s*\$?\s*([\d\.]+)",
+    'total_tributable': r"Total Tributable\s*\$?\s*([\d\.]+)",
+}
+
+def _cabecera_original(texto: str) -> dict:
+    cabecera = {}
+    for campo, patron in _PATRONES_ORIGINALES.items():
+        m = re.search(patron, texto, re.I)
+        cabecera[campo] = app.limpiar_monto(m.group(1)) if m else 0
+    m = re.search(r"Horas base:\s*([\d\.]+)", texto, re.I)
+    cabecera['horas_base'] = float(m.group(1)) if m else 44.0
+    return cabecera
+
+def test_cabecera_equivale_a_la_original_con_lineas_juntadas():
+    for i, _, texto in _paginas_fuzz():
+        cabecera = app.extraer_cabecera(texto)
+        esperada = _cabecera_original(texto)
+        
+        assert {campo: cabecera[campo] for campo in esperada} == esperada, f"página {i}"
+
+def test_identidad_no_depende_de_como_se_junten_las_lineas():
+    for i, texto, juntado in _paginas_fuzz():
+        original = app.extraer_cabecera(texto)
+        cabecera = app.extraer_cabecera(juntado)
+        
+        assert (cabecera['rut'], cabecera['nombre']) == (original['rut'], original['nombre']), f"página {i}"
+        assert original['rut'] and original['nombre'].startswith("Empleado ")
+
+# Items como los leía la versión original: una recorrida de líneas por sección
+def _items_seccion_original(lineas, inicio, fin, tipo):
+    items = []
+    capturando = False
+    for linea in lineas:
+        linea_upper = linea.upper()
+        if inicio in linea_upper and "TOTAL" not in linea_upper:
+            capturando = True
+            continue
+        if fin in linea_upper:
+            break
+        if capturando:
+            m = re.search(r'^(.+?)\s+\$\s*([\d\.]+)\s*$', linea)
+            if m:
+                nombre, monto = m.group(1).strip(), app.limpiar_monto(m.group(2))
+                if monto > 0 and len(nombre) > 3:
+                    items.append({'nombre': nombre, 'monto': monto, 'tipo': tipo})
+    return items
+
+def test_tokenizar_secciones_equivale_a_la_original_con_lineas_juntadas():
+    for i, _, texto in _paginas_fuzz():
+        lineas = [l.strip() for l in texto.split('\n') if l.strip()]
+        
+        items, _ = app.tokenizar_secciones(lineas)
+        
+        for tipo, inicio, fin in app.SECCIONES_ITEMS:
+            assert items[tipo] == _items_seccion_original(lineas, inicio, fin, tipo), f"página {i}, {tipo}"
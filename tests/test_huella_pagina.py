@@ -0,0 +1,33 @@
+import benchmark
+import untitled0 as app
+
+# Dos meses de un empleado y el primer mes de otro
+INDICES = [0, 1, benchmark.MESES_POR_EMPLEADO]
+
+def _pdf_con_xobjetos() -> bytes:
+    return benchmark.generar_pdf([benchmark.generar_texto_pagina(i) for i in INDICES], xobjetos=True)
+
+def test_paginas_con_xobjetos_tienen_huellas_distintas():
+    # Todas las páginas comparten el content stream "q /X0 Do Q": solo cambia el XObject
+    resultados = list(app._iterar_paginas(_pdf_con_xobjetos(), 0, len(INDICES)))
+    
+    assert len({r.huella for r in resultados}) == len(INDICES)
+    assert [r.estado for r in resultados] == ['extraida'] * len(INDICES)
+
+def test_pagina_conocida_no_oculta_las_demas():
+    datos = _pdf_con_xobjetos()
+    primera = next(app._iterar_paginas(datos, 0, 1))
+    
+    resultados = list(app._iterar_paginas(datos, 0, len(INDICES), frozenset([primera.huella])))
+    
+    assert [r.estado for r in resultados] == ['sin_cambios', 'extraida', 'extraida']
+    claves = [(r.liquidacion.rut, r.liquidacion.periodo) for r in resultados[1:]]
+    assert claves == [('10000000-0', '2015-02'), ('10007919-1', '2015-01')]
+
+def test_huella_estable_entre_aperturas():
+    datos = _pdf_con_xobjetos()
+    
+    primera = [r.huella for r in app._iterar_paginas(datos, 0, len(INDICES))]
+    segunda = [r.huella for r in app._iterar_paginas(datos, 1, len(INDICES))]
+    
+    assert segunda == primera[1:]
@@ -0,0 +1,65 @@
+import benchmark
+import untitled0 as app
+
+def _resultado(pagina: int, estado: str, indice: int = 0) -> app.ResultadoPagina:
+    liq = None
+    if estado == 'extraida':
+        liq = app.extraer_liquidacion_desde_pagina(benchmark.generar_texto_pagina(indice))
+    return app.ResultadoPagina(pagina, estado, f"huella-{pagina}", {}, liq)
+
+def test_avanzar_cuenta_como_nuevas_solo_las_liquidaciones():
+    trabajo = app.TrabajoIngesta(1, "h", "a.pdf")
+    previa = app.extraer_liquidacion_desde_pagina(benchmark.generar_texto_pagina(1)).clave
+    
+    trabajo.avanzar([
+        _resultado(1, 'omitida'),
+        _resultado(2, 'extraida', indice=0),
+        _resultado(3, 'extraida', indice=1),
+        _resultado(4, 'fallida'),
+        _resultado(5, 'sin_cambios'),
+    ], {previa})
+    
+    progreso = trabajo.progreso()
+    assert progreso['paginas_hechas'] == 5
+    assert progreso['liquidaciones'] == 2
+    assert (progreso['paginas_nuevas'], progreso['paginas_modificadas'], progreso['paginas_sin_cambios']) == (1, 1, 1)
+    assert progreso['paginas_omitidas'] == [1]
+    assert progreso['paginas_fallidas'] == [4]
+
+def test_guardar_lote_combina_desde_la_tabla_temporal():
+    almacen = app.AlmacenLiquidaciones(":memory:")
+    primera = _resultado(1, 'extraida', indice=0)
+    segunda = app.ResultadoPagina(1, 'extraida', "huella-otra", {}, primera.liquidacion)
+    
+    # Se preparan en desorden: manda el orden de carga (id de trabajo), no el de llegada
+    almacen.preparar_lote(2, [segunda, _resultado(2, 'fallida')])
+    almacen.preparar_lote(1, [primera, _resultado(3, 'omitida')])
+    
+    conflictos = almacen.guardar_lote([1, 2])
+    almacen.descartar_lote([1, 2])
+    
+    assert conflictos == [(*primera.liquidacion.clave, [1, 2], 2)]
+    assert almacen.huellas_paginas() == frozenset(["huella-otra", "huella-3"])
+    assert [liq.clave for liq in almacen.cargar()] == [primera.liquidacion.clave]
+    assert almacen._conn.execute("SELECT COUNT(*) FROM paginas_lote").fetchone()[0] == 0
+
+def test_memoria_pico_es_la_del_flujo_y_no_es_una_duracion():
+    registro = app.RegistroTiempos('procesar_pdf')
+    registro.agregar_paginas([
+        {'pagina': 1, 'texto': 0.5, 'memoria_mb': 10_000.0},
+        {'pagina': 2, 'texto': 0.25, 'memoria_mb': 20_000.0},
+        {'pagina': 3, 'texto': 1.0},
+    ])
+    
+    resumen = registro.resumen()
+    
+    assert resumen['memoria_pico_mb'] == 20_000.0
+    assert resumen['etapas_paginas_s'] == {'texto': 1.75}
+    assert resumen['paginas_mas_lentas'] == [3, 1, 2]
+
+def test_las_paginas_anotan_la_memoria_del_worker():
+    datos = benchmark.generar_pdf([benchmark.generar_texto_pagina(i) for i in range(2)])
+    
+    resultados = list(app._iterar_paginas(datos, 0, 2))
+    
+    assert all(r.tiempos['memoria_mb'] > 0 for r in resultados)
@@ -0,0 +1,75 @@
+import os
+
+import pandas as pd
+import pytest
+
+import benchmark
+import untitled0 as app
+
+N_ARCHIVOS = 6
+
+@pytest.fixture
+def directorio_pdfs(tmp_path):
+    directorio = tmp_path / "pdfs"
+    directorio.mkdir()
+    for k in range(N_ARCHIVOS):
+        textos = [benchmark.generar_texto_pagina(k * 2 + j) for j in range(2)]
+        (directorio / f"m{k}.pdf").write_bytes(benchmark.generar_pdf(textos))
+    return str(directorio)
+
+def _filas(salida: str) -> pd.DataFrame:
+    return pd.read_parquet(os.path.join(salida, "liquidaciones"))
+
+def test_relanzar_tras_un_corte_no_duplica_filas(directorio_pdfs, tmp_path, monkeypatch):
+    salida = str(tmp_path / "salida")
+    escribir = app._escribir_parquet_lote
+    
+    def escribir_y_cortar(resultados, directorio, salida, id_lote):
+        # El segundo lote alcanza a escribir su Parquet pero no su manifiesto
+        partes = escribir(resultados, directorio, salida, id_lote)
+        if "-00001-" in id_lote:
+            raise KeyboardInterrupt
+        return partes
+    
+    monkeypatch.setattr(app, "_escribir_parquet_lote", escribir_y_cortar)
+    with pytest.raises(KeyboardInterrupt):
+        app.procesar_directorio(directorio_pdfs, salida, max_workers=1, tamano_lote=2)
+    assert len(_filas(salida)) == 4 * 2  # Dos lotes escritos, uno sin confirmar
+    
+    monkeypatch.setattr(app, "_escribir_parquet_lote", escribir)
+    resumen = app.procesar_directorio(directorio_pdfs, salida, max_workers=1, tamano_lote=2)
+    
+    assert (resumen['archivos'], resumen['omitidos']) == (N_ARCHIVOS - 2, 2)
+    filas = _filas(salida)
+    assert len(filas) == N_ARCHIVOS * 2
+    assert not filas.duplicated(['rut', 'periodo']).any()
+
+def test_manifiesto_con_linea_cortada(directorio_pdfs, tmp_path):
+    salida = str(tmp_path / "salida")
+    app.procesar_directorio(directorio_pdfs, salida, max_workers=1, tamano_lote=2)
+    with open(os.path.join(salida, app.MANIFIESTO_LOTE), 'a', encoding='utf-8') as f:
+        f.write('{"archivo": "m9.pdf", "fir')
+    
+    resumen = app.procesar_directorio(directorio_pdfs, salida, max_workers=1, tamano_lote=2)
+    
+    assert (resumen['archivos'], resumen['omitidos']) == (0, N_ARCHIVOS)
+    procesados = app._leer_manifiesto(os.path.join(salida, app.MANIFIESTO_LOTE))
+    assert len(procesados) == N_ARCHIVOS
+
+def test_reexportacion_acumulativa_reemplaza_las_filas_del_archivo(directorio_pdfs, tmp_path):
+    salida = str(tmp_path / "salida")
+    app.procesar_directorio(directorio_pdfs, salida, max_workers=1, tamano_lote=4)
+    
+    # m0.pdf se vuelve a exportar con un mes más: sus dos meses anteriores y uno nuevo
+    textos = [benchmark.generar_texto_pagina(j) for j in (0, 1, N_ARCHIVOS * 2)]
+    with open(os.path.join(directorio_pdfs, "m0.pdf"), 'wb') as f:
+        f.write(benchmark.generar_pdf(textos))
+    resumen = app.procesar_directorio(directorio_pdfs, salida, max_workers=1, tamano_lote=4)
+    
+    assert (resumen['archivos'], resumen['omitidos']) == (1, N_ARCHIVOS - 1)
+    filas = _filas(salida)
+    assert len(filas) == N_ARCHIVOS * 2 + 1
+    assert not filas.duplicated(['rut', 'periodo']).any()
+    assert (filas['archivo'] == "m0.pdf").sum() == 3
+    items = pd.read_parquet(os.path.join(salida, "items"))
+    assert set(items.loc[items['archivo'] == "m0.pdf", 'periodo']) == set(filas.loc[filas['archivo'] == "m0.pdf", 'periodo'])
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import untitled0 as app
+
+# Meses con datos; entre ellos hay huecos (2023-01 y 2023-03..2023-10 no existen)
+MESES = {
+    "2022-11": 100.0,
+    "2022-12": 200.0,
+    "2023-02": 400.0,
+    "2023-11": 150.0,
+    "2024-02": 800.0,
+}
+
+@pytest.fixture
+def series() -> pd.DataFrame:
+    df = pd.DataFrame({
+        'periodo': list(MESES),
+        'liquido': list(MESES.values()),
+        'bruto': [v * 2 for v in MESES.values()],
+        'impuesto': [v / 10 for v in MESES.values()],
+        'total_descuentos': [v / 2 for v in MESES.values()],
+        'empleados': [1, 1, 2, 1, 1],
+    })
+    return app.construir_series(df)
+
+def _en(series, columna, periodo):
+    return series.loc[pd.Period(periodo, freq='M'), columna]
+
+def test_indice_mensual_denso(series):
+    assert series.index.equals(pd.period_range("2022-11", "2024-02", freq='M', name='periodo'))
+    assert np.isnan(_en(series, 'liquido', "2023-01"))
+    assert _en(series, 'empleados', "2023-01") == 0
+
+def test_interanual_contra_el_mismo_mes_aunque_haya_huecos(series):
+    # shift(12) sobre el índice denso: 2023-11 contra 2022-11, no contra el duodécimo dato anterior
+    assert _en(series, 'liquido_yoy', "2023-11") == pytest.approx(150 / 100 - 1)
+    assert _en(series, 'liquido_yoy', "2024-02") == pytest.approx(800 / 400 - 1)
+    assert np.isnan(_en(series, 'liquido_yoy', "2023-12"))  # Sin dato en el mes
+    assert np.isnan(_en(series, 'liquido_yoy', "2023-02"))  # 2022-02 no existe
+
+def test_ventanas_moviles_cuentan_meses_de_calendario(series):
+    # La ventana de 3 meses en 2023-02 abarca 2022-12..2023-02: el hueco de enero no alarga la ventana
+    assert _en(series, 'liquido_media_3m', "2023-02") == pytest.approx((200 + 400) / 2)
+    assert _en(series, 'liquido_media_3m', "2023-04") == pytest.approx(400)
+    assert np.isnan(_en(series, 'liquido_media_3m', "2023-06"))
+    assert _en(series, 'liquido_media_12m', "2023-11") == pytest.approx((200 + 400 + 150) / 3)
+    assert _en(series, 'tasa_descuento_12m', "2024-02") == pytest.approx(0.25)
+
+def test_impuesto_acumulado_se_reinicia_cada_anio(series):
+    assert _en(series, 'impuesto_acumulado_anio', "2022-12") == pytest.approx(30)
+    assert _en(series, 'impuesto_acumulado_anio', "2023-01") == 0
+    assert _en(series, 'impuesto_acumulado_anio', "2023-11") == pytest.approx(40 + 15)
+    assert _en(series, 'impuesto_acumulado_anio', "2024-02") == pytest.approx(80)
+    assert _en(series, 'impuesto_acumulado', "2024-02") == pytest.approx(165)
+
+def test_consultar_series_recorta_sin_recalcular(series):
+    recorte = app.consultar_series(series, "2023-02", "2023-11", ['liquido', 'liquido_yoy'])
+    
+    assert recorte.index[0] == pd.Period("2023-02", freq='M') and recorte.index[-1] == pd.Period("2023-11", freq='M')
+    assert recorte.columns.tolist() == ['liquido', 'liquido_yoy']
+    # El interanual se calculó con el historial completo, no con el recorte
+    assert recorte.loc[pd.Period("2023-11", freq='M'), 'liquido_yoy'] == pytest.approx(0.5)
+
+def test_sin_datos():
+    assert app.construir_series(pd.DataFrame(columns=['periodo', 'liquido'])).empty
@@ -0,0 +1,63 @@
+import random
+import re
+from dataclasses import replace
+
+import benchmark
+import untitled0 as app
+
+_RE_MONTO_LINEA = re.compile(r"\$ ([\d\.]+)$", re.M)
+_CONTROLES_SECCION = {'haberes_afectos', 'haberes_exentos', 'descuentos_legales', 'otros_descuentos'}
+
+def _pagina_mutada(indice: int, rng: random.Random) -> str:
+    """Página del benchmark con un monto al azar (item o total) alterado, en la mitad de los casos."""
+    texto = benchmark.generar_texto_pagina(indice, semilla=indice)
+    montos = list(_RE_MONTO_LINEA.finditer(texto))
+    if rng.random() < 0.5:
+        m = rng.choice(montos)
+        nuevo = app.limpiar_monto(m.group(1)) + rng.choice([-5000, -2, 2, 700, 10_000])
+        texto = texto[:m.start(1)] + f"{max(nuevo, 0):,}".replace(",", ".") + texto[m.end(1):]
+    return texto
+
+def _validar(liquidaciones):
+    return app.validar_lote(app.construir_tabla_totales(liquidaciones), app.construir_tabla_items(liquidaciones))
+
+def test_marca_las_mismas_liquidaciones_que_validar_liquidacion():
+    rng = random.Random(20)
+    liquidaciones = [app.extraer_liquidacion_desde_pagina(_pagina_mutada(i, rng)) for i in range(400)]
+    
+    discrepancias = _validar(liquidaciones)
+    
+    por_seccion = discrepancias[discrepancias['control'].isin(_CONTROLES_SECCION)]
+    esperadas = {liq.clave for liq in liquidaciones
+                 if not (liq.validacion_haberes_ok and liq.validacion_descuentos_ok)}
+    assert esperadas  # La mutación sí produjo páginas inválidas
+    assert set(zip(por_seccion['rut'], por_seccion['periodo'])) == esperadas
+
+def test_control_liquido():
+    liquidaciones = [app.extraer_liquidacion_desde_pagina(benchmark.generar_texto_pagina(i)) for i in range(3)]
+    liquidaciones[1] = replace(liquidaciones[1], liquido_a_pagar=liquidaciones[1].liquido_a_pagar + 500)
+    
+    discrepancias = _validar(liquidaciones)
+    
+    assert discrepancias['control'].tolist() == ['liquido']
+    assert (discrepancias['rut'][0], discrepancias['periodo'][0]) == liquidaciones[1].clave
+    assert discrepancias['diferencia'].tolist() == [-500]
+    assert discrepancias['declarado'].tolist() == [liquidaciones[1].liquido_a_pagar]
+
+def test_liquidacion_sin_items():
+    liq = replace(app.extraer_liquidacion_desde_pagina(benchmark.generar_texto_pagina(0)),
+                  haberes_items=[], descuentos_items=[])
+    
+    discrepancias = _validar([liq])
+    
+    # Todos los totales son positivos: ninguna sección cuadra, el líquido sí
+    assert discrepancias['control'].tolist() == [
+        'haberes_afectos', 'haberes_exentos', 'descuentos_legales', 'otros_descuentos'
+    ]
+    assert (discrepancias['calculado'] == 0).all()
+
+def test_sin_liquidaciones():
+    discrepancias = _validar([])
+    
+    assert discrepancias.empty
+    assert discrepancias.columns.tolist() == app._COLUMNAS_DISCREPANCIA
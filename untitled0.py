@@ -1,41 +1,193 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 import pdfplumber
+import pypdfium2 as pdfium
+from pdfminer.pdfdevice import PDFDevice
+from pdfminer.pdffont import PDFUnicodeNotDefined
+from pdfminer.pdfinterp import PDFPageInterpreter
+from pdfminer.pdftypes import PDFObjRef, PDFStream, stream_value
+from pdfminer.utils import make_compat_bytes
+import argparse
+import hashlib
+import io
+import json
+import logging
+import mmap
+import multiprocessing
+import os
+import pickle
 import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
-from typing import Dict, List, Optional
-from dataclasses import dataclass, asdict
+from enum import IntEnum
+from functools import lru_cache
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from dataclasses import dataclass, asdict, replace
 
 # --- CONFIGURACIÓN ---
-st.set_page_config(
-    page_title="Gestión Salarial USM PRO", 
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
-
 HORAS_MENSUALES_BASE = (44.0 * 52) / 12  # ~190.67 horas/mes
 
+# Procesos para la extracción paralela (USM_WORKERS=1 fuerza modo secuencial)
+MAX_WORKERS_EXTRACCION = int(os.environ.get("USM_WORKERS", "0")) or (os.cpu_count() or 1)
+TAREAS_POR_WORKER = 4  # Rangos por proceso, para repartir carga entre páginas desiguales
+PAGINAS_POR_TRAMO = 50  # Tope de páginas por rango: acota la memoria de cada resultado parcial
+TRAMOS_EN_VUELO_POR_WORKER = 2  # Rangos encargados sin consumir, por proceso (contrapresión)
+# Pre-filtro: descartar sin extracción completa las páginas sin "Liquidación de sueldo" (USM_PREFILTRO=0 lo apaga)
+PREFILTRO_CABECERA = os.environ.get("USM_PREFILTRO", "1") != "0"
+# Backend de texto del primer intento por página: 'pdfium' (texto crudo, sin análisis de layout)
+# o 'pdfplumber' (solo layout). Si el primer intento no parsea o no valida, se usa el layout.
+BACKEND_TEXTO = os.environ.get("USM_BACKEND_TEXTO", "pdfium")
+# Sobre este largo la ingesta solo escribe al almacén: no junta el resultado en memoria para la caché
+PAGINAS_MODO_STREAMING = int(os.environ.get("USM_PAGINAS_STREAMING", "500"))
+
+# Caché de PDFs procesados, compartida por todas las sesiones del servidor
+CACHE_PDF_MAX_ENTRADAS = int(os.environ.get("USM_CACHE_MAX_ENTRADAS", "64"))
+CACHE_PDF_MAX_MB = float(os.environ.get("USM_CACHE_MAX_MB", "256"))
+
+# Diagnóstico: nivel de los logs JSON por etapa (vacío o WARNING para silenciarlos)
+NIVEL_LOG_DIAGNOSTICO = os.environ.get("USM_LOG_LEVEL", "INFO")
+
+# Ingestas en segundo plano: PDFs procesándose a la vez y frecuencia del indicador de avance.
+# Todas comparten un pool de MAX_WORKERS_EXTRACCION procesos, así que más PDFs a la vez no
+# reparte más CPU: solo evita que los PDFs chicos de un lote esperen en fila.
+MAX_TRABAJOS_SIMULTANEOS = int(os.environ.get("USM_TRABAJOS", "0")) or max(MAX_WORKERS_EXTRACCION, 2)
+HISTORIAL_TRABAJOS = 20
+INTERVALO_PROGRESO_S = 1.0
+
+# Los PDFs subidos se vuelcan a disco (USM_SPOOL_DIR, por defecto el temporal del sistema)
+DIRECTORIO_SPOOL = os.environ.get("USM_SPOOL_DIR") or None
+TAMANO_BLOQUE_SPOOL = 1024 * 1024
+
+# Series de tiempo: ventanas de los promedios móviles (meses)
+VENTANAS_MOVILES = (3, 12)
+
+# Gráficos: puntos por traza (~ resolución visible), total de puntos de una figura sobre
+# el que las líneas pasan a WebGL, y tope del JSON de cada figura enviado al navegador
+PUNTOS_MAX_TRAZA = 1500
+PUNTOS_WEBGL = 1000
+MAX_KB_FIGURA = int(os.environ.get("USM_MAX_KB_FIGURA", "1024"))
+
+# Diferencia aceptada entre un total declarado y la suma de sus items (pesos)
+TOLERANCIA_VALIDACION = 1
+
+# Versión de las reglas de extracción: subirla invalida las huellas de página ya guardadas
+VERSION_EXTRACTOR = 1
+
+# Reglas de clasificación de descuentos legales: archivo JSON opcional (USM_REGLAS_DESCUENTO)
+# y tope de nombres de concepto distintos que se memorizan por proceso
+RUTA_REGLAS_DESCUENTO = os.environ.get("USM_REGLAS_DESCUENTO") or None
+MAX_NOMBRES_CLASIFICADOS = 4096
+
+# Base de datos local donde persisten las liquidaciones entre sesiones
+RUTA_BD = os.environ.get("USM_DB_PATH", "liquidaciones.db")
+# El almacén es compartido por todos los usuarios: vaciarlo entero desde la UI
+# (sin un empleado seleccionado) solo se ofrece con USM_PERMITIR_BORRAR_TODO=1
+PERMITIR_BORRAR_TODO = os.environ.get("USM_PERMITIR_BORRAR_TODO", "0") == "1"
+
 # --- MODELO DE DATOS ---
-@dataclass
-class ItemDescuento:
-    nombre: str
-    monto: int
-    tipo: str  # 'descuento_legal' o 'descuento_otro'
-    categoria: str  # 'AFP', 'SALUD', 'IMPUESTO', 'CESANTIA', 'OTRO'
+class TipoItem(IntEnum):
+    HABER_AFECTO = 0
+    HABER_EXENTO = 1
+    DESCUENTO_LEGAL = 2
+    DESCUENTO_OTRO = 3
+
+class CategoriaDescuento(IntEnum):
+    AFP = 0
+    SALUD = 1
+    IMPUESTO = 2
+    CESANTIA = 3
+    OTRO = 4
+
+# Texto de cada código, tal como lo ven la UI, el almacén y las tablas
+TIPOS_ITEM = [t.name.lower() for t in TipoItem]
+CATEGORIAS_DESCUENTO = [c.name for c in CategoriaDescuento]
+_TIPO_POR_TEXTO = {texto: TipoItem(i) for i, texto in enumerate(TIPOS_ITEM)}
+_CATEGORIA_POR_TEXTO = {texto: CategoriaDescuento(i) for i, texto in enumerate(CATEGORIAS_DESCUENTO)}
+
+def _codigo(valor: Union[str, int], enum: type, por_texto: Dict[str, IntEnum]) -> IntEnum:
+    """Código de un tipo o categoría dado como texto ('haber_afecto', 'AFP') o como entero."""
+    if isinstance(valor, int):
+        return enum(valor)
+    codigo = por_texto.get(valor)
+    if codigo is None:
+        raise ValueError(f"{enum.__name__} desconocido: {valor!r}")
+    return codigo
 
-@dataclass
 class ItemHaber:
-    nombre: str
-    monto: int
-    tipo: str  # 'haber_afecto' o 'haber_exento'
+    """
+    Item de haber compacto: sin __dict__ por instancia, con el nombre del concepto
+    internado (los mismos textos se repiten en cada página) y el tipo como código.
+    `tipo` sigue entregando el texto, como cuando era dataclass.
+    """
+    __slots__ = ('nombre', 'monto', 'codigo_tipo')
+    
+    def __init__(self, nombre: str, monto: int, tipo: Union[str, TipoItem]):
+        self.nombre = sys.intern(nombre)
+        self.monto = monto
+        self.codigo_tipo = _codigo(tipo, TipoItem, _TIPO_POR_TEXTO)  # HABER_AFECTO o HABER_EXENTO
+    
+    @property
+    def tipo(self) -> str:
+        return TIPOS_ITEM[self.codigo_tipo]
+    
+    def _campos(self) -> tuple:
+        return (self.nombre, self.monto, int(self.codigo_tipo))
+    
+    def __reduce__(self):
+        # Se serializa como tupla de enteros y textos (caché de PDFs, workers)
+        return (type(self), self._campos())
+    
+    def __eq__(self, otro):
+        if type(otro) is not type(self):
+            return NotImplemented
+        return self._campos() == otro._campos()
+    
+    __hash__ = None  # Mutable, igual que la dataclass que reemplaza
+    
+    def __repr__(self):
+        return f"{type(self).__name__}(nombre={self.nombre!r}, monto={self.monto!r}, tipo={self.tipo!r})"
+
+class ItemDescuento(ItemHaber):
+    """Item de descuento compacto: como ItemHaber, más la categoría como código."""
+    __slots__ = ('codigo_categoria',)
+    
+    def __init__(self, nombre: str, monto: int, tipo: Union[str, TipoItem],
+                 categoria: Union[str, CategoriaDescuento]):
+        super().__init__(nombre, monto, tipo)  # DESCUENTO_LEGAL o DESCUENTO_OTRO
+        self.codigo_categoria = _codigo(categoria, CategoriaDescuento, _CATEGORIA_POR_TEXTO)
+    
+    @property
+    def categoria(self) -> str:
+        return CATEGORIAS_DESCUENTO[self.codigo_categoria]
+    
+    def _campos(self) -> tuple:
+        return (*super()._campos(), int(self.codigo_categoria))
+    
+    def __repr__(self):
+        return f"{super().__repr__()[:-1]}, categoria={self.categoria!r})"
 
 @dataclass
 class LiquidacionMensual:
     periodo: str  # YYYY-MM
     mes_nombre: str  # "Enero 2025"
     
+    # Empleado
+    rut: str  # Normalizado "12345678-9"; sin RUT, el nombre (ver identificar_empleado)
+    nombre: str
+    
     # Información básica
     dias_trabajados: int
     dias_licencia: int
@@ -63,6 +215,64 @@ class LiquidacionMensual:
     validacion_haberes_ok: bool = True
     validacion_descuentos_ok: bool = True
     mensajes_validacion: List[str] = None
+    lineas_sin_seccion: List[str] = None  # Líneas con forma de item fuera de toda sección
+    
+    @property
+    def clave(self) -> Tuple[str, str]:
+        """Identidad de la liquidación: un empleado tiene una sola por periodo."""
+        return (self.rut, self.periodo)
+
+# --- PATRONES COMPILADOS ---
+_RE_NO_DIGITOS = re.compile(r'[^\d]')
+_RE_PERIODO = re.compile(r"Liquidación de sueldo\s+([A-Za-z]+)\s+(\d{4})", re.I)
+
+# Campos de cabecera y totales: (campo, etiqueta, valor). Se combinan en una sola
+# alternancia para leerlos todos en una pasada; gana la primera aparición. El
+# lookahead con las iniciales de las etiquetas descarta rápido las posiciones
+# donde ninguna alternativa puede empezar. El valor del nombre (None) se arma
+# después, con las demás etiquetas.
+_CAMPOS_CABECERA = [
+    ('rut', r"RUT:\s*", r"\d{1,2}\.?\d{3}\.?\d{3}\s*-?\s*[\dK]"),
+    ('nombre', r"Nombre:[ \t]*", None),
+    ('dias_trabajados', r"Días trabajados:\s*", r"\d+"),
+    ('dias_licencia', r"Días licencia:\s*", r"\d+"),
+    ('dias_ausencia', r"Días Ausencia:\s*", r"\d+"),
+    ('dias_vacaciones', r"Días vacaciones:\s*", r"\d+"),
+    ('horas_base', r"Horas base:\s*", r"[\d\.]+"),
+    ('sueldo_base', r"Sueldo base:\s*\$?\s*", r"[\d\.]+"),
+    ('haberes_afectos_total', r"Total Haberes Afectos:\s*\$\s*", r"[\d\.]+"),
+    ('haberes_exentos_total', r"Total Haberes Exentos:\s*\$\s*", r"[\d\.]+"),
+    ('descuentos_legales_total', r"Total Descuentos Legales:\s*\$\s*", r"[\d\.]+"),
+    ('otros_descuentos_total', r"Total Otros Descuentos:\s*\$\s*", r"[\d\.]+"),
+    ('liquido_a_pagar', r"Líquido a pagar:\s*\$\s*", r"[\d\.]+"),
+    ('total_imponible', r"Total Imponible\s*\$?\s*", r"[\d\.]+"),
+    ('total_tributable', r"Total Tributable\s*\$?\s*", r"[\d\.]+"),
+]
+_CAMPOS_TEXTO = ('rut', 'nombre')  # El resto de la cabecera son números
+# El nombre termina en el fin de línea o antes de la siguiente etiqueta: si el texto
+# junta varias en una línea ("Nombre: X  RUT: ..."), no se come los campos que siguen
+_VALOR_NOMBRE = r"[^\n]*?\S(?=[ \t]*(?:\n|\Z|Liquidación de sueldo|{}))".format(
+    "|".join(etiqueta for campo, etiqueta, _ in _CAMPOS_CABECERA if campo != 'nombre')
+)
+_RE_CABECERA = re.compile(
+    "(?=[" + "".join(sorted({etiqueta[0] for _, etiqueta, _ in _CAMPOS_CABECERA})) + "])(?:"
+    + "|".join(f"{etiqueta}(?P<{campo}>{valor or _VALOR_NOMBRE})" for campo, etiqueta, valor in _CAMPOS_CABECERA)
+    + ")",
+    re.I
+)
+
+# Patrón de item: NOMBRE ... $ MONTO. Equivale a r'^(.+?)\s+\$...' sobre líneas ya
+# recortadas, pero el grupo codicioso evita el retroceso carácter a carácter.
+_RE_ITEM = re.compile(r'(.*\S)\s+\$\s*([\d\.]+)\s*$')
+
+# Secciones de items: (tipo, ancla de inicio, ancla de fin)
+SECCIONES_ITEMS = (
+    ('haber_afecto', "HABERES AFECTOS", "TOTAL HABERES AFECTOS"),
+    ('haber_exento', "HABERES EXENTOS", "TOTAL HABERES EXENTOS"),
+    ('descuento_legal', "DESCUENTOS LEGALES", "TOTAL DESCUENTOS LEGALES"),
+    ('descuento_otro', "OTROS DESCUENTOS", "TOTAL OTROS DESCUENTOS"),
+)
+_SECCION_PENDIENTE, _SECCION_CAPTURANDO, _SECCION_TERMINADA = 0, 1, 2
 
 # --- UTILIDADES DE LIMPIEZA ---
 def limpiar_monto(texto: str) -> int:
@@ -70,7 +280,7 @@ def limpiar_monto(texto: str) -> int:
     if not texto:
         return 0
     # Quitar todo excepto dígitos
-    limpio = re.sub(r'[^\d]', '', texto)
+    limpio = _RE_NO_DIGITOS.sub('', texto)
     return int(limpio) if limpio else 0
 
 def normalizar_mes(mes_nombre: str) -> str:
@@ -82,16 +292,42 @@ def normalizar_mes(mes_nombre: str) -> str:
     }
     return meses_map.get(mes_nombre.upper(), "01")
 
+def normalizar_rut(rut: str) -> str:
+    """Deja un RUT como "12345678-9" (sin puntos, DV en mayúscula)."""
+    limpio = re.sub(r'[^\dK]', '', (rut or '').upper())
+    return f"{limpio[:-1]}-{limpio[-1]}" if len(limpio) > 1 else ""
+
+# Identificador de un empleado cuya liquidación no trae RUT: el nombre normalizado
+PREFIJO_SIN_RUT = "SIN-RUT:"
+
+def identificar_empleado(rut: str, nombre: str) -> str:
+    """
+    Identidad del empleado en la clave (rut, periodo): el RUT y, si falta, el
+    nombre normalizado (mayúsculas, sin tildes ni espacios repetidos) con
+    PREFIJO_SIN_RUT. Sin ninguno de los dos queda vacío ("Sin identificar").
+    """
+    if rut or not nombre:
+        return rut
+    sin_tildes = unicodedata.normalize('NFKD', nombre).encode('ascii', 'ignore').decode('ascii')
+    return PREFIJO_SIN_RUT + " ".join(sin_tildes.upper().split())
+
+def es_rut(identificador: Optional[str]) -> bool:
+    """True si el identificador de un empleado es un RUT (no un nombre ni vacío)."""
+    return bool(identificador) and not identificador.startswith(PREFIJO_SIN_RUT)
+
 # --- EXTRACCIÓN MEJORADA ---
-def extraer_liquidacion_desde_pagina(texto_pagina: str) -> Optional[LiquidacionMensual]:
+def extraer_liquidacion_desde_pagina(texto_pagina: str,
+                                     tiempos: Optional[Dict[str, float]] = None) -> Optional[LiquidacionMensual]:
     """
     Extrae datos completos de una liquidación siguiendo el modelo de datos.
     Implementa todas las reglas de extracción del documento de especificaciones.
+    Si se entrega `tiempos`, anota ahí la duración del parseo y de la validación.
     """
+    t_inicio = time.perf_counter()
     lineas = [l.strip() for l in texto_pagina.split('\n') if l.strip()]
     
     # 1. IDENTIFICACIÓN DEL PERIODO
-    match_periodo = re.search(r"Liquidación de sueldo\s+([A-Za-z]+)\s+(\d{4})", texto_pagina, re.I)
+    match_periodo = _RE_PERIODO.search(texto_pagina)
     if not match_periodo:
         return None
     
@@ -100,184 +336,176 @@ def extraer_liquidacion_desde_pagina(texto_pagina: str) -> Optional[LiquidacionM
     periodo = f"{anio}-{normalizar_mes(mes_nombre)}"
     mes_completo = f"{mes_nombre} {anio}"
     
-    # 2. INFORMACIÓN BÁSICA (Cabecera)
-    def extraer_valor(patron: str, default=0) -> int:
-        m = re.search(patron, texto_pagina, re.I)
-        if m:
-            return limpiar_monto(m.group(1))
-        return default
-    
-    dias_trabajados = extraer_valor(r"Días trabajados:\s*(\d+)")
-    dias_licencia = extraer_valor(r"Días licencia:\s*(\d+)")
-    dias_ausencia = extraer_valor(r"Días Ausencia:\s*(\d+)")
-    dias_vacaciones = extraer_valor(r"Días vacaciones:\s*(\d+)")
-    
-    # Horas base (puede ser decimal)
-    match_horas = re.search(r"Horas base:\s*([\d\.]+)", texto_pagina, re.I)
-    horas_base = float(match_horas.group(1)) if match_horas else 44.0
-    
-    sueldo_base = extraer_valor(r"Sueldo base:\s*\$?\s*([\d\.]+)")
-    
-    # 3. TOTALES (Anclas principales)
-    haberes_afectos_total = extraer_valor(r"Total Haberes Afectos:\s*\$\s*([\d\.]+)")
-    haberes_exentos_total = extraer_valor(r"Total Haberes Exentos:\s*\$\s*([\d\.]+)")
-    descuentos_legales_total = extraer_valor(r"Total Descuentos Legales:\s*\$\s*([\d\.]+)")
-    otros_descuentos_total = extraer_valor(r"Total Otros Descuentos:\s*\$\s*([\d\.]+)")
-    liquido_a_pagar = extraer_valor(r"Líquido a pagar:\s*\$\s*([\d\.]+)")
-    total_imponible = extraer_valor(r"Total Imponible\s*\$?\s*([\d\.]+)")
-    total_tributable = extraer_valor(r"Total Tributable\s*\$?\s*([\d\.]+)")
+    # 2. INFORMACIÓN BÁSICA (Cabecera) y 3. TOTALES (Anclas principales)
+    cabecera = extraer_cabecera(texto_pagina)
     
     # 4. EXTRACCIÓN DE ITEMS (Haberes y Descuentos)
-    haberes_items = []
-    descuentos_items = []
-    
-    # Extraer Haberes Afectos
-    haberes_afectos_dict = extraer_items_seccion(
-        lineas, 
-        "HABERES AFECTOS", 
-        "TOTAL HABERES AFECTOS",
-        "haber_afecto"
-    )
-    for item in haberes_afectos_dict:
-        haberes_items.append(ItemHaber(
-            nombre=item['nombre'],
-            monto=item['monto'],
-            tipo='haber_afecto'
-        ))
-    
-    # Extraer Haberes Exentos
-    haberes_exentos_dict = extraer_items_seccion(
-        lineas, 
-        "HABERES EXENTOS", 
-        "TOTAL HABERES EXENTOS",
-        "haber_exento"
-    )
-    for item in haberes_exentos_dict:
-        haberes_items.append(ItemHaber(
-            nombre=item['nombre'],
-            monto=item['monto'],
-            tipo='haber_exento'
-        ))
+    items_por_tipo, lineas_sin_seccion = tokenizar_secciones(lineas)
     
-    # Extraer Descuentos Legales
-    descuentos_legales = extraer_items_seccion(
-        lineas, 
-        "DESCUENTOS LEGALES", 
-        "TOTAL DESCUENTOS LEGALES",
-        "descuento_legal"
-    )
+    haberes_items = [
+        ItemHaber(nombre=item['nombre'], monto=item['monto'], tipo=tipo)
+        for tipo in ('haber_afecto', 'haber_exento')
+        for item in items_por_tipo[tipo]
+    ]
     
-    # Clasificar descuentos legales por categoría
-    for item in descuentos_legales:
-        categoria = clasificar_descuento(item['nombre'])
-        descuentos_items.append(ItemDescuento(
+    # Los descuentos legales se clasifican por categoría; los otros van a 'OTRO'
+    descuentos_items = [
+        ItemDescuento(
             nombre=item['nombre'],
             monto=item['monto'],
             tipo='descuento_legal',
-            categoria=categoria
-        ))
-    
-    # Extraer Otros Descuentos
-    otros_desc = extraer_items_seccion(
-        lineas, 
-        "OTROS DESCUENTOS", 
-        "TOTAL OTROS DESCUENTOS",
-        "descuento_otro"
+            categoria=clasificar_descuento(item['nombre'])
+        )
+        for item in items_por_tipo['descuento_legal']
+    ]
+    descuentos_items.extend(
+        ItemDescuento(nombre=item['nombre'], monto=item['monto'], tipo='descuento_otro', categoria='OTRO')
+        for item in items_por_tipo['descuento_otro']
     )
     
-    for item in otros_desc:
-        descuentos_items.append(ItemDescuento(
-            nombre=item['nombre'],
-            monto=item['monto'],
-            tipo='descuento_otro',
-            categoria='OTRO'
-        ))
-    
     # 5. VALIDACIONES
+    t_validacion = time.perf_counter()
     validaciones = validar_liquidacion(
         haberes_items,
-        haberes_afectos_total,
-        haberes_exentos_total,
+        cabecera['haberes_afectos_total'],
+        cabecera['haberes_exentos_total'],
         descuentos_items,
-        descuentos_legales_total,
-        otros_descuentos_total
+        cabecera['descuentos_legales_total'],
+        cabecera['otros_descuentos_total']
     )
+    if tiempos is not None:
+        tiempos['parseo'] = t_validacion - t_inicio
+        tiempos['validacion'] = time.perf_counter() - t_validacion
     
     # Crear objeto LiquidacionMensual
     liquidacion = LiquidacionMensual(
         periodo=periodo,
         mes_nombre=mes_completo,
-        dias_trabajados=dias_trabajados,
-        dias_licencia=dias_licencia,
-        dias_ausencia=dias_ausencia,
-        dias_vacaciones=dias_vacaciones,
-        horas_base_semanal=horas_base,
-        sueldo_base=sueldo_base,
-        haberes_afectos_total=haberes_afectos_total,
-        haberes_exentos_total=haberes_exentos_total,
+        rut=identificar_empleado(cabecera['rut'], cabecera['nombre']),
+        nombre=cabecera['nombre'],
+        dias_trabajados=cabecera['dias_trabajados'],
+        dias_licencia=cabecera['dias_licencia'],
+        dias_ausencia=cabecera['dias_ausencia'],
+        dias_vacaciones=cabecera['dias_vacaciones'],
+        horas_base_semanal=cabecera['horas_base'],
+        sueldo_base=cabecera['sueldo_base'],
+        haberes_afectos_total=cabecera['haberes_afectos_total'],
+        haberes_exentos_total=cabecera['haberes_exentos_total'],
         haberes_items=haberes_items,
-        descuentos_legales_total=descuentos_legales_total,
-        otros_descuentos_total=otros_descuentos_total,
+        descuentos_legales_total=cabecera['descuentos_legales_total'],
+        otros_descuentos_total=cabecera['otros_descuentos_total'],
         descuentos_items=descuentos_items,
-        liquido_a_pagar=liquido_a_pagar,
-        total_imponible=total_imponible,
-        total_tributable=total_tributable,
+        liquido_a_pagar=cabecera['liquido_a_pagar'],
+        total_imponible=cabecera['total_imponible'],
+        total_tributable=cabecera['total_tributable'],
         validacion_haberes_ok=validaciones['haberes_ok'],
         validacion_descuentos_ok=validaciones['descuentos_ok'],
-        mensajes_validacion=validaciones['mensajes']
+        mensajes_validacion=validaciones['mensajes'],
+        lineas_sin_seccion=lineas_sin_seccion
     )
     
     return liquidacion
 
-def extraer_items_seccion(lineas: List[str], inicio: str, fin: str, tipo: str) -> List[Dict]:
-    """Extrae items entre dos anclas (ej: entre 'Haberes Afectos' y 'Total Haberes Afectos')."""
-    items = []
-    capturando = False
+def extraer_cabecera(texto_pagina: str) -> Dict:
+    """Lee todos los campos de cabecera y totales en una sola pasada sobre el texto."""
+    encontrados = {}
+    for m in _RE_CABECERA.finditer(texto_pagina):
+        encontrados.setdefault(m.lastgroup, m.group(m.lastgroup))
+        if len(encontrados) == len(_CAMPOS_CABECERA):
+            break
+    
+    cabecera = {
+        campo: limpiar_monto(encontrados.get(campo))
+        for campo, _, _ in _CAMPOS_CABECERA if campo not in _CAMPOS_TEXTO
+    }
+    cabecera['rut'] = normalizar_rut(encontrados.get('rut'))
+    cabecera['nombre'] = " ".join(encontrados.get('nombre', '').split())
+    
+    # Horas base (puede ser decimal)
+    cabecera['horas_base'] = float(encontrados['horas_base']) if 'horas_base' in encontrados else 44.0
+    return cabecera
+
+def tokenizar_secciones(lineas: List[str], secciones: Tuple[Tuple[str, str, str], ...] = None) -> Tuple[Dict[str, List[Dict]], List[str]]:
+    """
+    Recorre las líneas una sola vez y extrae los items de todas las secciones.
+    Cada sección lleva su propio estado (pendiente, capturando, terminada), con las
+    mismas reglas de anclas que una búsqueda por sección. Retorna los items por tipo
+    y las líneas con forma de item que no quedaron dentro de ninguna sección.
+    """
+    secciones = tuple(secciones or SECCIONES_ITEMS)
+    patron_anclas = _patron_anclas(secciones)
+    estados = {tipo: _SECCION_PENDIENTE for tipo, _, _ in secciones}
+    items = {tipo: [] for tipo, _, _ in secciones}
+    capturando: List[str] = []
+    sin_seccion = []
     
     for linea in lineas:
         linea_upper = linea.upper()
+        atribuida = False
+        en_captura = capturando
         
-        # Detectar inicio de sección
-        if inicio in linea_upper and "TOTAL" not in linea_upper:
-            capturando = True
-            continue
-        
-        # Detectar fin de sección
-        if fin in linea_upper:
-            capturando = False
-            break
+        # Solo una línea que contiene alguna ancla puede cambiar el estado de las secciones
+        if patron_anclas.search(linea_upper):
+            es_total = "TOTAL" in linea_upper
+            en_captura = []
+            
+            for tipo, inicio, fin in secciones:
+                estado = estados[tipo]
+                if estado == _SECCION_TERMINADA:
+                    continue
+                
+                # Detectar inicio de sección
+                if inicio in linea_upper and not es_total:
+                    estados[tipo] = _SECCION_CAPTURANDO
+                    atribuida = True
+                    continue
+                
+                # Detectar fin de sección
+                if fin in linea_upper:
+                    estados[tipo] = _SECCION_TERMINADA
+                    atribuida = True
+                    continue
+                
+                if estado == _SECCION_CAPTURANDO:
+                    en_captura.append(tipo)
+            
+            capturando = [tipo for tipo, _, _ in secciones if estados[tipo] == _SECCION_CAPTURANDO]
         
-        if capturando:
-            # Buscar patrón: NOMBRE ... $ MONTO
-            match = re.search(r'^(.+?)\s+\$\s*([\d\.]+)\s*$', linea)
+        if en_captura:
+            match = _RE_ITEM.match(linea)
             if match:
                 nombre = match.group(1).strip()
-                monto = limpiar_monto(match.group(2))
+                monto = int(match.group(2).replace('.', '') or 0)  # El grupo solo trae dígitos y puntos
                 
                 # Filtrar líneas que no son items reales
                 if monto > 0 and len(nombre) > 3:
-                    items.append({
-                        'nombre': nombre,
-                        'monto': monto,
-                        'tipo': tipo
-                    })
+                    for tipo in en_captura:
+                        items[tipo].append({
+                            'nombre': nombre,
+                            'monto': monto,
+                            'tipo': tipo
+                        })
+        
+        # Las líneas de cabecera/totales ya tienen dueño aunque parezcan items
+        elif not atribuida and '$' in linea and _RE_ITEM.match(linea) and not _RE_CABECERA.match(linea):
+            sin_seccion.append(linea)
     
-    return items
+    return items, sin_seccion
 
-def clasificar_descuento(nombre: str) -> str:
-    """Clasifica un descuento en categorías: AFP, SALUD, IMPUESTO, CESANTIA, OTRO."""
-    nombre_upper = nombre.upper()
-    
-    if "AFP" in nombre_upper or "COTIZACION" in nombre_upper:
-        return "AFP"
-    elif any(x in nombre_upper for x in ["SALUD", "ISAPRE", "COLMENA"]):
-        return "SALUD"
-    elif "IMPUESTO" in nombre_upper:
-        return "IMPUESTO"
-    elif "CESANTIA" in nombre_upper or "CESANTÍA" in nombre_upper:
-        return "CESANTIA"
-    else:
-        return "OTRO"
+@lru_cache(maxsize=None)
+def _patron_anclas(secciones: Tuple[Tuple[str, str, str], ...]) -> re.Pattern:
+    """
+    Patrón que detecta si una línea (ya en mayúsculas) puede cambiar el estado de
+    alguna sección. Se omiten las anclas que contienen a otra (TOTAL X contiene a X).
+    """
+    todas = {ancla for _, inicio, fin in secciones for ancla in (inicio, fin)}
+    minimas = sorted(a for a in todas if not any(b != a and b in a for b in todas))
+    return re.compile("|".join(re.escape(a) for a in minimas))
+
+def extraer_items_seccion(lineas: List[str], inicio: str, fin: str, tipo: str) -> List[Dict]:
+    """Extrae items entre dos anclas (ej: entre 'Haberes Afectos' y 'Total Haberes Afectos')."""
+    items, _ = tokenizar_secciones(lineas, ((tipo, inicio, fin),))
+    return items[tipo]
 
 def validar_liquidacion(haberes_items, haberes_afectos_total, haberes_exentos_total,
                         descuentos_items, descuentos_legales_total, otros_descuentos_total) -> Dict:
@@ -286,7 +514,7 @@ def validar_liquidacion(haberes_items, haberes_afectos_total, haberes_exentos_to
     
     # Validar Haberes Afectos
     suma_afectos = sum(h.monto for h in haberes_items if h.tipo == 'haber_afecto')
-    haberes_ok = abs(suma_afectos - haberes_afectos_total) <= 1  # Tolerancia de 1 peso
+    haberes_ok = abs(suma_afectos - haberes_afectos_total) <= TOLERANCIA_VALIDACION
     
     if not haberes_ok:
         mensajes.append(f"⚠️ Haberes Afectos: suma items={suma_afectos:,} vs total={haberes_afectos_total:,}")
@@ -294,13 +522,13 @@ def validar_liquidacion(haberes_items, haberes_afectos_total, haberes_exentos_to
     # Validar Haberes Exentos
     suma_exentos = sum(h.monto for h in haberes_items if h.tipo == 'haber_exento')
     if haberes_exentos_total > 0:
-        if abs(suma_exentos - haberes_exentos_total) > 1:
+        if abs(suma_exentos - haberes_exentos_total) > TOLERANCIA_VALIDACION:
             haberes_ok = False
             mensajes.append(f"⚠️ Haberes Exentos: suma items={suma_exentos:,} vs total={haberes_exentos_total:,}")
     
     # Validar Descuentos Legales
     suma_desc_legales = sum(d.monto for d in descuentos_items if d.tipo == 'descuento_legal')
-    descuentos_ok = abs(suma_desc_legales - descuentos_legales_total) <= 1
+    descuentos_ok = abs(suma_desc_legales - descuentos_legales_total) <= TOLERANCIA_VALIDACION
     
     if not descuentos_ok:
         mensajes.append(f"⚠️ Desc. Legales: suma items={suma_desc_legales:,} vs total={descuentos_legales_total:,}")
@@ -308,7 +536,7 @@ def validar_liquidacion(haberes_items, haberes_afectos_total, haberes_exentos_to
     # Validar Otros Descuentos
     suma_otros_desc = sum(d.monto for d in descuentos_items if d.tipo == 'descuento_otro')
     if otros_descuentos_total > 0:
-        if abs(suma_otros_desc - otros_descuentos_total) > 1:
+        if abs(suma_otros_desc - otros_descuentos_total) > TOLERANCIA_VALIDACION:
             descuentos_ok = False
             mensajes.append(f"⚠️ Otros Desc.: suma items={suma_otros_desc:,} vs total={otros_descuentos_total:,}")
     
@@ -318,435 +546,2651 @@ def validar_liquidacion(haberes_items, haberes_afectos_total, haberes_exentos_to
         'mensajes': mensajes
     }
 
-# --- FUNCIONES DE ANÁLISIS ---
-def calcular_metricas_mes(liq: LiquidacionMensual) -> Dict:
-    """Calcula métricas derivadas de una liquidación."""
-    bruto = liq.haberes_afectos_total + liq.haberes_exentos_total
+# --- CLASIFICACIÓN DE DESCUENTOS ---
+# Reglas en orden de prioridad: gana la primera cuya lista `contiene` tenga algún
+# término presente en el nombre del concepto (sin distinguir mayúsculas). Un
+# archivo JSON con esta misma forma (USM_REGLAS_DESCUENTO) las reemplaza, para
+# sumar isapres, APV o préstamos sin tocar el código.
+REGLAS_DESCUENTO_POR_DEFECTO = [
+    {'categoria': 'AFP', 'contiene': ['AFP', 'COTIZACION']},
+    {'categoria': 'SALUD', 'contiene': ['SALUD', 'ISAPRE', 'COLMENA']},
+    {'categoria': 'IMPUESTO', 'contiene': ['IMPUESTO']},
+    {'categoria': 'CESANTIA', 'contiene': ['CESANTIA', 'CESANTÍA']},
+]
+
+class ClasificadorDescuentos:
+    """
+    Motor de reglas de clasificación compilado en una sola expresión regular: una
+    alternativa por regla, cada una con un lookahead sobre sus términos. Las
+    alternativas se prueban en orden desde el inicio del nombre, así que se
+    respeta la prioridad aunque un término de menor prioridad aparezca antes.
+    El resultado se memoriza por nombre: unas pocas decenas de conceptos se
+    repiten en miles de páginas.
+    """
     
-    # Desglose de descuentos por categoría
-    afp = sum(d.monto for d in liq.descuentos_items if d.categoria == 'AFP')
-    salud = sum(d.monto for d in liq.descuentos_items if d.categoria == 'SALUD')
-    impuesto = sum(d.monto for d in liq.descuentos_items if d.categoria == 'IMPUESTO')
-    cesantia = sum(d.monto for d in liq.descuentos_items if d.categoria == 'CESANTIA')
-    otros_desc = sum(d.monto for d in liq.descuentos_items if d.categoria == 'OTRO')
+    def __init__(self, reglas: List[Dict], max_nombres: int = MAX_NOMBRES_CLASIFICADOS):
+        alternativas = []
+        for i, regla in enumerate(reglas):
+            categoria, terminos = regla.get('categoria'), regla.get('contiene')
+            if categoria not in CATEGORIAS_DESCUENTO:
+                raise ValueError(f"Regla de descuento {i + 1}: categoría {categoria!r} no es una de {CATEGORIAS_DESCUENTO}")
+            if not terminos or not all(isinstance(t, str) and t.strip() for t in terminos):
+                raise ValueError(f"Regla de descuento {i + 1}: 'contiene' debe ser una lista de textos no vacíos")
+            opciones = "|".join(re.escape(t.strip().upper()) for t in terminos)
+            alternativas.append(f"(?=.*?(?:{opciones}))(?P<r{i}>)")
+        
+        self.categorias = [regla['categoria'] for regla in reglas]
+        self.firma = hashlib.sha256(
+            json.dumps(reglas, sort_keys=True, ensure_ascii=False).encode()
+        ).hexdigest()[:16]
+        self._patron = re.compile("|".join(alternativas), re.S) if alternativas else None
+        self.clasificar = lru_cache(maxsize=max_nombres)(self._clasificar)
     
-    # Valor hora
-    horas_mes = HORAS_MENSUALES_BASE
-    valor_hora_bruto = bruto / horas_mes if horas_mes > 0 else 0
-    valor_hora_liquido = liq.liquido_a_pagar / horas_mes if horas_mes > 0 else 0
+    def _clasificar(self, nombre: str) -> str:
+        match = self._patron.match(nombre.upper()) if self._patron else None
+        return self.categorias[int(match.lastgroup[1:])] if match else 'OTRO'
     
-    return {
-        'periodo': liq.periodo,
-        'mes': liq.mes_nombre,
-        'bruto': bruto,
-        'liquido': liq.liquido_a_pagar,
-        'afp': afp,
-        'salud': salud,
-        'impuesto': impuesto,
-        'cesantia': cesantia,
-        'otros_descuentos': otros_desc,
-        'total_descuentos': liq.descuentos_legales_total + liq.otros_descuentos_total,
-        'valor_hora_bruto': valor_hora_bruto,
-        'valor_hora_liquido': valor_hora_liquido
-    }
+    def estadisticas(self) -> Dict:
+        """Aciertos de la memoización por nombre en este proceso."""
+        info = self.clasificar.cache_info()
+        consultas = info.hits + info.misses
+        return {
+            'reglas': len(self.categorias),
+            'firma': self.firma,
+            'nombres_distintos': info.currsize,
+            'hits': info.hits,
+            'misses': info.misses,
+            'tasa_aciertos': round(info.hits / consultas, 4) if consultas else None
+        }
 
-# --- INTERFAZ STREAMLIT ---
-def main():
-    # Estado de sesión
-    if 'liquidaciones' not in st.session_state:
-        st.session_state.liquidaciones = []
+def cargar_reglas_descuento(ruta: str) -> List[Dict]:
+    """Lee las reglas de clasificación desde un archivo JSON (lista de reglas en orden de prioridad)."""
+    with open(ruta, encoding='utf-8') as f:
+        reglas = json.load(f)
+    if not isinstance(reglas, list):
+        raise ValueError(f"{ruta}: se esperaba una lista de reglas")
+    return reglas
+
+@lru_cache(maxsize=None)
+def obtener_clasificador() -> ClasificadorDescuentos:
+    """Clasificador del proceso; cada worker arma el suyo en su primer uso."""
+    if RUTA_REGLAS_DESCUENTO:
+        return ClasificadorDescuentos(cargar_reglas_descuento(RUTA_REGLAS_DESCUENTO))
+    return ClasificadorDescuentos(REGLAS_DESCUENTO_POR_DEFECTO)
+
+def clasificar_descuento(nombre: str) -> str:
+    """Clasifica un descuento en categorías: AFP, SALUD, IMPUESTO, CESANTIA, OTRO."""
+    return obtener_clasificador().clasificar(nombre)
+
+# --- DIAGNÓSTICO ---
+logger_diagnostico = logging.getLogger("usm.diagnostico")
+if not logger_diagnostico.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger_diagnostico.addHandler(_handler)
+    logger_diagnostico.setLevel(NIVEL_LOG_DIAGNOSTICO or "WARNING")
+    logger_diagnostico.propagate = False
+
+def memoria_actual_mb() -> Optional[float]:
+    """Memoria residente actual (MB) de este proceso; None si el sistema no la expone (solo Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, AttributeError, ValueError, IndexError):
+        return None
+
+# Claves de los tiempos de una página que no son duraciones
+_CLAVES_NO_DURACION = ('pagina', 'memoria_mb')
+
+class RegistroTiempos:
+    """
+    Mide las etapas de un flujo (ingesta de un PDF, render del dashboard) y las
+    duraciones por página que reportan los workers. La memoria pico es la mayor
+    memoria residente vista durante el flujo: la de este proceso al cerrar cada
+    etapa y la que cada worker anota al extraer el texto de una página. No es el
+    pico histórico del proceso, que en un servidor no dice nada de este flujo.
+    """
     
-    # SIDEBAR: Carga de datos
-    with st.sidebar:
-        st.header("📥 Carga de Liquidaciones")
-        
-        archivo = st.file_uploader(
-            "Sube tu PDF (multi-página)", 
-            type="pdf",
-            help="Cada página debe contener una liquidación mensual"
-        )
+    def __init__(self, flujo: str):
+        self.flujo = flujo
+        self.etapas: Dict[str, float] = {}
+        self.paginas: List[Dict] = []
+        self._memoria: List[float] = []
+        self._inicio = time.perf_counter()
+    
+    def _medir_memoria(self):
+        memoria = memoria_actual_mb()
+        if memoria is not None:
+            self._memoria.append(memoria)
+    
+    @contextmanager
+    def etapa(self, nombre: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.etapas[nombre] = self.etapas.get(nombre, 0.0) + time.perf_counter() - t
+            self._medir_memoria()
+    
+    def agregar_paginas(self, tiempos_paginas: List[Dict]):
+        self.paginas.extend(tiempos_paginas)
+    
+    def resumen(self) -> Dict:
+        total = time.perf_counter() - self._inicio
+        self._medir_memoria()
+        # Suma de lo que gastaron los workers en cada etapa de página (tiempo de CPU, no de reloj)
+        etapas_paginas: Dict[str, float] = {}
+        for pagina in self.paginas:
+            for etapa, segundos in pagina.items():
+                if etapa not in _CLAVES_NO_DURACION:
+                    etapas_paginas[etapa] = etapas_paginas.get(etapa, 0.0) + segundos
         
-        if st.button("📊 Procesar PDF", type="primary"):
-            if archivo:
-                with st.spinner("Procesando liquidaciones..."):
-                    liquidaciones_nuevas = []
-                    
-                    with pdfplumber.open(archivo) as pdf:
-                        for i, page in enumerate(pdf.pages, 1):
-                            texto = page.extract_text()
-                            liq = extraer_liquidacion_desde_pagina(texto)
-                            
-                            if liq:
-                                liquidaciones_nuevas.append(liq)
-                            else:
-                                st.warning(f"No se pudo procesar la página {i}")
-                    
-                    # Actualizar estado (evitar duplicados por periodo)
-                    periodos_existentes = {l.periodo for l in st.session_state.liquidaciones}
-                    
-                    for liq in liquidaciones_nuevas:
-                        if liq.periodo not in periodos_existentes:
-                            st.session_state.liquidaciones.append(liq)
-                        else:
-                            # Reemplazar si ya existe
-                            st.session_state.liquidaciones = [
-                                l for l in st.session_state.liquidaciones 
-                                if l.periodo != liq.periodo
-                            ]
-                            st.session_state.liquidaciones.append(liq)
-                    
-                    # Ordenar por periodo
-                    st.session_state.liquidaciones.sort(key=lambda x: x.periodo)
-                    
-                    st.success(f"✅ {len(liquidaciones_nuevas)} liquidaciones procesadas")
-                    st.rerun()
+        mas_lentas = sorted(
+            self.paginas, key=lambda p: sum(v for k, v in p.items() if k not in _CLAVES_NO_DURACION), reverse=True
+        )[:5]
+        memoria = self._memoria + [p['memoria_mb'] for p in self.paginas if p.get('memoria_mb') is not None]
+        return {
+            'flujo': self.flujo,
+            'total_s': round(total, 4),
+            'etapas_s': {k: round(v, 4) for k, v in self.etapas.items()},
+            'paginas': len(self.paginas),
+            'paginas_por_segundo': round(len(self.paginas) / total, 2) if self.paginas and total > 0 else None,
+            'etapas_paginas_s': {k: round(v, 4) for k, v in etapas_paginas.items()},
+            'paginas_mas_lentas': [p['pagina'] for p in mas_lentas],
+            'paginas_con_respaldo_layout': sum('texto_layout' in p for p in self.paginas),
+            'memoria_pico_mb': max(memoria) if memoria else None
+        }
+    
+    def emitir_log(self) -> Dict:
+        """Emite el resumen como una línea JSON y lo retorna."""
+        resumen = self.resumen()
+        logger_diagnostico.info(json.dumps({'evento': 'tiempos', **resumen}, ensure_ascii=False))
+        return resumen
+
+# --- PRE-FILTRO DE PÁGINAS ---
+_RE_ANCLA_LIQUIDACION = re.compile(r"Liquidaci\S{1,2}n\s*de\s*sueldo", re.I)
+_COLA_PREFILTRO = 64  # Caracteres que se arrastran entre strings, por si el ancla queda partida
+
+class _AnclaEncontrada(Exception):
+    pass
+
+class _DetectorAncla(PDFDevice):
+    """
+    Dispositivo de pdfminer que solo decodifica el texto del content stream (sin
+    posiciones, colores ni objetos de layout) y corta la interpretación de la
+    página apenas aparece el ancla.
+    """
+    
+    def __init__(self, rsrcmgr):
+        super().__init__(rsrcmgr)
+        self._cola = ""
+    
+    def render_string(self, textstate, seq, ncs, graphicstate):
+        font = textstate.font
+        caracteres = []
+        for obj in seq:
+            if isinstance(obj, str):
+                obj = make_compat_bytes(obj)
+            if not isinstance(obj, bytes):
+                continue  # Ajustes de espaciado dentro de TJ
+            for cid in font.decode(obj):
+                try:
+                    caracteres.append(font.to_unichr(cid))
+                except PDFUnicodeNotDefined:
+                    pass
         
-        if st.session_state.liquidaciones:
-            st.divider()
-            st.metric("Total Liquidaciones", len(st.session_state.liquidaciones))
+        texto = self._cola + "".join(caracteres)
+        if _RE_ANCLA_LIQUIDACION.search(texto):
+            raise _AnclaEncontrada
+        self._cola = texto[-_COLA_PREFILTRO:]
+
+def _huella_objeto(objeto, memo: Dict[int, bytes]) -> bytes:
+    """
+    Digest del contenido de un objeto PDF, siguiendo sus referencias. `memo` guarda
+    el de cada objeto indirecto: las fuentes y XObjects compartidos por las páginas
+    de un documento se recorren una vez.
+    """
+    if isinstance(objeto, PDFObjRef):
+        if objeto.objid not in memo:
+            memo[objeto.objid] = b""  # Corta los ciclos de referencias
+            memo[objeto.objid] = _huella_objeto(objeto.resolve(), memo)
+        return memo[objeto.objid]
+    
+    sha = hashlib.sha256()
+    if isinstance(objeto, PDFStream):
+        sha.update(b"stream")
+        sha.update(_huella_objeto(objeto.attrs, memo))
+        try:
+            sha.update(objeto.get_data())
+        except Exception:  # Filtro que pdfminer no sabe decodificar
+            sha.update(objeto.get_rawdata() or b"")
+    elif isinstance(objeto, dict):
+        sha.update(b"dict")
+        for clave in sorted(objeto):
+            if clave != 'Parent':  # Subiría al árbol de páginas completo
+                sha.update(repr(clave).encode())
+                sha.update(_huella_objeto(objeto[clave], memo))
+    elif isinstance(objeto, (list, tuple)):
+        sha.update(b"array")
+        for elemento in objeto:
+            sha.update(_huella_objeto(elemento, memo))
+    else:
+        sha.update(repr(objeto).encode())
+    return sha.digest()
+
+def huella_pagina(pagina, memo: Optional[Dict[int, bytes]] = None) -> str:
+    """
+    SHA-256 de los content streams de una página y de los recursos que dibujan
+    (XObjects, fuentes), junto con la versión del extractor y las reglas de
+    clasificación. Las páginas que se repiten entre exportaciones acumulativas
+    tienen la misma huella, y calcularla no requiere interpretar la página.
+    `memo` se comparte entre las páginas de un mismo documento.
+    """
+    memo = {} if memo is None else memo
+    sha = hashlib.sha256(f"{VERSION_EXTRACTOR}:{obtener_clasificador().firma}".encode())
+    for contenido in pagina.page_obj.contents:
+        sha.update(stream_value(contenido).get_data())
+    sha.update(_huella_objeto(pagina.page_obj.resources, memo))
+    return sha.hexdigest()
+
+def parece_liquidacion(pagina) -> bool:
+    """
+    Pre-clasificación barata de una página de pdfplumber: busca "Liquidación de
+    sueldo" en el texto crudo del content stream, que suele traer la cabecera al
+    principio. Las portadas, anexos y hojas de firma se descartan sin pagar la
+    extracción con layout. Ante cualquier error la página se considera candidata.
+    """
+    detector = _DetectorAncla(pagina.pdf.rsrcmgr)
+    try:
+        PDFPageInterpreter(pagina.pdf.rsrcmgr, detector).process_page(pagina.page_obj)
+    except _AnclaEncontrada:
+        return True
+    except Exception:
+        return True
+    return False
+
+# --- EXTRACCIÓN PARALELA ---
+FuentePDF = Union[str, bytes]  # Ruta del PDF en disco o su contenido en memoria
+
+def contexto_procesos():
+    """
+    Contexto de multiprocessing de los pools de extracción: forkserver (o spawn
+    donde no existe), nunca fork. El servidor de Streamlit tiene varios hilos y un
+    hijo forkeado mientras otro hilo tiene un lock tomado (logging, PDFium, SQLite)
+    puede quedar bloqueado para siempre.
+    """
+    metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(metodo)
+
+@dataclass
+class ResultadoPagina:
+    pagina: int
+    estado: str  # 'extraida', 'fallida', 'omitida' (sin cabecera) o 'sin_cambios' (huella ya conocida)
+    huella: str
+    tiempos: Dict[str, float]
+    liquidacion: Optional[LiquidacionMensual] = None
+
+@contextmanager
+def abrir_pdf(fuente: FuentePDF, paginas: Optional[range] = None):
+    """
+    Abre un PDF con pdfplumber. Una ruta se lee mediante mmap: los procesos que
+    abren el mismo archivo comparten sus páginas en la caché del sistema operativo
+    en vez de recibir cada uno una copia de los bytes.
+    """
+    if isinstance(fuente, bytes):
+        with pdfplumber.open(io.BytesIO(fuente), pages=paginas) as pdf:
+            yield pdf
+        return
+    
+    with open(fuente, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+        with pdfplumber.open(mapa, pages=paginas) as pdf:
+            yield pdf
+
+class BackendTexto:
+    """
+    Primer intento de extracción de texto de una página. Este backend base no
+    tiene camino rápido (retorna None) y deja todo al análisis de layout de
+    pdfplumber, que es también el respaldo de los demás backends.
+    """
+    nombre = "pdfplumber"
+    
+    def __init__(self, fuente: FuentePDF):
+        pass
+    
+    def texto(self, numero_pagina: int) -> Optional[str]:
+        return None
+    
+    def cerrar(self):
+        pass
+
+# PDFium no es thread-safe: las ingestas secuenciales corren en varios hilos del mismo proceso
+_LOCK_PDFIUM = threading.Lock()
+
+class BackendPdfium(BackendTexto):
+    """
+    Texto crudo de PDFium (la librería que pdfplumber ya usa para renderizar), en
+    el orden del content stream y sin análisis de layout. En las liquidaciones
+    generadas por sistema, cuya capa de texto viene limpia, da el mismo texto
+    que pdfplumber a una fracción del costo.
+    """
+    nombre = "pdfium"
+    
+    def __init__(self, fuente: FuentePDF):
+        with _LOCK_PDFIUM:
+            self._documento = pdfium.PdfDocument(fuente)
+    
+    def texto(self, numero_pagina: int) -> Optional[str]:
+        with _LOCK_PDFIUM:
+            pagina = self._documento[numero_pagina - 1]
+            try:
+                capa_texto = pagina.get_textpage()
+                try:
+                    return capa_texto.get_text_range().replace("\r\n", "\n")
+                finally:
+                    capa_texto.close()
+            finally:
+                pagina.close()
+    
+    def cerrar(self):
+        with _LOCK_PDFIUM:
+            self._documento.close()
+
+BACKENDS_TEXTO = {backend.nombre: backend for backend in (BackendTexto, BackendPdfium)}
+
+@contextmanager
+def abrir_backend_texto(fuente: FuentePDF, nombre: Optional[str] = None):
+    """Abre el backend pedido; si no logra abrir el PDF, el documento completo va por layout."""
+    clase = BACKENDS_TEXTO[nombre or BACKEND_TEXTO]
+    try:
+        backend = clase(fuente)
+    except Exception as e:
+        logger_diagnostico.warning(json.dumps(
+            {'evento': 'error_backend_texto', 'backend': clase.nombre, 'error': repr(e)}, ensure_ascii=False
+        ))
+        backend = BackendTexto(fuente)
+    try:
+        yield backend
+    finally:
+        backend.cerrar()
+
+def _iterar_paginas(fuente: FuentePDF, inicio: int, fin: int,
+                    conocidas: frozenset = frozenset()) -> Iterator[ResultadoPagina]:
+    """
+    Procesa una a una las páginas [inicio, fin) de un PDF con un único handle de
+    pdfplumber. Solo se instancian las páginas del rango y cada una libera su
+    layout apenas se extrae el texto, así la memoria no crece con el documento.
+    Las páginas cuya huella está en `conocidas` se resuelven sin extraer su texto.
+    El resto se intenta primero con el backend rápido (BACKEND_TEXTO); si su texto
+    no da una liquidación válida, la página pasa por el pre-filtro y el análisis
+    de layout de pdfplumber, como respaldo (también si el backend rápido falla).
+    Cada página va con sus tiempos: apertura (prorrateada en el rango), huella,
+    texto, prefiltro, texto_layout (solo si hubo respaldo), parseo y validación,
+    más la memoria residente del worker tras extraer el texto (memoria_mb).
+    """
+    t = time.perf_counter()
+    with abrir_pdf(fuente, range(inicio + 1, fin + 1)) as pdf, abrir_backend_texto(fuente) as backend:
+        apertura = (time.perf_counter() - t) / max(fin - inicio, 1)
+        memo_huellas = {}
+        for pagina in pdf.pages:
+            tiempos = {'pagina': pagina.page_number, 'apertura': apertura}
+            t = time.perf_counter()
+            huella = huella_pagina(pagina, memo_huellas)
+            tiempos['huella'] = time.perf_counter() - t
+            if huella in conocidas:
+                yield ResultadoPagina(pagina.page_number, 'sin_cambios', huella, tiempos)
+                continue
             
-            # Mostrar validaciones
-            validaciones_fallidas = [
-                liq for liq in st.session_state.liquidaciones 
-                if not (liq.validacion_haberes_ok and liq.validacion_descuentos_ok)
-            ]
+            t = time.perf_counter()
+            try:
+                texto_rapido = backend.texto(pagina.page_number)
+            except Exception as e:
+                # Un error del backend rápido equivale a no tener texto rápido: va por layout
+                logger_diagnostico.warning(json.dumps(
+                    {'evento': 'error_backend_texto', 'backend': backend.nombre,
+                     'pagina': pagina.page_number, 'error': repr(e)}, ensure_ascii=False
+                ))
+                texto_rapido = None
+            if texto_rapido is not None:
+                tiempos['texto'] = time.perf_counter() - t
+                liq = extraer_liquidacion_desde_pagina(texto_rapido, tiempos)
+                if liq and liq.validacion_haberes_ok and liq.validacion_descuentos_ok:
+                    tiempos['memoria_mb'] = memoria_actual_mb()
+                    pagina.close()
+                    yield ResultadoPagina(pagina.page_number, 'extraida', huella, tiempos, liq)
+                    continue
+                if PREFILTRO_CABECERA and texto_rapido.strip() and not _RE_ANCLA_LIQUIDACION.search(texto_rapido):
+                    # Hay capa de texto y no es una liquidación: ni pre-filtro ni layout
+                    pagina.close()
+                    yield ResultadoPagina(pagina.page_number, 'omitida', huella, tiempos)
+                    continue
             
-            if validaciones_fallidas:
-                st.warning(f"⚠️ {len(validaciones_fallidas)} con advertencias")
-                with st.expander("Ver detalles"):
-                    for liq in validaciones_fallidas:
-                        st.write(f"**{liq.mes_nombre}**")
-                        for msg in liq.mensajes_validacion:
-                            st.write(msg)
+            # Respaldo (o único camino, sin backend rápido): pre-filtro y layout
+            if PREFILTRO_CABECERA:
+                t = time.perf_counter()
+                candidata = parece_liquidacion(pagina)
+                tiempos['prefiltro'] = time.perf_counter() - t
+                if not candidata:
+                    pagina.close()
+                    yield ResultadoPagina(pagina.page_number, 'omitida', huella, tiempos)
+                    continue
             
-            if st.button("🗑️ Limpiar datos"):
-                st.session_state.liquidaciones = []
-                st.rerun()
+            t = time.perf_counter()
+            texto = pagina.extract_text() or ""
+            tiempos['memoria_mb'] = memoria_actual_mb()  # Con el layout de la página aún en memoria
+            pagina.close()
+            tiempos['texto' if texto_rapido is None else 'texto_layout'] = time.perf_counter() - t
+            liq = extraer_liquidacion_desde_pagina(texto, tiempos)
+            yield ResultadoPagina(pagina.page_number, 'extraida' if liq else 'fallida', huella, tiempos, liq)
+
+def _procesar_rango_paginas(fuente: FuentePDF, inicio: int, fin: int,
+                            conocidas: frozenset = frozenset()) -> List[ResultadoPagina]:
+    """Procesa las páginas [inicio, fin) dentro de un proceso del pool."""
+    return list(_iterar_paginas(fuente, inicio, fin, conocidas))
+
+def contar_paginas(fuente: FuentePDF) -> int:
+    with abrir_pdf(fuente) as pdf:
+        return len(pdf.pages)
+
+def iterar_resultados_pdf(fuente: FuentePDF, n_paginas: int, max_workers: Optional[int] = None,
+                          conocidas: frozenset = frozenset(),
+                          pool: Optional[ProcessPoolExecutor] = None) -> Iterator[List[ResultadoPagina]]:
+    """
+    Genera los resultados del PDF por tramos de páginas, en orden, a medida que
+    terminan. Permite persistir y reportar avance sin esperar al PDF completo.
+    Con una ruta, cada proceso abre el archivo por su cuenta y solo recibe
+    (ruta, inicio, fin); con bytes, cada rango lleva una copia del contenido.
+    Las páginas con huella en `conocidas` se entregan como 'sin_cambios'.
     
-    # MAIN CONTENT
-    if not st.session_state.liquidaciones:
-        st.title("📊 Gestión Salarial USM PRO")
-        st.info("👈 Sube un PDF desde el panel lateral para comenzar")
-        
-        st.markdown("""
-        ### Características:
-        - ✅ Extracción automática de liquidaciones
-        - ✅ Validación de totales
-        - ✅ Dashboard anual y mensual
-        - ✅ Análisis de descuentos
-        - ✅ Valor hora bruto y líquido
-        """)
+    Los tramos tienen a lo más PAGINAS_POR_TRAMO páginas y solo hay
+    TRAMOS_EN_VUELO_POR_WORKER por proceso encargados a la vez: si el consumidor
+    se atrasa no se encargan más, así la memoria no depende del largo del PDF.
+    
+    Con `pool`, los rangos se encargan a ese pool compartido (sin cerrarlo al
+    terminar), incluso si el PDF tiene un solo rango: así varios PDFs chicos se
+    extraen en paralelo en vez de uno por hilo.
+    """
+    workers = min(max_workers or MAX_WORKERS_EXTRACCION, max(n_paginas, 1))
+    n_tareas = max(min(n_paginas, workers * TAREAS_POR_WORKER), -(-n_paginas // PAGINAS_POR_TRAMO), 1)
+    tamano = max(-(-n_paginas // n_tareas), 1)  # División con redondeo hacia arriba
+    rangos = [(i, min(i + tamano, n_paginas)) for i in range(0, n_paginas, tamano)]
+    
+    if pool is None and (workers <= 1 or len(rangos) <= 1):
+        # Secuencial: un solo handle para todo el PDF, entregado por tramos
+        tramo = []
+        for resultado in _iterar_paginas(fuente, 0, n_paginas, conocidas):
+            tramo.append(resultado)
+            if len(tramo) == tamano:
+                yield tramo
+                tramo = []
+        if tramo:
+            yield tramo
         return
     
-    # Crear DataFrame de métricas
-    metricas = [calcular_metricas_mes(liq) for liq in st.session_state.liquidaciones]
-    df = pd.DataFrame(metricas)
+    with nullcontext(pool) if pool else ProcessPoolExecutor(max_workers=workers, mp_context=contexto_procesos()) as ejecutor:
+        en_vuelo = deque()
+        try:
+            for inicio, fin in rangos:
+                en_vuelo.append(ejecutor.submit(_procesar_rango_paginas, fuente, inicio, fin, conocidas))
+                if len(en_vuelo) >= workers * TRAMOS_EN_VUELO_POR_WORKER:
+                    # Se entrega en orden de página: se espera el tramo más antiguo
+                    yield en_vuelo.popleft().result()
+            while en_vuelo:
+                yield en_vuelo.popleft().result()
+        finally:
+            # Si el consumidor abandona el generador, no seguir extrayendo
+            for futuro in en_vuelo:
+                futuro.cancel()
+
+def procesar_pdf(fuente: FuentePDF, max_workers: Optional[int] = None,
+                 registro: Optional[RegistroTiempos] = None) -> Tuple[List[LiquidacionMensual], List[int], List[int]]:
+    """
+    Extrae las liquidaciones de un PDF repartiendo sus páginas entre procesos.
+    Retorna las liquidaciones en orden de página, los números de página fallidos
+    y los de las páginas omitidas por no ser liquidaciones.
+    """
+    registro = registro or RegistroTiempos('procesar_pdf')
     
-    # TABS: Dashboard Anual vs Mensual
-    tab_anual, tab_mensual, tab_detalle = st.tabs(["📅 Anual", "📆 Mensual", "📋 Detalle"])
+    with registro.etapa('conteo_paginas'):
+        n_paginas = contar_paginas(fuente)
     
-    # --- TAB ANUAL ---
-    with tab_anual:
-        st.title("📅 Dashboard Anual")
-        
-        # Agregar por año
-        df['anio'] = df['periodo'].str[:4]
-        df_anual = df.groupby('anio').agg({
-            'bruto': 'sum',
-            'liquido': 'sum',
-            'afp': 'sum',
-            'salud': 'sum',
-            'impuesto': 'sum',
-            'cesantia': 'sum',
-            'otros_descuentos': 'sum',
-            'total_descuentos': 'sum'
-        }).reset_index()
-        
-        # KPIs Anuales
-        col1, col2, col3, col4 = st.columns(4)
-        
-        ultimo_anio = df_anual.iloc[-1]
-        col1.metric("Bruto Anual", f"${ultimo_anio['bruto']:,.0f}")
-        col2.metric("Líquido Anual", f"${ultimo_anio['liquido']:,.0f}")
-        col3.metric("Descuentos Totales", f"${ultimo_anio['total_descuentos']:,.0f}")
-        col4.metric("% Descuento", f"{(ultimo_anio['total_descuentos']/ultimo_anio['bruto']*100):.1f}%")
-        
-        st.divider()
-        
-        # Gráfico de barras: Bruto vs Líquido por año
-        fig_anual = go.Figure()
-        fig_anual.add_trace(go.Bar(
-            name='Bruto',
-            x=df_anual['anio'],
-            y=df_anual['bruto'],
-            marker_color='#3b82f6'
-        ))
-        fig_anual.add_trace(go.Bar(
-            name='Líquido',
-            x=df_anual['anio'],
-            y=df_anual['liquido'],
-            marker_color='#10b981'
-        ))
-        fig_anual.update_layout(
-            title="Ingresos Anuales: Bruto vs Líquido",
-            barmode='group',
-            height=400
-        )
-        st.plotly_chart(fig_anual, use_container_width=True)
-        
-        # Descuentos anuales
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            fig_desc_anual = px.bar(
-                df_anual,
-                x='anio',
-                y=['afp', 'salud', 'impuesto', 'cesantia'],
-                title="Descuentos Legales por Año",
-                labels={'value': 'Monto ($)', 'variable': 'Tipo'},
-                barmode='group'
-            )
-            st.plotly_chart(fig_desc_anual, use_container_width=True)
-        
-        with col2:
-            # Tabla resumen anual
-            st.subheader("Resumen Anual")
-            st.dataframe(
-                df_anual.style.format({
-                    'bruto': '${:,.0f}',
-                    'liquido': '${:,.0f}',
-                    'afp': '${:,.0f}',
-                    'salud': '${:,.0f}',
-                    'impuesto': '${:,.0f}',
-                    'total_descuentos': '${:,.0f}'
-                }),
-                use_container_width=True,
-                height=400
-            )
+    resultados = []
+    with registro.etapa('extraccion'):
+        for tramo in iterar_resultados_pdf(fuente, n_paginas, max_workers):
+            resultados.extend(tramo)
     
-    # --- TAB MENSUAL ---
-    with tab_mensual:
-        st.title("📆 Dashboard Mensual")
-        
-        # Filtro de año
-        anios_disponibles = sorted(df['anio'].unique())
-        anio_seleccionado = st.selectbox(
-            "Selecciona el año",
-            anios_disponibles,
-            index=len(anios_disponibles) - 1
-        )
-        
-        df_anio = df[df['anio'] == anio_seleccionado].copy()
-        
-        # KPIs del año seleccionado
-        st.subheader(f"Resumen {anio_seleccionado}")
-        col1, col2, col3, col4 = st.columns(4)
-        
-        col1.metric("Bruto Acumulado", f"${df_anio['bruto'].sum():,.0f}")
-        col2.metric("Líquido Acumulado", f"${df_anio['liquido'].sum():,.0f}")
-        col3.metric("Promedio Mensual Líq.", f"${df_anio['liquido'].mean():,.0f}")
-        col4.metric("Meses Registrados", len(df_anio))
+    registro.agregar_paginas([r.tiempos for r in resultados])
+    liquidaciones = [r.liquidacion for r in resultados if r.liquidacion]
+    paginas_fallidas = [r.pagina for r in resultados if r.estado == 'fallida']
+    paginas_omitidas = [r.pagina for r in resultados if r.estado == 'omitida']
+    return liquidaciones, paginas_fallidas, paginas_omitidas
+
+# --- CACHÉ DE PDFs PROCESADOS ---
+class CachePDF:
+    """
+    Caché LRU de resultados de extracción, indexada por el SHA-256 del PDF.
+    Guarda los resultados serializados: el tamaño en bytes es exacto para el
+    presupuesto de memoria y cada sesión recibe su propia copia de los objetos.
+    """
+    
+    def __init__(self, max_entradas: int = CACHE_PDF_MAX_ENTRADAS, max_mb: float = CACHE_PDF_MAX_MB):
+        self.max_entradas = max_entradas
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._entradas: "OrderedDict[str, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def huella(datos: bytes) -> str:
+        return hashlib.sha256(datos).hexdigest()
+    
+    def obtener(self, huella: str) -> Optional[List[ResultadoPagina]]:
+        with self._lock:
+            serializado = self._entradas.get(huella)
+            if serializado is None:
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(huella)
+            self.hits += 1
+        return pickle.loads(serializado)
+    
+    def guardar(self, huella: str, resultado: List[ResultadoPagina]):
+        serializado = pickle.dumps(resultado, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(serializado) > self.max_bytes:
+            return  # Nunca cabría: no vaciar la caché por un solo PDF
         
-        st.divider()
+        with self._lock:
+            anterior = self._entradas.pop(huella, None)
+            if anterior is not None:
+                self._bytes -= len(anterior)
+            
+            self._entradas[huella] = serializado
+            self._bytes += len(serializado)
+            
+            # Expulsar las menos usadas hasta respetar ambos límites
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                _, expulsado = self._entradas.popitem(last=False)
+                self._bytes -= len(expulsado)
+    
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+    
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                'entradas': len(self._entradas),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'tasa_aciertos': self.hits / consultas if consultas else 0.0
+            }
+
+@st.cache_resource
+def obtener_cache_pdf() -> CachePDF:
+    """Instancia única de la caché para todo el servidor (sobrevive a los reruns)."""
+    return CachePDF()
+
+# --- PERSISTENCIA ---
+_ESQUEMA_BD = """
+CREATE TABLE IF NOT EXISTS liquidaciones (
+    rut TEXT NOT NULL,
+    periodo TEXT NOT NULL,
+    nombre TEXT NOT NULL,
+    mes_nombre TEXT NOT NULL,
+    dias_trabajados INTEGER NOT NULL,
+    dias_licencia INTEGER NOT NULL,
+    dias_ausencia INTEGER NOT NULL,
+    dias_vacaciones INTEGER NOT NULL,
+    horas_base_semanal REAL NOT NULL,
+    sueldo_base INTEGER NOT NULL,
+    haberes_afectos_total INTEGER NOT NULL,
+    haberes_exentos_total INTEGER NOT NULL,
+    descuentos_legales_total INTEGER NOT NULL,
+    otros_descuentos_total INTEGER NOT NULL,
+    liquido_a_pagar INTEGER NOT NULL,
+    total_imponible INTEGER NOT NULL,
+    total_tributable INTEGER NOT NULL,
+    validacion_haberes_ok INTEGER NOT NULL,
+    validacion_descuentos_ok INTEGER NOT NULL,
+    mensajes_validacion TEXT NOT NULL,
+    lineas_sin_seccion TEXT NOT NULL,
+    PRIMARY KEY (rut, periodo)
+);
+CREATE TABLE IF NOT EXISTS haberes (
+    rut TEXT NOT NULL,
+    periodo TEXT NOT NULL,
+    orden INTEGER NOT NULL,
+    nombre TEXT NOT NULL,
+    monto INTEGER NOT NULL,
+    tipo TEXT NOT NULL,
+    PRIMARY KEY (rut, periodo, orden)
+);
+CREATE TABLE IF NOT EXISTS descuentos (
+    rut TEXT NOT NULL,
+    periodo TEXT NOT NULL,
+    orden INTEGER NOT NULL,
+    nombre TEXT NOT NULL,
+    monto INTEGER NOT NULL,
+    tipo TEXT NOT NULL,
+    categoria TEXT NOT NULL,
+    PRIMARY KEY (rut, periodo, orden)
+);
+CREATE TABLE IF NOT EXISTS paginas (
+    huella TEXT PRIMARY KEY,
+    rut TEXT,  -- rut y periodo son NULL si la página no es una liquidación
+    periodo TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_paginas_clave ON paginas (rut, periodo);
+-- Las claves primarias empiezan por rut: las lecturas de toda la empresa por rango de periodos usan estos
+CREATE INDEX IF NOT EXISTS idx_liquidaciones_periodo ON liquidaciones (periodo);
+CREATE INDEX IF NOT EXISTS idx_haberes_tipo ON haberes (tipo);
+DROP INDEX IF EXISTS idx_descuentos_categoria;  -- Reemplazado por el de (categoria, periodo)
+CREATE INDEX IF NOT EXISTS idx_descuentos_categoria_periodo ON descuentos (categoria, periodo);
+"""
+
+# Agregados materializados del dashboard. `metricas` tiene los montos de cada
+# liquidación (los de calcular_metricas_mes) y sus triggers mantienen, en cada alta
+# o baja, los resúmenes anuales por empleado y de toda la empresa (rut '*') y el
+# resumen mensual de la empresa: los KPIs se leen sin recorrer el historial.
+_COLUMNAS_MONTO = ['bruto', 'liquido', 'afp', 'salud', 'impuesto', 'cesantia',
+                   'otros_descuentos', 'total_descuentos']
+
+def _sql_montos(plantilla: str) -> str:
+    return ", ".join(plantilla.format(c=c) for c in _COLUMNAS_MONTO)
+
+# Páginas de los lotes en curso (ver LoteIngesta). Es una tabla temporal de la
+# conexión: vive en disco, no en memoria, y desaparece con el proceso.
+_ESQUEMA_LOTE = """
+CREATE TEMP TABLE IF NOT EXISTS paginas_lote (
+    trabajo INTEGER NOT NULL,  -- Id del trabajo: sigue el orden de carga del lote
+    pagina INTEGER NOT NULL,
+    huella TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    rut TEXT,
+    periodo TEXT,
+    liquidacion BLOB,  -- LiquidacionMensual serializada, solo si la página se extrajo
+    PRIMARY KEY (trabajo, pagina)
+);
+CREATE INDEX IF NOT EXISTS temp.idx_paginas_lote_clave ON paginas_lote (rut, periodo);
+"""
+
+_ESQUEMA_AGREGADOS = f"""
+CREATE TABLE IF NOT EXISTS metricas (
+    rut TEXT NOT NULL,
+    periodo TEXT NOT NULL,
+    mes TEXT NOT NULL,
+    {_sql_montos("{c} INTEGER NOT NULL")},
+    PRIMARY KEY (rut, periodo)
+);
+CREATE TABLE IF NOT EXISTS resumen_anual (
+    rut TEXT NOT NULL,
+    anio TEXT NOT NULL,
+    liquidaciones INTEGER NOT NULL,
+    {_sql_montos("{c} INTEGER NOT NULL")},
+    PRIMARY KEY (rut, anio)
+);
+CREATE TABLE IF NOT EXISTS resumen_mensual (
+    periodo TEXT PRIMARY KEY,
+    mes TEXT NOT NULL,
+    empleados INTEGER NOT NULL,
+    {_sql_montos("{c} INTEGER NOT NULL")}
+);
+CREATE TRIGGER IF NOT EXISTS metricas_alta AFTER INSERT ON metricas BEGIN
+    INSERT INTO resumen_anual VALUES
+        (NEW.rut, substr(NEW.periodo, 1, 4), 1, {_sql_montos("NEW.{c}")}),
+        ('*', substr(NEW.periodo, 1, 4), 1, {_sql_montos("NEW.{c}")})
+    ON CONFLICT (rut, anio) DO UPDATE SET
+        liquidaciones = liquidaciones + 1, {_sql_montos("{c} = {c} + excluded.{c}")};
+    INSERT INTO resumen_mensual VALUES (NEW.periodo, NEW.mes, 1, {_sql_montos("NEW.{c}")})
+    ON CONFLICT (periodo) DO UPDATE SET
+        empleados = empleados + 1, {_sql_montos("{c} = {c} + excluded.{c}")};
+END;
+CREATE TRIGGER IF NOT EXISTS metricas_baja AFTER DELETE ON metricas BEGIN
+    UPDATE resumen_anual SET liquidaciones = liquidaciones - 1, {_sql_montos("{c} = {c} - OLD.{c}")}
+    WHERE rut IN (OLD.rut, '*') AND anio = substr(OLD.periodo, 1, 4);
+    DELETE FROM resumen_anual
+    WHERE rut IN (OLD.rut, '*') AND anio = substr(OLD.periodo, 1, 4) AND liquidaciones = 0;
+    UPDATE resumen_mensual SET empleados = empleados - 1, {_sql_montos("{c} = {c} - OLD.{c}")}
+    WHERE periodo = OLD.periodo;
+    DELETE FROM resumen_mensual WHERE periodo = OLD.periodo AND empleados = 0;
+END;
+"""
+
+# 1: un solo empleado, clave periodo. 2: clave (rut, periodo). 3: agregados materializados
+VERSION_ESQUEMA_BD = 3
+
+# Columnas escalares de LiquidacionMensual, en el orden de la tabla (la clave primero)
+_COLUMNAS_LIQUIDACION = [
+    'rut', 'periodo', 'nombre', 'mes_nombre', 'dias_trabajados', 'dias_licencia', 'dias_ausencia',
+    'dias_vacaciones', 'horas_base_semanal', 'sueldo_base', 'haberes_afectos_total',
+    'haberes_exentos_total', 'descuentos_legales_total', 'otros_descuentos_total',
+    'liquido_a_pagar', 'total_imponible', 'total_tributable',
+    'validacion_haberes_ok', 'validacion_descuentos_ok'
+]
+
+class AlmacenLiquidaciones:
+    """
+    Almacén SQLite de liquidaciones con sus items. Cada (rut, periodo) se guarda
+    una sola vez: volver a guardarlo reemplaza la liquidación y todos sus items.
+    También registra las huellas de las páginas ya ingeridas.
+    """
+    
+    def __init__(self, ruta: str = RUTA_BD):
+        self.ruta = ruta
+        self._conn = sqlite3.connect(ruta, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._escrituras = 0  # Ver version()
+        with self._lock, self._conn:
+            if ruta != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < 2:
+                self._migrar_v1()
+            self._conn.executescript(_ESQUEMA_BD + _ESQUEMA_AGREGADOS + _ESQUEMA_LOTE)
+            if version < 3:
+                self._rellenar_metricas()
+            self._conn.execute(f"PRAGMA user_version = {VERSION_ESQUEMA_BD}")
+    
+    def _migrar_v1(self):
+        """
+        Pasa una base de un solo empleado (clave periodo) a la clave (rut, periodo).
+        Las filas existentes quedan con RUT y nombre vacíos; se borran las huellas
+        de página para que reingerir esos PDFs recupere la identidad del empleado.
+        """
+        tablas = {n for n, in self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if 'liquidaciones' not in tablas:
+            return  # Base nueva
         
-        # Evolución mensual
-        fig_mensual = go.Figure()
-        fig_mensual.add_trace(go.Scatter(
-            x=df_anio['mes'],
-            y=df_anio['bruto'],
-            name='Bruto',
-            mode='lines+markers',
-            marker=dict(size=10),
-            line=dict(width=3)
-        ))
-        fig_mensual.add_trace(go.Scatter(
-            x=df_anio['mes'],
-            y=df_anio['liquido'],
-            name='Líquido',
-            mode='lines+markers',
-            marker=dict(size=10),
-            line=dict(width=3)
-        ))
-        fig_mensual.update_layout(
-            title=f"Evolución Mensual {anio_seleccionado}",
-            height=400,
-            hovermode='x unified'
+        for tabla in ('liquidaciones', 'haberes', 'descuentos'):
+            self._conn.execute(f"ALTER TABLE {tabla} RENAME TO {tabla}_v1")
+        self._conn.execute("DROP INDEX IF EXISTS idx_haberes_tipo")
+        self._conn.execute("DROP INDEX IF EXISTS idx_descuentos_categoria")
+        self._conn.execute("DROP TABLE IF EXISTS paginas")
+        self._conn.executescript(_ESQUEMA_BD)
+        
+        for tabla in ('liquidaciones', 'haberes', 'descuentos'):
+            columnas = [c[1] for c in self._conn.execute(f"PRAGMA table_info({tabla}_v1)")]
+            vacias = "'', '', " if tabla == 'liquidaciones' else "'', "
+            destino = "rut, nombre, " if tabla == 'liquidaciones' else "rut, "
+            self._conn.execute(
+                f"INSERT INTO {tabla} ({destino}{', '.join(columnas)}) "
+                f"SELECT {vacias}{', '.join(columnas)} FROM {tabla}_v1"
+            )
+            self._conn.execute(f"DROP TABLE {tabla}_v1")
+    
+    def _rellenar_metricas(self):
+        """Calcula los agregados de las liquidaciones que ya estaban guardadas (migración a v3)."""
+        por_categoria = ", ".join(
+            f"COALESCE(SUM(CASE WHEN d.categoria = '{categoria}' THEN d.monto END), 0)"
+            for categoria in CATEGORIAS_DESCUENTO  # En el orden de _COLUMNAS_MONTO
+        )
+        self._conn.execute(
+            f"INSERT INTO metricas "
+            f"SELECT l.rut, l.periodo, l.mes_nombre, l.haberes_afectos_total + l.haberes_exentos_total, "
+            f"l.liquido_a_pagar, {por_categoria}, l.descuentos_legales_total + l.otros_descuentos_total "
+            f"FROM liquidaciones l LEFT JOIN descuentos d ON d.rut = l.rut AND d.periodo = l.periodo "
+            f"GROUP BY l.rut, l.periodo"
+        )
+    
+    def guardar(self, liquidaciones: List[LiquidacionMensual],
+                paginas: Optional[List[Tuple[str, Optional[str], Optional[str]]]] = None):
+        """
+        Inserta o reemplaza (por rut y periodo) un lote de liquidaciones en una
+        transacción, junto con las huellas (huella, rut, periodo) de sus páginas.
+        Los agregados se ajustan solo con la diferencia de cada liquidación.
+        """
+        with self._lock, self._conn:
+            self._escribir(liquidaciones, paginas)
+    
+    def _escribir(self, liquidaciones: Iterable[LiquidacionMensual],
+                  paginas: Optional[List[Tuple[str, Optional[str], Optional[str]]]] = None):
+        """Cuerpo de guardar(): requiere el lock tomado y una transacción abierta."""
+        columnas = _COLUMNAS_LIQUIDACION + ['mensajes_validacion', 'lineas_sin_seccion']
+        sql_upsert = (
+            f"INSERT INTO liquidaciones ({', '.join(columnas)}) "
+            f"VALUES ({', '.join('?' * len(columnas))}) "
+            f"ON CONFLICT (rut, periodo) DO UPDATE SET "
+            + ", ".join(f"{c} = excluded.{c}" for c in columnas[2:])
         )
-        st.plotly_chart(fig_mensual, use_container_width=True)
         
-        # Descuentos mensuales
-        col1, col2 = st.columns(2)
+        escritas = 0
+        for liq in liquidaciones:
+            escritas += 1
+            self._conn.execute(sql_upsert, [getattr(liq, c) for c in _COLUMNAS_LIQUIDACION] + [
+                json.dumps(liq.mensajes_validacion or [], ensure_ascii=False),
+                json.dumps(liq.lineas_sin_seccion or [], ensure_ascii=False)
+            ])
+            clave = liq.clave
+            self._conn.execute("DELETE FROM haberes WHERE rut = ? AND periodo = ?", clave)
+            self._conn.execute("DELETE FROM descuentos WHERE rut = ? AND periodo = ?", clave)
+            # La huella de una versión anterior de la liquidación deja de describir lo guardado
+            self._conn.execute("DELETE FROM paginas WHERE rut = ? AND periodo = ?", clave)
+            # Baja de la versión anterior y alta de la nueva: los triggers ajustan los resúmenes
+            self._conn.execute("DELETE FROM metricas WHERE rut = ? AND periodo = ?", clave)
+            metricas = calcular_metricas_mes(liq)
+            self._conn.execute(
+                f"INSERT INTO metricas VALUES (?, ?, ?, {', '.join('?' * len(_COLUMNAS_MONTO))})",
+                [*clave, liq.mes_nombre] + [metricas[c] for c in _COLUMNAS_MONTO]
+            )
+            self._conn.executemany(
+                "INSERT INTO haberes VALUES (?, ?, ?, ?, ?, ?)",
+                [(*clave, i, h.nombre, h.monto, h.tipo) for i, h in enumerate(liq.haberes_items)]
+            )
+            self._conn.executemany(
+                "INSERT INTO descuentos VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(*clave, i, d.nombre, d.monto, d.tipo, d.categoria)
+                 for i, d in enumerate(liq.descuentos_items)]
+            )
+        if paginas:
+            self._conn.executemany("INSERT OR REPLACE INTO paginas VALUES (?, ?, ?)", paginas)
+        # Las huellas no cambian lo que se muestra: reingerir páginas conocidas no invalida las vistas
+        if escritas:
+            self._escrituras += 1
+    
+    def huellas_paginas(self) -> frozenset:
+        with self._lock:
+            return frozenset(h for h, in self._conn.execute("SELECT huella FROM paginas"))
+    
+    def preparar_lote(self, trabajo: int, tramo: List[ResultadoPagina]):
+        """Deja en espera las páginas de un trabajo de lote hasta guardar_lote(). Las fallidas no aportan."""
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO paginas_lote VALUES (?, ?, ?, ?, ?, ?, ?)", [
+                (trabajo, r.pagina, r.huella, r.estado, *(r.liquidacion.clave if r.liquidacion else (None, None)),
+                 pickle.dumps(r.liquidacion, protocol=pickle.HIGHEST_PROTOCOL) if r.liquidacion else None)
+                for r in tramo if r.estado != 'fallida'
+            ])
+    
+    def guardar_lote(self, trabajos: List[int]) -> List[Tuple[str, str, List[int], int]]:
+        """
+        Combina las páginas en espera de `trabajos` y las guarda en una transacción.
+        Por clave gana la página del último trabajo en el orden de carga; si esa
+        página ya estaba en el almacén ('sin_cambios') lo guardado se mantiene. Las
+        huellas de las páginas perdedoras no se guardan: si el orden cambia en otra
+        carga, se vuelven a extraer. Retorna los conflictos (rut, periodo, trabajos
+        con esa clave, trabajo usado): claves en varios trabajos con páginas distintas.
+        """
+        if not trabajos:
+            return []
+        en_lote = f"trabajo IN ({', '.join('?' * len(trabajos))})"
+        with self._lock, self._conn:
+            # Las páginas sin cambios toman la clave con la que ya están guardadas
+            self._conn.execute(
+                f"UPDATE paginas_lote SET (rut, periodo) = "
+                f"(SELECT rut, periodo FROM paginas WHERE huella = paginas_lote.huella) "
+                f"WHERE estado = 'sin_cambios' AND {en_lote}", trabajos
+            )
+            conflictos = [
+                (rut, periodo, sorted(int(t) for t in ids.split(',')), usado)
+                for rut, periodo, ids, usado in self._conn.execute(
+                    f"SELECT rut, periodo, GROUP_CONCAT(DISTINCT trabajo), MAX(trabajo) FROM paginas_lote "
+                    f"WHERE {en_lote} AND rut IS NOT NULL GROUP BY rut, periodo "
+                    f"HAVING COUNT(DISTINCT trabajo) > 1 AND COUNT(DISTINCT huella) > 1", trabajos
+                )
+            ]
+            ganadoras = self._conn.execute(
+                f"SELECT trabajo, pagina, huella, rut, periodo FROM paginas_lote g "
+                f"WHERE {en_lote} AND liquidacion IS NOT NULL AND NOT EXISTS ("
+                f"SELECT 1 FROM paginas_lote o WHERE o.{en_lote} AND o.rut = g.rut AND o.periodo = g.periodo "
+                f"AND (o.trabajo, o.pagina) > (g.trabajo, g.pagina))", trabajos * 2
+            ).fetchall()
+            
+            # Las liquidaciones se leen de a una mientras se escriben
+            self._escribir(
+                (pickle.loads(self._conn.execute(
+                    "SELECT liquidacion FROM paginas_lote WHERE trabajo = ? AND pagina = ?", (trabajo, pagina)
+                ).fetchone()[0]) for trabajo, pagina, *_ in ganadoras),
+                [(huella, rut, periodo) for _, _, huella, rut, periodo in ganadoras]
+            )
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO paginas SELECT DISTINCT huella, NULL, NULL FROM paginas_lote "
+                f"WHERE estado = 'omitida' AND {en_lote}", trabajos
+            )
+        return conflictos
+    
+    def descartar_lote(self, trabajos: List[int]):
+        """Borra las páginas en espera de `trabajos`."""
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM paginas_lote WHERE trabajo = ?", [(t,) for t in trabajos])
+    
+    def claves(self) -> set:
+        """Claves (rut, periodo) de todas las liquidaciones guardadas."""
+        with self._lock:
+            return set(self._conn.execute("SELECT rut, periodo FROM liquidaciones"))
+    
+    def cargar(self) -> List[LiquidacionMensual]:
+        """Carga todas las liquidaciones ordenadas por rut y periodo."""
+        with self._lock:
+            filas = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNAS_LIQUIDACION)}, mensajes_validacion, lineas_sin_seccion "
+                f"FROM liquidaciones ORDER BY rut, periodo"
+            ).fetchall()
+            haberes = self._conn.execute(
+                "SELECT rut, periodo, nombre, monto, tipo FROM haberes ORDER BY rut, periodo, orden"
+            ).fetchall()
+            descuentos = self._conn.execute(
+                "SELECT rut, periodo, nombre, monto, tipo, categoria FROM descuentos ORDER BY rut, periodo, orden"
+            ).fetchall()
+        
+        haberes_por_clave: Dict[Tuple[str, str], List[ItemHaber]] = {}
+        for rut, periodo, nombre, monto, tipo in haberes:
+            haberes_por_clave.setdefault((rut, periodo), []).append(ItemHaber(nombre, monto, tipo))
         
-        with col1:
-            fig_desc_mes = px.bar(
-                df_anio,
-                x='mes',
-                y=['afp', 'salud', 'impuesto', 'cesantia'],
-                title="Descuentos Legales por Mes",
-                barmode='stack'
+        descuentos_por_clave: Dict[Tuple[str, str], List[ItemDescuento]] = {}
+        for rut, periodo, nombre, monto, tipo, categoria in descuentos:
+            descuentos_por_clave.setdefault((rut, periodo), []).append(ItemDescuento(nombre, monto, tipo, categoria))
+        
+        liquidaciones = []
+        for fila in filas:
+            datos = dict(zip(_COLUMNAS_LIQUIDACION, fila))
+            datos['validacion_haberes_ok'] = bool(datos['validacion_haberes_ok'])
+            datos['validacion_descuentos_ok'] = bool(datos['validacion_descuentos_ok'])
+            liquidaciones.append(LiquidacionMensual(
+                **datos,
+                haberes_items=haberes_por_clave.get((datos['rut'], datos['periodo']), []),
+                descuentos_items=descuentos_por_clave.get((datos['rut'], datos['periodo']), []),
+                mensajes_validacion=json.loads(fila[-2]),
+                lineas_sin_seccion=json.loads(fila[-1])
+            ))
+        return liquidaciones
+    
+    def eliminar(self, claves: List[Tuple[str, str]]):
+        """Borra liquidaciones (rut, periodo) con sus items, huellas y aporte a los agregados."""
+        with self._lock, self._conn:
+            antes = self._conn.total_changes
+            for tabla in ('liquidaciones', 'haberes', 'descuentos', 'paginas', 'metricas'):
+                self._conn.executemany(f"DELETE FROM {tabla} WHERE rut = ? AND periodo = ?", claves)
+            if self._conn.total_changes != antes:
+                self._escrituras += 1
+    
+    def eliminar_todo(self):
+        with self._lock, self._conn:
+            antes = self._conn.total_changes
+            for tabla in ('haberes', 'descuentos', 'liquidaciones', 'paginas',
+                          'resumen_anual', 'resumen_mensual', 'metricas'):
+                self._conn.execute(f"DELETE FROM {tabla}")
+            if self._conn.total_changes != antes:
+                self._escrituras += 1
+    
+    def version(self) -> str:
+        """
+        Versión de los datos guardados, para memorizar lo que se lee del almacén:
+        cambia con cada escritura de esta conexión (la que comparten todas las
+        sesiones) que toque liquidaciones y con las de otras conexiones a la misma
+        base (PRAGMA data_version).
+        """
+        with self._lock:
+            return f"{self._escrituras}.{self._conn.execute('PRAGMA data_version').fetchone()[0]}"
+    
+    def resumen_anual(self, rut: Optional[str] = None) -> pd.DataFrame:
+        """
+        Totales por año ya agregados, de un empleado o de toda la empresa (rut None).
+        `meses` cuenta los meses con datos; en la empresa, distinto de `liquidaciones`.
+        """
+        with self._lock:
+            df = pd.read_sql_query(
+                f"SELECT anio, liquidaciones, {', '.join(_COLUMNAS_MONTO)} FROM resumen_anual "
+                f"WHERE rut = ? ORDER BY anio", self._conn, params=['*' if rut is None else rut]
             )
-            fig_desc_mes.update_layout(xaxis_tickangle=-45)
-            st.plotly_chart(fig_desc_mes, use_container_width=True)
+            if rut is None:
+                meses = dict(self._conn.execute(
+                    "SELECT substr(periodo, 1, 4), COUNT(*) FROM resumen_mensual GROUP BY 1"
+                ))
+        df.insert(1, 'meses', df['anio'].map(meses) if rut is None else df['liquidaciones'])
+        return df
+    
+    def resumen_mensual(self, rut: Optional[str], anio: Optional[str] = None) -> pd.DataFrame:
+        """
+        Montos por mes de un año (o de todo el historial si `anio` es None), de un
+        empleado o de toda la empresa (rut None), ya agregados.
+        """
+        desde, hasta = (f"{anio}-01", f"{anio}-12") if anio else ("0000-00", "9999-99")
+        montos = ', '.join(_COLUMNAS_MONTO)
+        with self._lock:
+            if rut is None:
+                df = pd.read_sql_query(
+                    f"SELECT periodo, mes, empleados, {montos} FROM resumen_mensual "
+                    f"WHERE periodo BETWEEN ? AND ? ORDER BY periodo", self._conn, params=[desde, hasta]
+                )
+            else:
+                df = pd.read_sql_query(
+                    f"SELECT periodo, mes, 1 AS empleados, {montos} FROM metricas "
+                    f"WHERE rut = ? AND periodo BETWEEN ? AND ? ORDER BY periodo",
+                    self._conn, params=[rut, desde, hasta]
+                )
+        # Valor hora promedio entre los empleados del mes
+        df['valor_hora_bruto'] = df['bruto'] / df['empleados'] / HORAS_MENSUALES_BASE
+        df['valor_hora_liquido'] = df['liquido'] / df['empleados'] / HORAS_MENSUALES_BASE
+        return df
+    
+    def top_otros_descuentos(self, rut: Optional[str], anio: str, n: int = 5) -> pd.Series:
+        """Conceptos de categoría OTRO con mayor monto en el año (de un empleado o de la empresa)."""
+        filtro_rut = "" if rut is None else "AND rut = ? "
+        with self._lock:
+            filas = self._conn.execute(
+                f"SELECT nombre, SUM(monto) FROM descuentos WHERE categoria = 'OTRO' "
+                f"AND periodo BETWEEN ? AND ? {filtro_rut}GROUP BY nombre ORDER BY 2 DESC LIMIT ?",
+                [f"{anio}-01", f"{anio}-12"] + ([] if rut is None else [rut]) + [n]
+            ).fetchall()
+        return pd.Series(dict(filas), dtype='int64', name='monto')
+
+@st.cache_resource
+def obtener_almacen() -> AlmacenLiquidaciones:
+    """Conexión única al almacén para todo el servidor."""
+    return AlmacenLiquidaciones()
+
+class IndiceLiquidaciones:
+    """
+    Liquidaciones indexadas por (rut, periodo), con acceso O(1) a una liquidación
+    y a la serie de cada empleado. Se arma una vez por cambio del dataset.
+    """
+    
+    def __init__(self, liquidaciones: List[LiquidacionMensual]):
+        self._por_clave: Dict[Tuple[str, str], LiquidacionMensual] = {}
+        self._por_empleado: Dict[str, List[LiquidacionMensual]] = {}
+        self._nombres: Dict[str, str] = {}
+        for liq in sorted(liquidaciones, key=lambda l: l.clave):
+            self._por_clave[liq.clave] = liq
+            self._por_empleado.setdefault(liq.rut, []).append(liq)
+            if liq.nombre:
+                self._nombres[liq.rut] = liq.nombre
+    
+    def __len__(self) -> int:
+        return len(self._por_clave)
+    
+    def obtener(self, rut: str, periodo: str) -> Optional[LiquidacionMensual]:
+        return self._por_clave.get((rut, periodo))
+    
+    def de_empleado(self, rut: str) -> List[LiquidacionMensual]:
+        """Liquidaciones de un empleado ordenadas por periodo."""
+        return self._por_empleado.get(rut, [])
+    
+    def empleados(self) -> List[str]:
+        """RUTs ordenados por nombre."""
+        return sorted(self._por_empleado, key=lambda rut: (self.nombre(rut), rut))
+    
+    def nombre(self, rut: str) -> str:
+        """Nombre para mostrar: el último registrado, o el RUT si no hay."""
+        return self._nombres.get(rut) or rut or "Sin identificar"
+
+# --- INGESTA EN SEGUNDO PLANO ---
+def volcar_a_disco(origen: BinaryIO) -> Tuple[str, str]:
+    """
+    Copia un archivo subido a un temporal por bloques, sin armar otra copia
+    completa en memoria, y calcula su SHA-256 en la misma pasada.
+    Retorna (ruta, huella); quien lo llama debe borrar el temporal.
+    """
+    sha = hashlib.sha256()
+    origen.seek(0)
+    fd, ruta = tempfile.mkstemp(prefix="usm_", suffix=".pdf", dir=DIRECTORIO_SPOOL)
+    try:
+        with os.fdopen(fd, 'wb') as destino:
+            for bloque in iter(lambda: origen.read(TAMANO_BLOQUE_SPOOL), b""):
+                sha.update(bloque)
+                destino.write(bloque)
+    except BaseException:
+        os.remove(ruta)
+        raise
+    return ruta, sha.hexdigest()
+
+class TrabajoIngesta:
+    """
+    Avance de la ingesta de un PDF. Lo actualiza el hilo que procesa el PDF y lo
+    lee la sesión que lo envió (o las que enviaron el mismo PDF mientras corría).
+    """
+    
+    def __init__(self, id_trabajo: int, huella: str, nombre: str, lote: Optional["LoteIngesta"] = None):
+        self.id = id_trabajo
+        self.huella = huella
+        self.nombre = nombre
+        self.lote = lote
+        self.estado = 'en_cola'  # 'en_cola', 'procesando', 'terminado' o 'error'
+        self.paginas_total = 0
+        self.paginas_hechas = 0
+        self.liquidaciones = 0
+        self.paginas_nuevas = 0
+        self.paginas_modificadas = 0
+        self.paginas_sin_cambios = 0
+        self.paginas_fallidas: List[int] = []
+        self.paginas_omitidas: List[int] = []
+        self.error: Optional[str] = None
+        self.diagnostico: Optional[Dict] = None
+        self._inicio: Optional[float] = None
+        self._fin: Optional[float] = None
+        self._lock = threading.Lock()
+    
+    @property
+    def terminado(self) -> bool:
+        return self.estado in ('terminado', 'error')
+    
+    def iniciar(self, paginas_total: int):
+        with self._lock:
+            self.estado = 'procesando'
+            self.paginas_total = paginas_total
+            self._inicio = time.perf_counter()
+    
+    def avanzar(self, resultados: List[ResultadoPagina], claves_previas: set):
+        """
+        Suma un tramo de páginas. Una página con huella desconocida que dio una
+        liquidación es modificada si su (rut, periodo) ya estaba en el almacén antes
+        de esta ingesta, y nueva si no. Las omitidas y fallidas se cuentan aparte.
+        """
+        with self._lock:
+            self.paginas_hechas += len(resultados)
+            for r in resultados:
+                if r.estado == 'sin_cambios':
+                    self.paginas_sin_cambios += 1
+                elif r.estado == 'fallida':
+                    self.paginas_fallidas.append(r.pagina)
+                elif r.estado == 'omitida':
+                    self.paginas_omitidas.append(r.pagina)
+                else:
+                    self.liquidaciones += 1
+                    if r.liquidacion.clave in claves_previas:
+                        self.paginas_modificadas += 1
+                    else:
+                        self.paginas_nuevas += 1
+    
+    def finalizar(self, diagnostico: Optional[Dict] = None, error: Optional[str] = None):
+        with self._lock:
+            self.estado = 'error' if error else 'terminado'
+            self.error = error
+            self.diagnostico = diagnostico
+            self._fin = time.perf_counter()
+    
+    def progreso(self) -> Dict:
+        """Foto consistente del avance, con velocidad y tiempo restante estimado."""
+        with self._lock:
+            transcurrido = ((self._fin or time.perf_counter()) - self._inicio) if self._inicio else 0.0
+            velocidad = self.paginas_hechas / transcurrido if self.paginas_hechas and transcurrido > 0 else None
+            restantes = self.paginas_total - self.paginas_hechas
+            return {
+                'nombre': self.nombre,
+                'estado': self.estado,
+                'paginas_hechas': self.paginas_hechas,
+                'paginas_total': self.paginas_total,
+                'fraccion': self.paginas_hechas / self.paginas_total if self.paginas_total else 0.0,
+                'paginas_por_segundo': velocidad,
+                'eta_s': restantes / velocidad if velocidad and not self.terminado else None,
+                'liquidaciones': self.liquidaciones,
+                'paginas_nuevas': self.paginas_nuevas,
+                'paginas_modificadas': self.paginas_modificadas,
+                'paginas_sin_cambios': self.paginas_sin_cambios,
+                'paginas_fallidas': list(self.paginas_fallidas),
+                'paginas_omitidas': list(self.paginas_omitidas),
+                'error': self.error
+            }
+
+class LoteIngesta:
+    """
+    PDFs subidos juntos. Cada uno se extrae en su propio trabajo, en paralelo con
+    los demás, pero nada se guarda hasta que terminan todos: mientras tanto sus
+    páginas esperan en una tabla temporal del almacén (en disco), y al final se
+    combinan ahí en el orden de carga y se guardan en una sola escritura. Si un
+    mismo empleado y periodo aparece en varios archivos gana el último, y si las
+    páginas difieren queda anotado como conflicto. Los archivos idénticos byte a
+    byte se procesan una sola vez.
+    """
+    
+    def __init__(self):
+        self.trabajos: List[TrabajoIngesta] = []  # En orden de carga
+        self.duplicados: Dict[str, str] = {}  # Archivo omitido -> archivo idéntico del lote
+        self.conflictos: List[Dict] = []
+        self.terminado = False
+        self._cierres: Dict[int, Tuple[Optional[Dict], Optional[str]]] = {}
+        self._lock = threading.Lock()
+    
+    def cerrar(self, trabajo: TrabajoIngesta, diagnostico: Optional[Dict], error: Optional[str] = None) -> bool:
+        """Registra el fin de un trabajo del lote. Retorna True si era el último."""
+        with self._lock:
+            self._cierres[trabajo.id] = (diagnostico, error)
+            return len(self._cierres) == len(self.trabajos)
+    
+    def guardar(self, almacen: AlmacenLiquidaciones):
+        """Guarda lo que aportan los archivos sin error (ver guardar_lote) y libera las páginas en espera."""
+        nombres = {t.id: t.nombre for t in self.trabajos}
+        try:
+            conflictos = almacen.guardar_lote([t.id for t in self.trabajos if not self._cierres[t.id][1]])
+        finally:
+            almacen.descartar_lote(list(nombres))
+        self.conflictos = [
+            {'rut': rut, 'periodo': periodo, 'archivos': ", ".join(nombres[i] for i in ids), 'usado': nombres[usado]}
+            for rut, periodo, ids, usado in conflictos
+        ]
+    
+    def finalizar(self, error: Optional[str] = None):
+        """Cierra todos los trabajos del lote de una vez (un solo recargado en la sesión)."""
+        for trabajo in self.trabajos:
+            diagnostico, error_trabajo = self._cierres[trabajo.id]
+            trabajo.finalizar(diagnostico, error=error_trabajo or error)
+        self.terminado = True
+    
+    def resumen(self) -> Dict:
+        return {
+            'archivos': len(self.trabajos) + len(self.duplicados),
+            'duplicados': dict(self.duplicados),
+            'conflictos': list(self.conflictos)
+        }
+
+class GestorTrabajos:
+    """
+    Cola de ingestas para todo el servidor. Cada PDF se procesa en un hilo propio
+    (que a su vez reparte las páginas entre procesos) y sus liquidaciones se
+    guardan en el almacén tramo a tramo, así que el trabajo no depende de la sesión
+    que lo envió. Un PDF que ya se está procesando no se encola dos veces, y las
+    páginas cuya huella ya está en el almacén no se vuelven a extraer: reingerir
+    una exportación acumulativa cuesta lo que sus páginas nuevas.
+    
+    El PDF se vuelca a disco al encolarlo y los workers lo abren desde ahí, así que
+    ni la cola ni el pool guardan copias de su contenido. Todos los trabajos
+    reparten sus páginas en un mismo pool de procesos.
+    """
+    
+    def __init__(self, almacen: AlmacenLiquidaciones, cache: CachePDF,
+                 max_simultaneos: int = MAX_TRABAJOS_SIMULTANEOS):
+        self.almacen = almacen
+        self.cache = cache
+        self._pool = ThreadPoolExecutor(max_workers=max_simultaneos, thread_name_prefix="ingesta")
+        self._procesos: Optional[ProcessPoolExecutor] = None
+        self._trabajos: "OrderedDict[int, TrabajoIngesta]" = OrderedDict()
+        self._siguiente_id = 0
+        self._lock = threading.Lock()
+    
+    def _registrar(self, huella: str, nombre: str, lote: Optional[LoteIngesta] = None) -> TrabajoIngesta:
+        """Da de alta un trabajo (con el lock tomado) y olvida los terminados más antiguos."""
+        self._siguiente_id += 1
+        trabajo = TrabajoIngesta(self._siguiente_id, huella, nombre, lote)
+        self._trabajos[trabajo.id] = trabajo
         
-        with col2:
-            # Top conceptos de "Otros Descuentos"
-            st.subheader("Otros Descuentos")
-            otros_items = []
-            for liq in st.session_state.liquidaciones:
-                if liq.periodo.startswith(anio_seleccionado):
-                    for desc in liq.descuentos_items:
-                        if desc.categoria == 'OTRO':
-                            otros_items.append({
-                                'Concepto': desc.nombre,
-                                'Monto': desc.monto,
-                                'Mes': liq.mes_nombre
-                            })
-            
-            if otros_items:
-                df_otros = pd.DataFrame(otros_items)
-                top_otros = df_otros.groupby('Concepto')['Monto'].sum().sort_values(ascending=False).head(5)
-                
-                fig_otros = px.bar(
-                    x=top_otros.values,
-                    y=top_otros.index,
-                    orientation='h',
-                    title="Top 5 Otros Descuentos del Año"
+        terminados = [t.id for t in self._trabajos.values() if t.terminado]
+        for id_trabajo in terminados[:max(len(terminados) - HISTORIAL_TRABAJOS, 0)]:
+            del self._trabajos[id_trabajo]
+        return trabajo
+    
+    def enviar(self, origen: BinaryIO, nombre: str) -> TrabajoIngesta:
+        ruta, huella = volcar_a_disco(origen)
+        with self._lock:
+            for trabajo in self._trabajos.values():
+                if trabajo.huella == huella and not trabajo.terminado and trabajo.lote is None:
+                    os.remove(ruta)
+                    return trabajo
+            trabajo = self._registrar(huella, nombre)
+        
+        self._pool.submit(self._ejecutar, trabajo, ruta)
+        return trabajo
+    
+    def enviar_lote(self, archivos: List[Tuple[BinaryIO, str]]) -> LoteIngesta:
+        """
+        Encola varios PDFs como un lote (ver LoteIngesta). Todos se vuelcan a disco
+        y se registran antes de empezar, así el lote conoce a todos sus trabajos.
+        """
+        lote = LoteIngesta()
+        rutas: Dict[str, Tuple[str, str]] = {}  # huella -> (ruta, nombre)
+        try:
+            for origen, nombre in archivos:
+                ruta, huella = volcar_a_disco(origen)
+                if huella in rutas:
+                    os.remove(ruta)
+                    lote.duplicados[nombre] = rutas[huella][1]
+                else:
+                    rutas[huella] = (ruta, nombre)
+        except BaseException:
+            for ruta, _ in rutas.values():
+                os.remove(ruta)
+            raise
+        
+        with self._lock:
+            for huella, (ruta, nombre) in rutas.items():
+                lote.trabajos.append(self._registrar(huella, nombre, lote))
+        for trabajo, (ruta, _) in zip(lote.trabajos, rutas.values()):
+            self._pool.submit(self._ejecutar, trabajo, ruta)
+        return lote
+    
+    def trabajos(self) -> List[TrabajoIngesta]:
+        with self._lock:
+            return list(self._trabajos.values())
+    
+    def _pool_procesos(self) -> Optional[ProcessPoolExecutor]:
+        """Pool de procesos compartido por todas las ingestas (None en modo secuencial)."""
+        if MAX_WORKERS_EXTRACCION <= 1:
+            return None
+        with self._lock:
+            if self._procesos is None:
+                self._procesos = ProcessPoolExecutor(
+                    max_workers=MAX_WORKERS_EXTRACCION, mp_context=contexto_procesos()
                 )
-                st.plotly_chart(fig_otros, use_container_width=True)
+            return self._procesos
+    
+    def _descartar_pool_procesos(self, pool: ProcessPoolExecutor):
+        """Un worker murió: el pool queda inutilizable y la próxima ingesta arma otro."""
+        with self._lock:
+            if self._procesos is pool:
+                self._procesos = None
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    def _guardar_tramo(self, trabajo: TrabajoIngesta, tramo: List[ResultadoPagina]):
+        if trabajo.lote is not None:
+            self.almacen.preparar_lote(trabajo.id, tramo)
+            return
+        self.almacen.guardar(
+            [r.liquidacion for r in tramo if r.liquidacion],
+            # Las fallidas no se registran: se reintentan en la próxima ingesta
+            [(r.huella, *(r.liquidacion.clave if r.liquidacion else (None, None)))
+             for r in tramo if r.estado in ('extraida', 'omitida')]
+        )
+    
+    def _finalizar(self, trabajo: TrabajoIngesta, diagnostico: Optional[Dict], error: Optional[str] = None):
+        """Cierra un trabajo; el último de un lote combina y guarda el lote completo."""
+        lote = trabajo.lote
+        if lote is None:
+            trabajo.finalizar(diagnostico, error=error)
+            return
+        if not lote.cerrar(trabajo, diagnostico, error):
+            return
+        
+        try:
+            lote.guardar(self.almacen)
+        except Exception as e:
+            logger_diagnostico.error(json.dumps(
+                {'evento': 'error_lote', 'archivos': [t.nombre for t in lote.trabajos], 'error': repr(e)},
+                ensure_ascii=False
+            ))
+            lote.finalizar(error=str(e))
+        else:
+            lote.finalizar()
+    
+    def _ejecutar(self, trabajo: TrabajoIngesta, ruta: str):
+        registro = RegistroTiempos('procesar_pdf')
+        pool = self._pool_procesos()
+        try:
+            with registro.etapa('huellas'):
+                conocidas = self.almacen.huellas_paginas()
+                claves_previas = self.almacen.claves()
+            with registro.etapa('cache'):
+                resultado = self.cache.obtener(trabajo.huella)
+            
+            if resultado is not None:
+                # Mismo PDF ya extraído: solo falta lo que el almacén no tenga
+                trabajo.iniciar(len(resultado))
+                tramos = [[replace(r, estado='sin_cambios', liquidacion=None) if r.huella in conocidas else r
+                           for r in resultado]]
             else:
-                st.info("No hay otros descuentos en este año")
+                with registro.etapa('conteo_paginas'):
+                    n_paginas = contar_paginas(ruta)
+                trabajo.iniciar(n_paginas)
+                tramos = iterar_resultados_pdf(ruta, n_paginas, conocidas=conocidas, pool=pool)
+            
+            # Solo se cachea un resultado completo: sin páginas saltadas y fuera del modo streaming
+            completo = [] if resultado is None and trabajo.paginas_total <= PAGINAS_MODO_STREAMING else None
+            for tramo in tramos:
+                with registro.etapa('persistencia'):
+                    self._guardar_tramo(trabajo, tramo)
+                if resultado is None:
+                    registro.agregar_paginas([r.tiempos for r in tramo])
+                trabajo.avanzar(tramo, claves_previas)
+                if completo is not None and trabajo.paginas_sin_cambios:
+                    completo = None
+                elif completo is not None:
+                    completo.extend(tramo)
+            
+            if completo is not None:
+                with registro.etapa('cache'):
+                    self.cache.guardar(trabajo.huella, completo)
+            
+            diagnostico, error = registro.emitir_log(), None
+        except Exception as e:
+            logger_diagnostico.error(json.dumps(
+                {'evento': 'error_ingesta', 'archivo': trabajo.nombre, 'error': repr(e)}, ensure_ascii=False
+            ))
+            if isinstance(e, BrokenProcessPool) and pool is not None:
+                self._descartar_pool_procesos(pool)
+            diagnostico, error = registro.resumen(), str(e)
+        finally:
+            os.remove(ruta)
+        self._finalizar(trabajo, diagnostico, error)
+
+@st.cache_resource
+def obtener_gestor_trabajos() -> GestorTrabajos:
+    """Cola única de ingestas: sobrevive a los reruns y a las recargas del navegador."""
+    return GestorTrabajos(obtener_almacen(), obtener_cache_pdf())
+
+# --- FUNCIONES DE ANÁLISIS ---
+def calcular_metricas_mes(liq: LiquidacionMensual) -> Dict:
+    """Calcula métricas derivadas de una liquidación."""
+    bruto = liq.haberes_afectos_total + liq.haberes_exentos_total
+    
+    # Desglose de descuentos por categoría
+    afp = sum(d.monto for d in liq.descuentos_items if d.categoria == 'AFP')
+    salud = sum(d.monto for d in liq.descuentos_items if d.categoria == 'SALUD')
+    impuesto = sum(d.monto for d in liq.descuentos_items if d.categoria == 'IMPUESTO')
+    cesantia = sum(d.monto for d in liq.descuentos_items if d.categoria == 'CESANTIA')
+    otros_desc = sum(d.monto for d in liq.descuentos_items if d.categoria == 'OTRO')
+    
+    # Valor hora
+    horas_mes = HORAS_MENSUALES_BASE
+    valor_hora_bruto = bruto / horas_mes if horas_mes > 0 else 0
+    valor_hora_liquido = liq.liquido_a_pagar / horas_mes if horas_mes > 0 else 0
+    
+    return {
+        'periodo': liq.periodo,
+        'mes': liq.mes_nombre,
+        'bruto': bruto,
+        'liquido': liq.liquido_a_pagar,
+        'afp': afp,
+        'salud': salud,
+        'impuesto': impuesto,
+        'cesantia': cesantia,
+        'otros_descuentos': otros_desc,
+        'total_descuentos': liq.descuentos_legales_total + liq.otros_descuentos_total,
+        'valor_hora_bruto': valor_hora_bruto,
+        'valor_hora_liquido': valor_hora_liquido
+    }
+
+# --- TABLAS COLUMNARES ---
+def construir_tabla_items(liquidaciones: List[LiquidacionMensual]) -> pd.DataFrame:
+    """
+    Aplana todos los items (haberes y descuentos) en una tabla con una fila por item.
+    'tipo' y 'categoria' son categóricas, armadas directo desde los códigos de
+    los items; los haberes no tienen categoría.
+    """
+    filas = [
+        (liq.rut, liq.periodo, h.nombre, h.monto, h.codigo_tipo, -1)
+        for liq in liquidaciones for h in liq.haberes_items
+    ]
+    filas.extend(
+        (liq.rut, liq.periodo, d.nombre, d.monto, d.codigo_tipo, d.codigo_categoria)
+        for liq in liquidaciones for d in liq.descuentos_items
+    )
+    
+    df = pd.DataFrame(filas, columns=['rut', 'periodo', 'nombre', 'monto', 'tipo', 'categoria'])
+    df['monto'] = df['monto'].astype('int64')
+    df['tipo'] = pd.Categorical.from_codes(df['tipo'].astype('int8'), categories=TIPOS_ITEM)
+    df['categoria'] = pd.Categorical.from_codes(df['categoria'].astype('int8'), categories=CATEGORIAS_DESCUENTO)
+    return df
+
+def construir_tabla_totales(liquidaciones: List[LiquidacionMensual]) -> pd.DataFrame:
+    """Tabla de totales de cabecera, una fila por liquidación."""
+    return pd.DataFrame(
+        [(liq.rut, liq.nombre, liq.periodo, liq.mes_nombre, liq.haberes_afectos_total,
+          liq.haberes_exentos_total, liq.descuentos_legales_total, liq.otros_descuentos_total,
+          liq.liquido_a_pagar)
+         for liq in liquidaciones],
+        columns=['rut', 'nombre', 'periodo', 'mes', 'haberes_afectos_total', 'haberes_exentos_total',
+                 'descuentos_legales_total', 'otros_descuentos_total', 'liquido_a_pagar']
+    )
+
+# Controles de validar_lote: (control, suma calculada, total declarado, solo si el total es > 0)
+_CONTROLES_VALIDACION = [
+    ('haberes_afectos', 'haber_afecto', 'haberes_afectos_total', False),
+    ('haberes_exentos', 'haber_exento', 'haberes_exentos_total', True),
+    ('descuentos_legales', 'descuento_legal', 'descuentos_legales_total', False),
+    ('otros_descuentos', 'descuento_otro', 'otros_descuentos_total', True),
+    ('liquido', 'bruto_menos_descuentos', 'liquido_a_pagar', False),
+]
+_COLUMNAS_DISCREPANCIA = ['rut', 'periodo', 'control', 'calculado', 'declarado', 'diferencia']
+
+def validar_lote(df_totales: pd.DataFrame, df_items: pd.DataFrame,
+                 tolerancia: int = TOLERANCIA_VALIDACION) -> pd.DataFrame:
+    """
+    Versión vectorizada de validar_liquidacion para todas las liquidaciones, sobre
+    las tablas columnares (sin volver a leer los PDFs). Además de las sumas por
+    sección, controla que bruto − descuentos = líquido a pagar. Retorna solo las
+    discrepancias, una fila por liquidación y control.
+    """
+    sumas = (
+        df_items.groupby(['rut', 'periodo', 'tipo'], observed=False)['monto'].sum()
+        .unstack('tipo', fill_value=0)
+        .reindex(columns=TIPOS_ITEM, fill_value=0)
+    )
+    df = df_totales.join(sumas, on=['rut', 'periodo'])
+    df[TIPOS_ITEM] = df[TIPOS_ITEM].fillna(0).astype('int64')
+    df['bruto_menos_descuentos'] = (
+        df['haberes_afectos_total'] + df['haberes_exentos_total']
+        - df['descuentos_legales_total'] - df['otros_descuentos_total']
+    )
+    
+    partes = []
+    for control, calculado, declarado, solo_positivo in _CONTROLES_VALIDACION:
+        diferencia = df[calculado] - df[declarado]
+        falla = diferencia.abs() > tolerancia
+        if solo_positivo:
+            falla &= df[declarado] > 0
+        if falla.any():
+            partes.append(pd.DataFrame({
+                'rut': df.loc[falla, 'rut'],
+                'periodo': df.loc[falla, 'periodo'],
+                'control': control,
+                'calculado': df.loc[falla, calculado],
+                'declarado': df.loc[falla, declarado],
+                'diferencia': diferencia[falla]
+            }))
+    
+    if partes:
+        discrepancias = pd.concat(partes, ignore_index=True).sort_values(['rut', 'periodo'], kind='stable')
+    else:
+        discrepancias = pd.DataFrame(columns=_COLUMNAS_DISCREPANCIA)
+    discrepancias['control'] = pd.Categorical(
+        discrepancias['control'], categories=[c[0] for c in _CONTROLES_VALIDACION]
+    )
+    return discrepancias.reset_index(drop=True)
+
+# --- SERIES DE TIEMPO ---
+# Las series se calculan una vez por versión del dataset sobre un índice mensual
+# denso (un mes sin liquidaciones queda como NaN, no desaparece): así shift(12) es
+# exactamente el mismo mes del año anterior y las ventanas cuentan meses de
+# calendario. Los gráficos solo recortan rangos de periodos de la tabla ya hecha.
+_COLUMNAS_SERIE = ['bruto', 'liquido', 'impuesto', 'total_descuentos']
+
+def construir_series(df_mensual: pd.DataFrame) -> pd.DataFrame:
+    """
+    Series mensuales derivadas de las métricas por mes (las de calcular_metricas_mes,
+    sumadas por periodo, con la cantidad de `empleados`): promedios móviles del
+    líquido, variación interanual de líquido y valor hora, tasa efectiva de
+    descuento e impuesto retenido acumulado. Índice: PeriodIndex mensual denso.
+    """
+    if df_mensual.empty:
+        return pd.DataFrame(index=pd.PeriodIndex([], freq='M'))
+    
+    periodos = pd.PeriodIndex(df_mensual['periodo'], freq='M')
+    indice = pd.period_range(periodos.min(), periodos.max(), freq='M', name='periodo')
+    series = df_mensual[_COLUMNAS_SERIE + ['empleados']].set_axis(periodos).reindex(indice)
+    series['empleados'] = series['empleados'].fillna(0).astype('int64')
+    
+    # Valor hora promedio por empleado (NaN en los meses sin liquidaciones)
+    empleados = series['empleados'].where(series['empleados'] > 0)
+    series['valor_hora_bruto'] = series['bruto'] / empleados / HORAS_MENSUALES_BASE
+    series['valor_hora_liquido'] = series['liquido'] / empleados / HORAS_MENSUALES_BASE
+    
+    # Promedios móviles: media de los meses con datos dentro de la ventana
+    for ventana in VENTANAS_MOVILES:
+        series[f'liquido_media_{ventana}m'] = series['liquido'].rolling(ventana, min_periods=1).mean()
+    
+    # Variación interanual contra el mismo mes del año anterior
+    for columna in ('liquido', 'valor_hora_liquido'):
+        anterior = series[columna].shift(12)
+        series[f'{columna}_yoy'] = series[columna] / anterior.where(anterior > 0) - 1
+    
+    # Tasa efectiva de descuento: del mes y de los últimos 12 meses (ponderada por bruto)
+    series['tasa_descuento'] = series['total_descuentos'] / series['bruto'].where(series['bruto'] > 0)
+    bruto_12m = series['bruto'].rolling(12, min_periods=1).sum()
+    series['tasa_descuento_12m'] = (
+        series['total_descuentos'].rolling(12, min_periods=1).sum() / bruto_12m.where(bruto_12m > 0)
+    )
+    
+    # Impuesto retenido acumulado: en todo el historial y dentro de cada año
+    impuesto = series['impuesto'].fillna(0)
+    series['impuesto_acumulado'] = impuesto.cumsum()
+    series['impuesto_acumulado_anio'] = impuesto.groupby(indice.year).cumsum()
+    return series
+
+def consultar_series(series: pd.DataFrame, desde: Optional[str] = None, hasta: Optional[str] = None,
+                     columnas: Optional[List[str]] = None) -> pd.DataFrame:
+    """Recorte de las series entre dos periodos 'YYYY-MM' (incluidos), sin recalcularlas."""
+    recorte = series.loc[desde:hasta]
+    return recorte if columnas is None else recorte[columnas]
+
+# --- PROCESAMIENTO POR LOTES ---
+MANIFIESTO_LOTE = "procesados.jsonl"
+REPORTE_VALIDACION = "reporte_validacion.jsonl"
+
+def _procesar_archivo(ruta: str) -> Dict:
+    """Procesa un PDF completo dentro de un proceso del pool. Nunca lanza excepciones."""
+    try:
+        liquidaciones, paginas_fallidas, paginas_omitidas = procesar_pdf(ruta, max_workers=1)
+        return {'ruta': ruta, 'liquidaciones': liquidaciones, 'paginas_fallidas': paginas_fallidas,
+                'paginas_omitidas': paginas_omitidas, 'error': None}
+    except Exception as e:
+        return {'ruta': ruta, 'liquidaciones': [], 'paginas_fallidas': [], 'paginas_omitidas': [],
+                'error': f"{type(e).__name__}: {e}"}
+
+def _firma_archivo(ruta: str) -> Dict:
+    """Identifica una versión de un archivo sin leerlo (tamaño y fecha de modificación)."""
+    info = os.stat(ruta)
+    return {'tamano': info.st_size, 'mtime': info.st_mtime_ns}
+
+# Partes de Parquet de un archivo: parte-<id del lote>-<nº del archivo en el lote>-<i>.parquet
+_RE_PARTE_ARCHIVO = re.compile(r"parte-(\d{14}-\d{5}-[0-9a-f]{8}-\d{5})-\d+\.parquet")
+
+def _leer_manifiesto(ruta_manifiesto: str) -> Dict[str, Dict]:
+    """
+    Última entrada de cada archivo ya procesado. Una entrada cuenta solo si su
+    lote quedó confirmado (las de manifiestos anteriores a los ids de lote no
+    llevan lote y cuentan siempre); una línea cortada por una interrupción se ignora.
+    """
+    entradas, confirmados = [], set()
+    if os.path.exists(ruta_manifiesto):
+        with open(ruta_manifiesto, encoding='utf-8') as f:
+            for linea in f:
+                try:
+                    entrada = json.loads(linea)
+                except json.JSONDecodeError:
+                    continue
+                if 'lote_confirmado' in entrada:
+                    confirmados.add(entrada['lote_confirmado'])
+                else:
+                    entradas.append(entrada)
+    return {e['archivo']: e for e in entradas if e.get('lote') is None or e['lote'] in confirmados}
+
+def _borrar_partes_sobrantes(salida: str, procesados: Dict[str, Dict]) -> int:
+    """
+    Borra las partes de Parquet que ninguna entrada vigente del manifiesto
+    reclama: las de lotes que no llegaron a confirmarse y las de versiones
+    anteriores de un archivo que se volvió a procesar.
+    """
+    vigentes = {e['parte'] for e in procesados.values() if e.get('parte')}
+    borradas = 0
+    for tabla in ("liquidaciones", "items"):
+        for raiz, _, archivos in os.walk(os.path.join(salida, tabla)):
+            for nombre in archivos:
+                parte = _RE_PARTE_ARCHIVO.fullmatch(nombre)
+                if parte and parte.group(1) not in vigentes:
+                    os.remove(os.path.join(raiz, nombre))
+                    borradas += 1
+    return borradas
+
+def _escribir_parquet_lote(resultados: List[Dict], directorio: str, salida: str, id_lote: str) -> Dict[str, str]:
+    """
+    Escribe un lote de resultados como Parquet particionado por año, con partes
+    propias de cada archivo. Retorna el id de parte de cada archivo con filas.
+    """
+    partes = {}
+    for n_archivo, r in enumerate(resultados):
+        if not r['liquidaciones']:
+            continue
+        archivo = os.path.relpath(r['ruta'], directorio)
+        filas_liq = []
+        for liq in r['liquidaciones']:
+            fila = {c: getattr(liq, c) for c in _COLUMNAS_LIQUIDACION}
+            fila['mensajes_validacion'] = " | ".join(liq.mensajes_validacion or [])
+            fila['archivo'] = archivo
+            filas_liq.append(fila)
+        
+        df_liq = pd.DataFrame(filas_liq)
+        df_liq['anio'] = df_liq['periodo'].str[:4]
+        df_items = construir_tabla_items(r['liquidaciones']).assign(archivo=archivo)
+        df_items['anio'] = df_items['periodo'].str[:4]
         
-        # Tabla mensual
-        st.subheader("Detalle Mensual")
+        # Un nombre de parte por archivo: una nueva versión del archivo reemplaza
+        # sus partes (ver _borrar_partes_sobrantes) sin tocar las de los demás
+        partes[archivo] = f"{id_lote}-{n_archivo:05d}"
+        plantilla = f"parte-{partes[archivo]}-{{i}}.parquet"
+        df_liq.to_parquet(os.path.join(salida, "liquidaciones"), partition_cols=['anio'],
+                          index=False, basename_template=plantilla)
+        df_items.to_parquet(os.path.join(salida, "items"), partition_cols=['anio'],
+                            index=False, basename_template=plantilla)
+    return partes
+
+def procesar_directorio(directorio: str, salida: str, max_workers: Optional[int] = None,
+                        tamano_lote: int = 500) -> Dict:
+    """
+    Procesa todos los PDFs bajo `directorio` con un pool de procesos y escribe
+    Parquet particionado por año en `salida`, más un reporte de validación.
+    Los archivos ya registrados en el manifiesto (mismo tamaño y fecha) se omiten,
+    por lo que un trabajo interrumpido se puede relanzar.
+    
+    Cada lote escribe sus partes de Parquet y después sus entradas del manifiesto,
+    cerradas por una línea que confirma el lote. Si el proceso se corta entre ambas
+    cosas, al relanzarlo se borran las partes del lote sin confirmar y el lote se
+    procesa de nuevo. Un archivo que cambió (p. ej. una reexportación acumulativa)
+    se vuelve a procesar y sus partes anteriores se borran una vez confirmadas las
+    nuevas: el dataset no queda con filas duplicadas.
+    """
+    os.makedirs(salida, exist_ok=True)
+    ruta_manifiesto = os.path.join(salida, MANIFIESTO_LOTE)
+    ruta_reporte = os.path.join(salida, REPORTE_VALIDACION)
+    procesados = _leer_manifiesto(ruta_manifiesto)
+    sobrantes = _borrar_partes_sobrantes(salida, procesados)
+    linea_cortada = False  # Una interrupción pudo dejar la última línea del manifiesto a medias
+    if os.path.exists(ruta_manifiesto) and os.path.getsize(ruta_manifiesto):
+        with open(ruta_manifiesto, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            linea_cortada = f.read(1) != b"\n"
+    if sobrantes:
+        print(f"{sobrantes} partes de Parquet sin confirmar o reemplazadas borradas", file=sys.stderr)
+    
+    pendientes = []
+    omitidos = 0
+    for raiz, _, archivos in os.walk(directorio):
+        for nombre in sorted(archivos):
+            if not nombre.lower().endswith('.pdf'):
+                continue
+            ruta = os.path.join(raiz, nombre)
+            previo = procesados.get(os.path.relpath(ruta, directorio))
+            if previo and previo['firma'] == _firma_archivo(ruta):
+                omitidos += 1
+            else:
+                pendientes.append(ruta)
+    
+    resumen = {'archivos': len(pendientes), 'omitidos': omitidos, 'liquidaciones': 0,
+               'advertencias': 0, 'paginas_fallidas': 0, 'paginas_omitidas': 0, 'errores': 0}
+    workers = max_workers or MAX_WORKERS_EXTRACCION
+    
+    with ProcessPoolExecutor(max_workers=workers, mp_context=contexto_procesos()) as pool, \
+            open(ruta_manifiesto, 'a', encoding='utf-8') as manifiesto, \
+            open(ruta_reporte, 'a', encoding='utf-8') as reporte:
+        if linea_cortada:
+            manifiesto.write("\n")
+        for n_lote, inicio in enumerate(range(0, len(pendientes), tamano_lote)):
+            rutas = pendientes[inicio:inicio + tamano_lote]
+            resultados = list(pool.map(_procesar_archivo, rutas, chunksize=4))
+            
+            # Primero los datos y después el manifiesto: si se corta aquí, las partes
+            # quedan huérfanas (se borran al relanzar) y el lote se repite
+            id_lote = f"{datetime.now():%Y%m%d%H%M%S}-{n_lote:05d}-{uuid.uuid4().hex[:8]}"
+            partes = _escribir_parquet_lote([r for r in resultados if not r['error']], directorio, salida, id_lote)
+            
+            entradas = []
+            for r in resultados:
+                archivo = os.path.relpath(r['ruta'], directorio)
+                if r['error']:
+                    resumen['errores'] += 1
+                    reporte.write(json.dumps({'archivo': archivo, 'error': r['error']}, ensure_ascii=False) + "\n")
+                    continue  # Sin entrada en el manifiesto: se reintenta en la próxima ejecución
+                
+                for pagina in r['paginas_fallidas']:
+                    reporte.write(json.dumps({'archivo': archivo, 'pagina': pagina,
+                                              'error': "No se pudo procesar la página"}, ensure_ascii=False) + "\n")
+                for liq in r['liquidaciones']:
+                    if not (liq.validacion_haberes_ok and liq.validacion_descuentos_ok):
+                        resumen['advertencias'] += 1
+                        reporte.write(json.dumps({'archivo': archivo, 'periodo': liq.periodo,
+                                                  'mensajes': liq.mensajes_validacion}, ensure_ascii=False) + "\n")
+                
+                resumen['liquidaciones'] += len(r['liquidaciones'])
+                resumen['paginas_fallidas'] += len(r['paginas_fallidas'])
+                resumen['paginas_omitidas'] += len(r['paginas_omitidas'])
+                entradas.append({'archivo': archivo, 'firma': _firma_archivo(r['ruta']),
+                                 'liquidaciones': len(r['liquidaciones']), 'lote': id_lote,
+                                 'parte': partes.get(archivo)})
+            
+            reporte.flush()
+            # Entradas del lote y su confirmación en una sola escritura, llevada a disco
+            entradas.append({'lote_confirmado': id_lote})
+            manifiesto.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entradas))
+            manifiesto.flush()
+            os.fsync(manifiesto.fileno())
+            
+            # Ya confirmadas las nuevas partes, las de versiones anteriores sobran
+            reemplazados = [e['archivo'] for e in entradas[:-1] if e['archivo'] in procesados]
+            procesados.update((e['archivo'], e) for e in entradas[:-1])
+            if reemplazados:
+                _borrar_partes_sobrantes(salida, procesados)
+            print(f"{min(inicio + tamano_lote, len(pendientes))}/{len(pendientes)} archivos procesados",
+                  file=sys.stderr)
+    
+    return resumen
+
+def main_lote(argv: Optional[List[str]] = None) -> int:
+    """Punto de entrada de línea de comandos (sin Streamlit)."""
+    parser = argparse.ArgumentParser(
+        description="Procesa un directorio de liquidaciones PDF y genera Parquet particionado por año."
+    )
+    parser.add_argument("directorio", help="Directorio con los PDFs (se recorre recursivamente)")
+    parser.add_argument("--salida", default="dataset_liquidaciones", help="Directorio de salida")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos en paralelo (por defecto, uno por CPU)")
+    parser.add_argument("--lote", type=int, default=500, help="Archivos por escritura de Parquet")
+    args = parser.parse_args(argv)
+    
+    resumen = procesar_directorio(args.directorio, args.salida, args.workers, args.lote)
+    print(json.dumps(resumen, ensure_ascii=False))
+    return 1 if resumen['errores'] else 0
+
+# --- GRÁFICOS ---
+# Las figuras se reducen en el servidor antes de enviarlas: las líneas se submuestrean
+# con LTTB (conserva la forma de la curva), las barras se promedian por tramos y,
+# sobre PUNTOS_WEBGL puntos, las líneas se dibujan con WebGL (Scattergl). Si aun así
+# el JSON pasa de MAX_KB_FIGURA, se reduce el presupuesto de puntos a la mitad.
+PUNTOS_MIN_TRAZA = 50
+
+def indices_lttb(y: np.ndarray, n: int) -> np.ndarray:
+    """
+    Índices de los `n` puntos que elige Largest-Triangle-Three-Buckets sobre una
+    serie de puntos equiespaciados (periodos). Siempre incluye el primero y el último.
+    """
+    m = len(y)
+    if n >= m or n < 3:
+        return np.arange(m)
+    y = np.nan_to_num(np.asarray(y, dtype='float64'))  # Los huecos puntúan como 0
+    x = np.arange(m, dtype='float64')
+    
+    limites = np.linspace(1, m - 1, n - 1).astype('int64')  # n-2 tramos entre los extremos
+    indices = np.empty(n, dtype='int64')
+    indices[0], indices[-1] = 0, m - 1
+    a = 0
+    for i in range(n - 2):
+        inicio, fin = limites[i], limites[i + 1]
+        # Vértice del triángulo: el promedio del tramo siguiente (o el último punto)
+        fin_siguiente = limites[i + 2] if i + 2 < len(limites) else m
+        cx, cy = x[fin:fin_siguiente].mean(), y[fin:fin_siguiente].mean()
+        area = np.abs((x[a] - cx) * (y[inicio:fin] - y[a]) - (x[a] - x[inicio:fin]) * (cy - y[a]))
+        a = inicio + int(area.argmax())
+        indices[i + 1] = a
+    return indices
+
+def promediar_tramos(valores: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Promedio (sin NaN) de `n` tramos consecutivos y el índice donde empieza cada tramo."""
+    valores = np.asarray(valores, dtype='float64')
+    inicios = np.linspace(0, len(valores), n, endpoint=False).astype('int64')
+    validos = ~np.isnan(valores)
+    sumas = np.add.reduceat(np.where(validos, valores, 0.0), inicios)
+    cuentas = np.add.reduceat(validos.astype('int64'), inicios)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sumas / cuentas, inicios
+
+def _reducir_trazas(trazas: List[Dict], presupuesto: int) -> List[Dict]:
+    """Trazas (como dicts de plotly) con a lo más `presupuesto` puntos cada una."""
+    reducidas = []
+    for traza in trazas:
+        traza = dict(traza)
+        x, y = traza.get('x'), traza.get('y')
+        n = 0 if y is None or x is None else len(y)
+        if n > presupuesto and traza['type'] in ('scatter', 'scattergl'):
+            indices = indices_lttb(y, presupuesto)
+            traza['x'], traza['y'] = np.asarray(x)[indices], np.asarray(y)[indices]
+        elif n > presupuesto and traza['type'] == 'bar' and traza.get('orientation') != 'h':
+            # Cada barra pasa a ser el promedio de su tramo, rotulada con su primer periodo
+            traza['y'], inicios = promediar_tramos(y, presupuesto)
+            traza['x'] = np.asarray(x)[inicios]
+        reducidas.append(traza)
+    
+    # Sobre el umbral, las líneas se dibujan con WebGL
+    puntos = sum(len(t['y']) for t in reducidas
+                 if t['type'] in ('scatter', 'scattergl') and t.get('y') is not None)
+    for traza in reducidas:
+        if traza['type'] == 'scatter' and puntos > PUNTOS_WEBGL:
+            traza['type'] = 'scattergl'
+    return reducidas
+
+def ajustar_figura(fig: go.Figure, max_kb: int = MAX_KB_FIGURA) -> go.Figure:
+    """
+    Reduce en el lugar las trazas de `fig` a la resolución visible y las pasa a WebGL
+    cuando son muchas; si el JSON aún supera `max_kb`, achica el presupuesto de puntos.
+    """
+    originales = [traza.to_plotly_json() for traza in fig.data]
+    reducibles = sum(1 for t in originales if t['type'] in ('scatter', 'scattergl', 'bar')) or 1
+    presupuesto = max(PUNTOS_MAX_TRAZA // reducibles, PUNTOS_MIN_TRAZA)
+    while True:
+        fig.data = []
+        fig.add_traces(_reducir_trazas(originales, presupuesto))
+        if presupuesto <= PUNTOS_MIN_TRAZA or len(fig.to_json()) <= max_kb * 1024:
+            return fig
+        presupuesto = max(presupuesto // 2, PUNTOS_MIN_TRAZA)
+
+# --- VISTAS DEL DASHBOARD ---
+# Cada vista se memoriza por la versión de sus datos (y sus filtros): un rerun por
+# interacción reutiliza tablas y figuras mientras los datos no cambien. Lo que se
+# calcula desde las liquidaciones de la sesión usa la huella del dataset (los
+# argumentos con "_" no se hashean; la huella los representa); lo que se lee del
+# almacén compartido usa su version(), que cambia con cualquier escritura, de esta
+# sesión o de otra. Las figuras salen ya reducidas por ajustar_figura, así que lo
+# memorizado es lo que se envía al navegador.
+def huella_dataset(liquidaciones: List[LiquidacionMensual]) -> str:
+    """Huella de contenido del conjunto de liquidaciones."""
+    return hashlib.sha256(pickle.dumps(liquidaciones, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+def actualizar_liquidaciones(liquidaciones: List[LiquidacionMensual]):
+    """Reemplaza las liquidaciones de la sesión y recalcula su huella (una vez por cambio)."""
+    st.session_state.liquidaciones = liquidaciones
+    st.session_state.indice = IndiceLiquidaciones(liquidaciones)
+    st.session_state.huella_datos = huella_dataset(liquidaciones)
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def preparar_tablas(huella: str, _liquidaciones: List[LiquidacionMensual]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Tabla de totales por liquidación y tabla columnar de items."""
+    return construir_tabla_totales(_liquidaciones), construir_tabla_items(_liquidaciones)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def calcular_discrepancias(huella: str, _liquidaciones: List[LiquidacionMensual]) -> pd.DataFrame:
+    """Revalida todo el historial con las reglas actuales, sin releer los PDFs."""
+    return validar_lote(*preparar_tablas(huella, _liquidaciones))
+
+def filtrar_empleado(df: pd.DataFrame, rut: Optional[str]) -> pd.DataFrame:
+    """Filas de un empleado, o todas si `rut` es None (toda la empresa)."""
+    return df if rut is None else df[df['rut'] == rut]
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def calcular_vista_anual(version: str, rut: Optional[str]) -> Dict:
+    """Resumen anual y figuras del tab Anual, de un empleado o de toda la empresa."""
+    df_anual = obtener_almacen().resumen_anual(rut)
+    
+    # Gráfico de barras: Bruto vs Líquido por año
+    fig_anual = go.Figure()
+    fig_anual.add_trace(go.Bar(
+        name='Bruto',
+        x=df_anual['anio'],
+        y=df_anual['bruto'],
+        marker_color='#3b82f6'
+    ))
+    fig_anual.add_trace(go.Bar(
+        name='Líquido',
+        x=df_anual['anio'],
+        y=df_anual['liquido'],
+        marker_color='#10b981'
+    ))
+    fig_anual.update_layout(
+        title="Ingresos Anuales: Bruto vs Líquido",
+        barmode='group',
+        height=400
+    )
+    
+    fig_desc_anual = px.bar(
+        df_anual,
+        x='anio',
+        y=['afp', 'salud', 'impuesto', 'cesantia'],
+        title="Descuentos Legales por Año",
+        labels={'value': 'Monto ($)', 'variable': 'Tipo'},
+        barmode='group'
+    )
+    
+    return {
+        'df_anual': df_anual,
+        'fig_anual': ajustar_figura(fig_anual),
+        'fig_desc_anual': ajustar_figura(fig_desc_anual)
+    }
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def calcular_vista_mensual(version: str, rut: Optional[str], anio: str) -> Dict:
+    """Métricas, KPIs y figuras del tab Mensual para un año (por mes, sumando empleados)."""
+    almacen = obtener_almacen()
+    df_anio = almacen.resumen_mensual(rut, anio)
+    totales_anio = almacen.resumen_anual(rut).set_index('anio').loc[anio]
+    
+    # Evolución mensual
+    fig_mensual = go.Figure()
+    fig_mensual.add_trace(go.Scatter(
+        x=df_anio['mes'],
+        y=df_anio['bruto'],
+        name='Bruto',
+        mode='lines+markers',
+        marker=dict(size=10),
+        line=dict(width=3)
+    ))
+    fig_mensual.add_trace(go.Scatter(
+        x=df_anio['mes'],
+        y=df_anio['liquido'],
+        name='Líquido',
+        mode='lines+markers',
+        marker=dict(size=10),
+        line=dict(width=3)
+    ))
+    fig_mensual.update_layout(
+        title=f"Evolución Mensual {anio}",
+        height=400,
+        hovermode='x unified'
+    )
+    
+    fig_desc_mes = px.bar(
+        df_anio,
+        x='mes',
+        y=['afp', 'salud', 'impuesto', 'cesantia'],
+        title="Descuentos Legales por Mes",
+        barmode='stack'
+    )
+    fig_desc_mes.update_layout(xaxis_tickangle=-45)
+    
+    # Top conceptos de "Otros Descuentos"
+    top_otros = almacen.top_otros_descuentos(rut, anio)
+    fig_otros = None
+    if not top_otros.empty:
+        fig_otros = px.bar(
+            x=top_otros.values,
+            y=top_otros.index,
+            orientation='h',
+            title="Top 5 Otros Descuentos del Año"
+        )
+    
+    return {
+        'df_anio': df_anio,
+        'meses': totales_anio['meses'],
+        'bruto_acumulado': totales_anio['bruto'],
+        'liquido_acumulado': totales_anio['liquido'],
+        'liquido_promedio': totales_anio['liquido'] / totales_anio['meses'],
+        'fig_mensual': ajustar_figura(fig_mensual),
+        'fig_desc_mes': ajustar_figura(fig_desc_mes),
+        'fig_otros': fig_otros
+    }
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def calcular_series(version: str, rut: Optional[str]) -> pd.DataFrame:
+    """Series de tiempo de un empleado o de toda la empresa, una vez por versión del almacén."""
+    return construir_series(obtener_almacen().resumen_mensual(rut))
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def calcular_vista_tendencias(version: str, rut: Optional[str], desde: str, hasta: str) -> Dict:
+    """Figuras del tab Tendencias para un rango de periodos."""
+    series = consultar_series(calcular_series(version, rut), desde, hasta)
+    fechas = series.index.to_timestamp()
+    
+    # Líquido mensual y sus promedios móviles
+    fig_liquido = go.Figure()
+    fig_liquido.add_trace(go.Scatter(
+        x=fechas,
+        y=series['liquido'],
+        name='Líquido',
+        mode='lines+markers',
+        marker=dict(size=6)
+    ))
+    for ventana in VENTANAS_MOVILES:
+        fig_liquido.add_trace(go.Scatter(
+            x=fechas,
+            y=series[f'liquido_media_{ventana}m'],
+            name=f'Promedio {ventana} meses',
+            mode='lines',
+            line=dict(width=3, dash='dot' if ventana < 12 else 'solid')
+        ))
+    fig_liquido.update_layout(title="Líquido y Promedios Móviles", height=400, hovermode='x unified')
+    
+    # Variación interanual (%)
+    fig_yoy = go.Figure()
+    fig_yoy.add_trace(go.Bar(
+        name='Líquido',
+        x=fechas,
+        y=series['liquido_yoy'] * 100,
+        marker_color='#10b981'
+    ))
+    fig_yoy.add_trace(go.Bar(
+        name='Valor Hora Líquido',
+        x=fechas,
+        y=series['valor_hora_liquido_yoy'] * 100,
+        marker_color='#3b82f6'
+    ))
+    fig_yoy.update_layout(
+        title="Variación Interanual (%)",
+        barmode='group',
+        height=400,
+        yaxis_ticksuffix='%'
+    )
+    
+    # Tasa efectiva de descuento
+    fig_tasa = go.Figure()
+    fig_tasa.add_trace(go.Scatter(x=fechas, y=series['tasa_descuento'] * 100, name='Mensual', mode='lines+markers'))
+    fig_tasa.add_trace(go.Scatter(x=fechas, y=series['tasa_descuento_12m'] * 100, name='Últimos 12 meses',
+                                  mode='lines', line=dict(width=3)))
+    fig_tasa.update_layout(title="Tasa Efectiva de Descuento (%)", height=400, yaxis_ticksuffix='%')
+    
+    # Impuesto retenido acumulado
+    fig_impuesto = go.Figure()
+    fig_impuesto.add_trace(go.Scatter(x=fechas, y=series['impuesto_acumulado'], name='Histórico',
+                                      mode='lines', fill='tozeroy'))
+    fig_impuesto.add_trace(go.Scatter(x=fechas, y=series['impuesto_acumulado_anio'], name='En el año',
+                                      mode='lines'))
+    fig_impuesto.update_layout(title="Impuesto Retenido Acumulado", height=400)
+    
+    return {
+        'series': series,
+        'fig_liquido': ajustar_figura(fig_liquido),
+        'fig_yoy': ajustar_figura(fig_yoy),
+        'fig_tasa': ajustar_figura(fig_tasa),
+        'fig_impuesto': ajustar_figura(fig_impuesto)
+    }
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def calcular_vista_detalle(huella: str, rut: str, periodo: str, _liq: LiquidacionMensual) -> Dict:
+    """Tablas y figuras del tab Detalle para una liquidación."""
+    metricas_mes = calcular_metricas_mes(_liq)
+    
+    df_haberes = pd.DataFrame([{
+        'Concepto': h.nombre,
+        'Tipo': 'Afecto' if h.tipo == 'haber_afecto' else 'Exento',
+        'Monto': h.monto
+    } for h in _liq.haberes_items], columns=['Concepto', 'Tipo', 'Monto'])
+    
+    df_descuentos = pd.DataFrame([{
+        'Concepto': d.nombre,
+        'Categoría': d.categoria,
+        'Monto': d.monto
+    } for d in _liq.descuentos_items], columns=['Concepto', 'Categoría', 'Monto'])
+    
+    # Composición de descuentos
+    fig_desc_pie = None
+    if not df_descuentos.empty:
+        desc_por_cat = df_descuentos.groupby('Categoría')['Monto'].sum()
+        fig_desc_pie = px.pie(
+            values=desc_por_cat.values,
+            names=desc_por_cat.index,
+            title="Composición de Descuentos"
+        )
+    
+    # Desglose bruto vs descuentos vs líquido
+    fig_waterfall = go.Figure(go.Waterfall(
+        name="Flujo",
+        orientation="v",
+        measure=["absolute", "relative", "relative", "total"],
+        x=["Bruto", "Desc. Legales", "Otros Desc.", "Líquido"],
+        y=[metricas_mes['bruto'], 
+           -_liq.descuentos_legales_total, 
+           -_liq.otros_descuentos_total,
+           metricas_mes['liquido']],
+        connector={"line": {"color": "rgb(63, 63, 63)"}},
+    ))
+    fig_waterfall.update_layout(title="De Bruto a Líquido", height=400)
+    
+    return {
+        'metricas_mes': metricas_mes,
+        'df_haberes': df_haberes,
+        'df_descuentos': df_descuentos,
+        'fig_desc_pie': fig_desc_pie,
+        'fig_waterfall': fig_waterfall
+    }
+
+# --- INTERFAZ STREAMLIT ---
+def etiqueta_empleado(rut: Optional[str]) -> str:
+    """Texto de un empleado (o de toda la empresa) para selectores y subtítulos."""
+    if rut is None:
+        return "🏢 Toda la empresa"
+    nombre = st.session_state.indice.nombre(rut)
+    return f"👤 {nombre} ({rut})" if es_rut(rut) and nombre != rut else f"👤 {nombre}"
+
+def mostrar_vista_anual(huella: str, rut: Optional[str]):
+    """Dashboard anual: totales por año y descuentos legales."""
+    st.title("📅 Dashboard Anual")
+    st.caption(etiqueta_empleado(rut))
+    
+    vista = calcular_vista_anual(obtener_almacen().version(), rut)
+    df_anual = vista['df_anual']
+    if df_anual.empty:
+        st.info("No hay liquidaciones guardadas")
+        return
+    
+    # KPIs Anuales
+    col1, col2, col3, col4 = st.columns(4)
+    
+    ultimo_anio = df_anual.iloc[-1]
+    col1.metric("Bruto Anual", f"${ultimo_anio['bruto']:,.0f}")
+    col2.metric("Líquido Anual", f"${ultimo_anio['liquido']:,.0f}")
+    col3.metric("Descuentos Totales", f"${ultimo_anio['total_descuentos']:,.0f}")
+    col4.metric("% Descuento", f"{(ultimo_anio['total_descuentos']/ultimo_anio['bruto']*100):.1f}%")
+    
+    st.divider()
+    
+    # Gráfico de barras: Bruto vs Líquido por año
+    st.plotly_chart(vista['fig_anual'], use_container_width=True)
+    
+    # Descuentos anuales
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.plotly_chart(vista['fig_desc_anual'], use_container_width=True)
+    
+    with col2:
+        # Tabla resumen anual
+        st.subheader("Resumen Anual")
         st.dataframe(
-            df_anio[['mes', 'bruto', 'liquido', 'afp', 'salud', 'impuesto', 
-                     'valor_hora_bruto', 'valor_hora_liquido']].style.format({
+            df_anual.style.format({
                 'bruto': '${:,.0f}',
                 'liquido': '${:,.0f}',
                 'afp': '${:,.0f}',
                 'salud': '${:,.0f}',
                 'impuesto': '${:,.0f}',
-                'valor_hora_bruto': '${:,.0f}',
-                'valor_hora_liquido': '${:,.0f}'
+                'total_descuentos': '${:,.0f}'
             }),
-            use_container_width=True
+            use_container_width=True,
+            height=400
         )
+
+def mostrar_vista_mensual(huella: str, rut: Optional[str]):
+    """Dashboard mensual del año seleccionado."""
+    st.title("📆 Dashboard Mensual")
+    st.caption(etiqueta_empleado(rut))
     
-    # --- TAB DETALLE ---
-    with tab_detalle:
-        st.title("📋 Detalle de Liquidaciones")
-        
-        # Selector de mes
-        meses_disponibles = [(liq.periodo, liq.mes_nombre) for liq in st.session_state.liquidaciones]
-        mes_seleccionado = st.selectbox(
-            "Selecciona un mes",
-            meses_disponibles,
-            format_func=lambda x: x[1],
-            index=len(meses_disponibles) - 1
+    # Filtro de año
+    almacen = obtener_almacen()
+    anios_disponibles = list(almacen.resumen_anual(rut)['anio'])
+    if not anios_disponibles:
+        st.info("No hay liquidaciones guardadas")
+        return
+    anio_seleccionado = st.selectbox(
+        "Selecciona el año",
+        anios_disponibles,
+        index=len(anios_disponibles) - 1
+    )
+    
+    vista = calcular_vista_mensual(almacen.version(), rut, anio_seleccionado)
+    df_anio = vista['df_anio']
+    
+    # KPIs del año seleccionado
+    st.subheader(f"Resumen {anio_seleccionado}")
+    col1, col2, col3, col4 = st.columns(4)
+    
+    col1.metric("Bruto Acumulado", f"${vista['bruto_acumulado']:,.0f}")
+    col2.metric("Líquido Acumulado", f"${vista['liquido_acumulado']:,.0f}")
+    col3.metric("Promedio Mensual Líq.", f"${vista['liquido_promedio']:,.0f}")
+    col4.metric("Meses Registrados", vista['meses'])
+    
+    st.divider()
+    
+    # Evolución mensual
+    st.plotly_chart(vista['fig_mensual'], use_container_width=True)
+    
+    # Descuentos mensuales
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.plotly_chart(vista['fig_desc_mes'], use_container_width=True)
+    
+    with col2:
+        # Top conceptos de "Otros Descuentos"
+        st.subheader("Otros Descuentos")
+        if vista['fig_otros'] is not None:
+            st.plotly_chart(vista['fig_otros'], use_container_width=True)
+        else:
+            st.info("No hay otros descuentos en este año")
+    
+    # Tabla mensual (en la vista de empresa, con la cantidad de empleados de cada mes)
+    st.subheader("Detalle Mensual")
+    columnas = ['mes'] + (['empleados'] if rut is None else []) + [
+        'bruto', 'liquido', 'afp', 'salud', 'impuesto', 'valor_hora_bruto', 'valor_hora_liquido'
+    ]
+    st.dataframe(
+        df_anio[columnas].style.format({
+            'bruto': '${:,.0f}',
+            'liquido': '${:,.0f}',
+            'afp': '${:,.0f}',
+            'salud': '${:,.0f}',
+            'impuesto': '${:,.0f}',
+            'valor_hora_bruto': '${:,.0f}',
+            'valor_hora_liquido': '${:,.0f}'
+        }),
+        use_container_width=True
+    )
+
+def mostrar_vista_tendencias(huella: str, rut: Optional[str]):
+    """Dashboard de tendencias: promedios móviles, variación interanual, tasas e impuesto acumulado."""
+    st.title("📈 Tendencias")
+    st.caption(etiqueta_empleado(rut))
+    
+    version = obtener_almacen().version()
+    series = calcular_series(version, rut)
+    if series.empty:
+        st.info("No hay liquidaciones guardadas")
+        return
+    
+    # Rango de periodos (por defecto, todo el historial)
+    periodos = list(series.index.strftime('%Y-%m'))
+    if len(periodos) > 1:
+        desde, hasta = st.select_slider(
+            "Periodo",
+            options=periodos,
+            value=(periodos[0], periodos[-1])
         )
+    else:
+        desde = hasta = periodos[0]
+    
+    vista = calcular_vista_tendencias(version, rut, desde, hasta)
+    ultimo = vista['series'].iloc[-1]
+    
+    # KPIs al cierre del rango
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric(f"Promedio Líquido {VENTANAS_MOVILES[-1]} Meses",
+                f"${ultimo[f'liquido_media_{VENTANAS_MOVILES[-1]}m']:,.0f}")
+    col2.metric("Líquido vs Año Anterior",
+                "—" if pd.isna(ultimo['liquido_yoy']) else f"{ultimo['liquido_yoy'] * 100:+.1f}%")
+    col3.metric("Tasa Descuento 12 Meses",
+                "—" if pd.isna(ultimo['tasa_descuento_12m']) else f"{ultimo['tasa_descuento_12m'] * 100:.1f}%")
+    col4.metric("Impuesto Acumulado en el Año", f"${ultimo['impuesto_acumulado_anio']:,.0f}")
+    
+    st.divider()
+    
+    st.plotly_chart(vista['fig_liquido'], use_container_width=True)
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.plotly_chart(vista['fig_yoy'], use_container_width=True)
+    
+    with col2:
+        st.plotly_chart(vista['fig_tasa'], use_container_width=True)
+    
+    st.plotly_chart(vista['fig_impuesto'], use_container_width=True)
+
+@st.fragment
+def mostrar_vista_detalle(huella: str, rut: Optional[str]):
+    """Fragmento: cambiar el empleado o el mes seleccionado solo vuelve a ejecutar esta función."""
+    st.title("📋 Detalle de Liquidaciones")
+    indice = st.session_state.indice
+    
+    # En la vista de empresa, el detalle es de un empleado a elegir
+    if rut is None:
+        rut = st.selectbox("Selecciona un empleado", indice.empleados(), format_func=etiqueta_empleado)
+    else:
+        st.caption(etiqueta_empleado(rut))
+    
+    # Selector de mes
+    periodos = [liq.periodo for liq in indice.de_empleado(rut)]
+    periodo = st.selectbox(
+        "Selecciona un mes",
+        periodos,
+        format_func=lambda p: indice.obtener(rut, p).mes_nombre,
+        index=len(periodos) - 1
+    )
+    
+    liq = indice.obtener(rut, periodo)
+    vista = calcular_vista_detalle(huella, rut, periodo, liq)
+    metricas_mes = vista['metricas_mes']
+    
+    # KPIs del mes
+    st.subheader(f"Resumen de {liq.mes_nombre}")
+    col1, col2, col3, col4 = st.columns(4)
+    
+    col1.metric("Bruto", f"${metricas_mes['bruto']:,.0f}")
+    col2.metric("Líquido", f"${metricas_mes['liquido']:,.0f}")
+    col3.metric("Valor Hora Bruto", f"${metricas_mes['valor_hora_bruto']:,.0f}")
+    col4.metric("Valor Hora Líquido", f"${metricas_mes['valor_hora_liquido']:,.0f}")
+    
+    if liq.lineas_sin_seccion:
+        with st.expander(f"⚠️ {len(liq.lineas_sin_seccion)} líneas fuera de sección"):
+            for linea in liq.lineas_sin_seccion:
+                st.text(linea)
+    
+    st.divider()
+    
+    # Información laboral
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.subheader("📅 Información Laboral")
+        st.write(f"**Días trabajados:** {liq.dias_trabajados}")
+        st.write(f"**Días licencia:** {liq.dias_licencia}")
+        st.write(f"**Días ausencia:** {liq.dias_ausencia}")
+        st.write(f"**Días vacaciones:** {liq.dias_vacaciones}")
+        st.write(f"**Horas base semanal:** {liq.horas_base_semanal}")
+        st.write(f"**Sueldo base:** ${liq.sueldo_base:,}")
+    
+    with col2:
+        st.subheader("💰 Totales")
+        st.write(f"**Haberes Afectos:** ${liq.haberes_afectos_total:,}")
+        st.write(f"**Haberes Exentos:** ${liq.haberes_exentos_total:,}")
+        st.write(f"**Descuentos Legales:** ${liq.descuentos_legales_total:,}")
+        st.write(f"**Otros Descuentos:** ${liq.otros_descuentos_total:,}")
+        st.write(f"**Total Imponible:** ${liq.total_imponible:,}")
+        st.write(f"**Total Tributable:** ${liq.total_tributable:,}")
+    
+    st.divider()
+    
+    # Detalle de haberes
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.subheader("💵 Haberes")
+        df_haberes = vista['df_haberes']
         
-        liq = next(l for l in st.session_state.liquidaciones if l.periodo == mes_seleccionado[0])
-        metricas_mes = calcular_metricas_mes(liq)
+        if not df_haberes.empty:
+            st.dataframe(
+                df_haberes.style.format({'Monto': '${:,.0f}'}),
+                use_container_width=True,
+                height=300
+            )
+    
+    with col2:
+        st.subheader("💳 Descuentos")
+        df_descuentos = vista['df_descuentos']
         
-        # KPIs del mes
-        st.subheader(f"Resumen de {liq.mes_nombre}")
-        col1, col2, col3, col4 = st.columns(4)
+        if not df_descuentos.empty:
+            st.dataframe(
+                df_descuentos.style.format({'Monto': '${:,.0f}'}),
+                use_container_width=True,
+                height=300
+            )
+    
+    # Gráfico de composición
+    st.divider()
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        # Composición de descuentos
+        if vista['fig_desc_pie'] is not None:
+            st.plotly_chart(vista['fig_desc_pie'], use_container_width=True)
+    
+    with col2:
+        # Desglose bruto vs descuentos vs líquido
+        st.plotly_chart(vista['fig_waterfall'], use_container_width=True)
+
+VISTAS_DASHBOARD = {
+    "📅 Anual": mostrar_vista_anual,
+    "📆 Mensual": mostrar_vista_mensual,
+    "📈 Tendencias": mostrar_vista_tendencias,
+    "📋 Detalle": mostrar_vista_detalle,
+}
+
+@st.fragment(run_every=INTERVALO_PROGRESO_S)
+def mostrar_progreso_trabajos():
+    """
+    Fragmento que se refresca solo mientras haya ingestas pendientes enviadas por
+    esta sesión. Al terminar alguna, recarga las liquidaciones y rehace la página;
+    los trabajos de un lote se aplican juntos, cuando el lote entero está guardado.
+    """
+    pendientes = st.session_state.trabajos_pendientes
+    
+    for trabajo in pendientes:
+        progreso = trabajo.progreso()
+        if trabajo.terminado:
+            continue
+        if progreso['estado'] == 'en_cola':
+            st.progress(0.0, text=f"{progreso['nombre']}: en cola")
+            continue
         
-        col1.metric("Bruto", f"${metricas_mes['bruto']:,.0f}")
-        col2.metric("Líquido", f"${metricas_mes['liquido']:,.0f}")
-        col3.metric("Valor Hora Bruto", f"${metricas_mes['valor_hora_bruto']:,.0f}")
-        col4.metric("Valor Hora Líquido", f"${metricas_mes['valor_hora_liquido']:,.0f}")
+        texto = f"{progreso['nombre']}: {progreso['paginas_hechas']}/{progreso['paginas_total']} págs"
+        if progreso['paginas_por_segundo']:
+            texto += f" · {progreso['paginas_por_segundo']:.1f} págs/s"
+        if progreso['eta_s'] is not None:
+            texto += f" · faltan ~{progreso['eta_s']:.0f} s"
+        st.progress(progreso['fraccion'], text=texto)
+    
+    terminados = [t for t in pendientes if t.terminado and (t.lote is None or t.lote.terminado)]
+    if terminados:
+        st.session_state.trabajos_pendientes = [t for t in pendientes if t not in terminados]
+        st.session_state.resultados_ingesta = [t.progreso() for t in terminados]
+        lotes = list(dict.fromkeys(t.lote for t in terminados if t.lote))
+        st.session_state.resultados_lotes = [lote.resumen() for lote in lotes]
+        st.session_state.diagnostico_ingesta = terminados[-1].diagnostico
+        if any(t.liquidaciones for t in terminados):
+            actualizar_liquidaciones(obtener_almacen().cargar())
+        st.rerun()
+
+def listar_paginas(paginas: List[int], maximo: int = 20) -> str:
+    """Lista compacta de números de página para los resúmenes de ingesta."""
+    return ", ".join(map(str, paginas[:maximo])) + (" …" if len(paginas) > maximo else "")
+
+def mostrar_diagnostico():
+    """Expander del sidebar con los tiempos de la última ingesta y del último render."""
+    ingesta = st.session_state.get('diagnostico_ingesta')
+    render = st.session_state.get('diagnostico_render')
+    if not (ingesta or render):
+        return
+    clasificador = obtener_clasificador().estadisticas()
+    
+    with st.sidebar.expander("🩺 Diagnóstico"):
+        if ingesta:
+            st.caption("Última ingesta")
+            col1, col2 = st.columns(2)
+            col1.metric("Total", f"{ingesta['total_s']:.2f} s")
+            col2.metric("Págs/seg", f"{ingesta['paginas_por_segundo'] or 0:.1f}")
+            if ingesta['memoria_pico_mb'] is not None:
+                st.caption(f"Memoria pico: {ingesta['memoria_pico_mb']:.0f} MB")
+            st.json(ingesta, expanded=False)
+        if render:
+            st.caption("Último render")
+            st.json(render, expanded=False)
+        if clasificador['hits'] or clasificador['misses']:
+            # Los workers memorizan por su cuenta: esto cubre lo clasificado en este proceso
+            st.caption(f"Clasificador de descuentos: {clasificador['nombres_distintos']} conceptos, "
+                       f"{clasificador['tasa_aciertos']:.1%} de aciertos")
+            st.json(clasificador, expanded=False)
+
+def main():
+    st.set_page_config(
+        page_title="Gestión Salarial USM PRO", 
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    
+    almacen = obtener_almacen()
+    gestor = obtener_gestor_trabajos()
+    
+    # Estado de sesión (se hidrata desde el almacén al abrir la sesión)
+    if 'trabajos_pendientes' not in st.session_state:
+        # Solo los trabajos que envió esta sesión: los de otros usuarios no se siguen
+        st.session_state.trabajos_pendientes = []
+    if 'liquidaciones' not in st.session_state:
+        actualizar_liquidaciones(almacen.cargar())
+    
+    # SIDEBAR: Carga de datos
+    empleado = None
+    with st.sidebar:
+        st.header("📥 Carga de Liquidaciones")
         
-        st.divider()
+        archivos = st.file_uploader(
+            "Sube tus PDFs (multi-página)", 
+            type="pdf",
+            accept_multiple_files=True,
+            help="Cada página debe contener una liquidación mensual. Si un mismo mes "
+                 "aparece en varios archivos, se usa el último en el orden de carga."
+        )
         
-        # Información laboral
-        col1, col2 = st.columns(2)
+        if st.button("📊 Procesar PDF", type="primary"):
+            if len(archivos) == 1:
+                st.session_state.trabajos_pendientes.append(gestor.enviar(archivos[0], archivos[0].name))
+            elif archivos:
+                lote = gestor.enviar_lote([(archivo, archivo.name) for archivo in archivos])
+                st.session_state.trabajos_pendientes.extend(lote.trabajos)
         
-        with col1:
-            st.subheader("📅 Información Laboral")
-            st.write(f"**Días trabajados:** {liq.dias_trabajados}")
-            st.write(f"**Días licencia:** {liq.dias_licencia}")
-            st.write(f"**Días ausencia:** {liq.dias_ausencia}")
-            st.write(f"**Días vacaciones:** {liq.dias_vacaciones}")
-            st.write(f"**Horas base semanal:** {liq.horas_base_semanal}")
-            st.write(f"**Sueldo base:** ${liq.sueldo_base:,}")
+        # Avance de las ingestas de esta sesión (solo se refresca mientras haya alguna)
+        if st.session_state.trabajos_pendientes:
+            mostrar_progreso_trabajos()
         
-        with col2:
-            st.subheader("💰 Totales")
-            st.write(f"**Haberes Afectos:** ${liq.haberes_afectos_total:,}")
-            st.write(f"**Haberes Exentos:** ${liq.haberes_exentos_total:,}")
-            st.write(f"**Descuentos Legales:** ${liq.descuentos_legales_total:,}")
-            st.write(f"**Otros Descuentos:** ${liq.otros_descuentos_total:,}")
-            st.write(f"**Total Imponible:** ${liq.total_imponible:,}")
-            st.write(f"**Total Tributable:** ${liq.total_tributable:,}")
+        for resultado in st.session_state.get('resultados_ingesta', []):
+            if resultado['estado'] == 'error':
+                st.error(f"❌ {resultado['nombre']}: {resultado['error']}")
+                continue
+            st.success(f"✅ {resultado['nombre']}: {resultado['liquidaciones']} liquidaciones procesadas")
+            st.caption(f"Páginas: {resultado['paginas_nuevas']} nuevas · {resultado['paginas_modificadas']} "
+                       f"modificadas · {resultado['paginas_sin_cambios']} sin cambios")
+            if resultado['paginas_omitidas']:
+                st.info(f"{len(resultado['paginas_omitidas'])} páginas sin cabecera de liquidación omitidas "
+                        f"(portadas, anexos, firmas): {listar_paginas(resultado['paginas_omitidas'])}")
+            if resultado['paginas_fallidas']:
+                st.warning(f"No se pudieron procesar {len(resultado['paginas_fallidas'])} páginas: "
+                           f"{listar_paginas(resultado['paginas_fallidas'])}")
         
-        st.divider()
+        for lote in st.session_state.get('resultados_lotes', []):
+            if lote['duplicados']:
+                st.info(f"{len(lote['duplicados'])} archivos idénticos a otro del lote se procesaron una vez: "
+                        + ", ".join(f"{nombre} (= {original})" for nombre, original in lote['duplicados'].items()))
+            if lote['conflictos']:
+                st.warning(f"⚠️ {len(lote['conflictos'])} meses aparecen distintos en más de un archivo: "
+                           f"se usó el último en el orden de carga")
+                with st.expander("Ver conflictos"):
+                    st.dataframe(pd.DataFrame(lote['conflictos']), hide_index=True)
         
-        # Detalle de haberes
-        col1, col2 = st.columns(2)
+        stats_cache = obtener_cache_pdf().estadisticas()
+        if stats_cache['hits'] or stats_cache['misses']:
+            st.caption(
+                f"Caché: {stats_cache['entradas']} PDFs · {stats_cache['bytes'] / 1024 / 1024:.1f} MB · "
+                f"{stats_cache['hits']} aciertos / {stats_cache['misses']} fallos"
+            )
         
-        with col1:
-            st.subheader("💵 Haberes")
-            haberes_data = [{
-                'Concepto': h.nombre,
-                'Tipo': 'Afecto' if h.tipo == 'haber_afecto' else 'Exento',
-                'Monto': h.monto
-            } for h in liq.haberes_items]
+        if st.session_state.liquidaciones:
+            st.divider()
+            st.metric("Total Liquidaciones", len(st.session_state.liquidaciones))
             
-            if haberes_data:
-                df_haberes = pd.DataFrame(haberes_data)
-                st.dataframe(
-                    df_haberes.style.format({'Monto': '${:,.0f}'}),
-                    use_container_width=True,
-                    height=300
+            # Selector de empleado (None = toda la empresa)
+            indice = st.session_state.indice
+            empleados = indice.empleados()
+            if len(empleados) > 1:
+                st.metric("Empleados", len(empleados))
+                empleado = st.selectbox(
+                    "👤 Empleado", [None] + empleados,
+                    format_func=etiqueta_empleado, key="empleado"
                 )
-        
-        with col2:
-            st.subheader("💳 Descuentos")
-            descuentos_data = [{
-                'Concepto': d.nombre,
-                'Categoría': d.categoria,
-                'Monto': d.monto
-            } for d in liq.descuentos_items]
+            else:
+                empleado = empleados[0]
             
-            if descuentos_data:
-                df_descuentos = pd.DataFrame(descuentos_data)
-                st.dataframe(
-                    df_descuentos.style.format({'Monto': '${:,.0f}'}),
-                    use_container_width=True,
-                    height=300
-                )
-        
-        # Gráfico de composición
-        st.divider()
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            # Composición de descuentos
-            desc_por_cat = df_descuentos.groupby('Categoría')['Monto'].sum()
-            fig_desc_pie = px.pie(
-                values=desc_por_cat.values,
-                names=desc_por_cat.index,
-                title="Composición de Descuentos"
+            # Mostrar validaciones (recalculadas sobre todo el historial con las reglas actuales)
+            discrepancias = filtrar_empleado(
+                calcular_discrepancias(st.session_state.huella_datos, st.session_state.liquidaciones),
+                empleado
             )
-            st.plotly_chart(fig_desc_pie, use_container_width=True)
+            
+            if not discrepancias.empty:
+                n_con_advertencias = len(discrepancias.drop_duplicates(['rut', 'periodo']))
+                st.warning(f"⚠️ {n_con_advertencias} con advertencias")
+                with st.expander("Ver detalles"):
+                    tabla = discrepancias.drop(columns='rut')
+                    if empleado is None:
+                        tabla.insert(0, 'empleado', discrepancias['rut'].map(indice.nombre))
+                    st.dataframe(
+                        tabla.style.format({
+                            'calculado': '${:,.0f}',
+                            'declarado': '${:,.0f}',
+                            'diferencia': '${:,.0f}'
+                        }),
+                        hide_index=True
+                    )
+            
+            # Borrado con confirmación: las liquidaciones del empleado seleccionado, o
+            # todo el almacén (de todos los usuarios) si el servidor lo permite
+            if empleado is not None or PERMITIR_BORRAR_TODO:
+                with st.popover("🗑️ Eliminar datos"):
+                    if empleado is not None:
+                        claves = [liq.clave for liq in indice.de_empleado(empleado)]
+                        st.warning(f"Se eliminarán {len(claves)} liquidaciones de {etiqueta_empleado(empleado)} "
+                                   f"del almacén compartido, también para los demás usuarios.")
+                    else:
+                        claves = None
+                        st.warning("Se eliminarán todas las liquidaciones del almacén, de todos los "
+                                   "empleados y para todos los usuarios.")
+                    if st.button("Confirmar eliminación", type="primary"):
+                        if claves is None:
+                            almacen.eliminar_todo()
+                        else:
+                            almacen.eliminar(claves)
+                        actualizar_liquidaciones(almacen.cargar())
+                        st.session_state.resultados_ingesta = []
+                        st.session_state.resultados_lotes = []
+                        st.session_state.pop('empleado', None)
+                        st.rerun()
+    
+    # MAIN CONTENT
+    if not st.session_state.liquidaciones:
+        st.title("📊 Gestión Salarial USM PRO")
+        st.info("👈 Sube un PDF desde el panel lateral para comenzar")
         
-        with col2:
-            # Desglose bruto vs descuentos vs líquido
-            fig_waterfall = go.Figure(go.Waterfall(
-                name="Flujo",
-                orientation="v",
-                measure=["absolute", "relative", "relative", "total"],
-                x=["Bruto", "Desc. Legales", "Otros Desc.", "Líquido"],
-                y=[metricas_mes['bruto'], 
-                   -liq.descuentos_legales_total, 
-                   -liq.otros_descuentos_total,
-                   metricas_mes['liquido']],
-                connector={"line": {"color": "rgb(63, 63, 63)"}},
-            ))
-            fig_waterfall.update_layout(title="De Bruto a Líquido", height=400)
-            st.plotly_chart(fig_waterfall, use_container_width=True)
+        st.markdown("""
+        ### Características:
+        - ✅ Extracción automática de liquidaciones
+        - ✅ Validación de totales
+        - ✅ Dashboard anual y mensual
+        - ✅ Tendencias: promedios móviles y variación interanual
+        - ✅ Análisis de descuentos
+        - ✅ Valor hora bruto y líquido
+        """)
+        mostrar_diagnostico()
+        return
+    
+    registro_render = RegistroTiempos('render')
+    huella = st.session_state.huella_datos
+    
+    # Selector de vista: a diferencia de st.tabs, solo se calcula y dibuja la vista activa
+    vista_activa = st.radio(
+        "Vista",
+        list(VISTAS_DASHBOARD),
+        horizontal=True,
+        label_visibility="collapsed",
+        key="vista_activa"
+    )
+    with registro_render.etapa(VISTAS_DASHBOARD[vista_activa].__name__):
+        VISTAS_DASHBOARD[vista_activa](huella, empleado)
+    
+    st.session_state.diagnostico_render = registro_render.emitir_log()
+    mostrar_diagnostico()
 
 if __name__ == "__main__":
-    main()
+    # `streamlit run untitled0.py` levanta la app; `python untitled0.py <dir>` procesa por lotes
+    if st.runtime.exists():
+        main()
+    else:
+        sys.exit(main_lote())